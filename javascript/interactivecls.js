@@ -761,6 +761,7 @@ commands sent to the python subprocess (enclosed with < >):
 <startcamera>           : starts the camera loop (call this after <trigger,1>)
 <quit>                  : exit python (close cameras) (call startcamera first)
 <startsave>             : start saving data in default save directory (call startcamera first)
+<savebuffer,2>          : like startsave, starting 2 s before the command (frames kept in memory)
 <stopsave>              : stop saving data (call startsave first)
 <gain,20>               : sets the gain to 20 (choose a value between 0 and 45).
 <setdir,absolutepath>   : set the default save directory
@@ -806,7 +807,7 @@ function run_arduino_command(){
 //same as prev function but in python
 function run_python_command(){
   var mypython=new MyInput({
-    message: "Python command(arrows:history, '-q':quit, '-m' :messages, '-h':help):",
+    message: "Python command(arrows:history, '-q':quit, '-m' :messages, '-s' :well stats, '-h':help):",
     initial: 'startpython',
     history: {
       store: new Store({ path: `python_history.json` }),
@@ -822,6 +823,8 @@ function run_python_command(){
         else
         if (answer=="-m"){console.log( python_text_out);run_python_command();}
         else
+        if (answer=="-s"){show_well_stats();run_python_command();}
+        else
         if (answer!="-q") {send_python(answer); run_python_command();}
 
         else{
@@ -1111,6 +1114,7 @@ var reader;
 var python_initialized=0
 var show_output_from_python=1
 var python_text_out=[]
+var well_stats=null //latest py.json wellstats report (per-well mean, min/max, saturation, histogram)
 async function run_python(){
   console.log("trying to run python vimba_rap3.py\n")
   const spawn = require("child_process").spawn;
@@ -1137,6 +1141,14 @@ async function run_python(){
       input: python.stdout,
     })
     for await(const line of reader) {
+      if (line.startsWith("py.json ")){
+        try {
+          const message=JSON.parse(line.slice(8));
+          if (message.type=="wellstats") well_stats=message;
+        } catch (error) {
+          console.error("bad py.json line from python: "+error);
+        }
+      }
       if (show_output_from_python==1){
        if (line.includes("py. ")){
 
@@ -1172,6 +1184,21 @@ async function run_python(){
 
  */
 
+//prints the latest per-well statistics from python, one row per well
+function show_well_stats(){
+  if (well_stats==null){
+    console.log("no well statistics yet (start the camera first)");
+    return;
+  }
+  const rows=[];
+  for (var w=0;w<well_stats.wells;w++){
+    if (well_stats.mean[w]==null) continue;
+    rows.push({well:w, frames:well_stats.frames[w], mean:well_stats.mean[w], min:well_stats.min[w],
+      max:well_stats.max[w], "saturated %":(well_stats.saturated[w]*100).toFixed(2)});
+  }
+  console.table(rows);
+}
+
 //send get command to python file
  async function python_get_frames(){
   python.stdin.write(`get\n`);
@@ -0,0 +1,376 @@
+"""Throughput and latency benchmark for the vimba_rap3 acquisition loop.
+
+Drives vimba_rap3.Handler -> well demux / phase lock -> maybesaveimage / maybeshowimage
+with frames from the simulated camera (rap_simcam) at 1, 6 and 24 wells, in save-only,
+display-only and save+display modes, and reports sustained fps, frame latency (callback -> loop done),
+time spent in the camera callback (how long each camera buffer is held), peak queue depth
+and RSS.
+
+Usage:
+    python python/rap_bench.py                      run the default matrix
+    python python/rap_bench.py --save-baseline      ... and store the results as the baseline
+    python python/rap_bench.py --compare            ... and fail (exit 1) on a regression
+    python python/rap_bench.py --find-max           search for the highest sustainable frame rate
+
+Display runs in its own thread (rap_display) as in vimba_rap3; display_fps and
+display_skipped report what it showed and skipped. Without --gui the display step goes
+to a headless sink (no OpenCV window), so display numbers measure the loop overhead
+only; run with --gui on the rig to include imshow.
+
+--pixel-format=Mono12 makes the simulated camera stream frames that need converting to
+Mono8; compare the callback times with --converters=0 (conversion in the callback) and
+the default converter threads (rap_convert).
+"""
+
+import argparse
+import functools
+import gc
+import json
+import os
+import platform
+import shutil
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+import numpy as np
+
+import vimba_rap3
+from rap_simcam import SimCamera
+from rap_writer import WriterPool
+from rap_demux import WellDemux, WellQueues
+from rap_phaselock import PhaseLock
+from rap_display import DisplayThread
+
+try:
+    import resource
+except ImportError:  # Windows
+    resource = None
+
+
+DEFAULT_WELLS = (1, 6, 24)
+DEFAULT_MODES = ("save", "display", "save+display")
+DEFAULT_BASELINE = Path(__file__).with_name("rap_bench_baseline.json")
+
+# a case regresses if fps drops or p99 latency grows by more than these fractions
+FPS_TOLERANCE = 0.10
+LATENCY_TOLERANCE = 0.50
+
+
+# stands in for cv2 when there is no display: imwrite is real, window calls do nothing
+class HeadlessCV2:
+    WINDOW_NORMAL = 0
+
+    def __init__(self, cv2):
+        self.imwrite = cv2.imwrite
+        self.shown = 0
+
+    def namedWindow(self, *args):
+        pass
+
+    def moveWindow(self, *args):
+        pass
+
+    def destroyAllWindows(self):
+        pass
+
+    def imshow(self, title, img):
+        self.shown += 1
+
+    def waitKey(self, delay):
+        return -1
+
+
+# wraps a Handler to record when each frame entered the callback and how long it was held
+class TimedHandler:
+    def __init__(self, handler):
+        self.handler = handler
+        self.t_in = {}
+        self.held = []
+
+    def __call__(self, cam, stream, frame):
+        t0 = time.perf_counter()
+        self.t_in[self.handler.frnum + 1] = t0
+        self.handler(cam, stream, frame)
+        self.held.append(time.perf_counter() - t0)
+
+
+def rss_mb():
+    try:
+        with open('/proc/self/statm') as f:
+            return int(f.read().split()[1]) * os.sysconf('SC_PAGE_SIZE') / 2**20
+    except (OSError, ValueError, AttributeError):
+        if resource is not None:
+            return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+        return float('nan')
+
+
+def percentile_ms(values, q):
+    if not values:
+        return float('nan')
+    return float(np.percentile(values, q)) * 1000
+
+
+# runs one (wells, mode, fps) case for the given number of seconds and returns its stats
+# (cv replaces the OpenCV module, e.g. with a test double; writers=0 saves inline like before the writer pool)
+# (display_fps caps the display thread like --display-fps, default vimba_rap3.display_fps)
+# (pixel_format is the simulated camera's format; converters=0 converts in the callback, default vimba_rap3.convert_threads)
+def run_case(wells, mode, fps=100.0, seconds=5.0, gui=False, save_dir=None, cv=None, writers=None,
+             display_fps=None, pixel_format="Mono8", converters=None):
+    if cv is None:
+        import cv2
+        cv = cv2 if gui else HeadlessCV2(cv2)
+    save = "save" in mode
+    display = "display" in mode
+    gc.collect()  # whatever the previous case left behind is not counted in this one's rss
+
+    saved_globals = {name: getattr(vimba_rap3, name) for name in
+                     ("SAVETOGGLE", "savedframes", "save_max", "number_of_wells", "writer",
+                      "mode", "mosaic", "display_wells", "preview")}
+    cwd = os.getcwd()
+    tmp_dir = None
+    if save:
+        if save_dir is None:
+            save_dir = tmp_dir = tempfile.mkdtemp(prefix="rap_bench_")
+        os.chdir(save_dir)
+
+    cam = SimCamera(fps=fps, wells=wells, pixel_format=vimba_rap3.PixelFormat[pixel_format])
+    handler = vimba_rap3.Handler(cv)
+    handler.verbose = 0
+    if converters is None:
+        converters = vimba_rap3.convert_threads
+    handler.start_converting(cam.get_pixel_format(), converters)
+    timed = TimedHandler(handler)
+    vimba_rap3.number_of_wells = wells
+    vimba_rap3.SAVETOGGLE = 1 if save else 0
+    vimba_rap3.savedframes = 0
+    vimba_rap3.save_max = sys.maxsize
+    if writers is None:
+        writers = vimba_rap3.writer_threads
+    pool = vimba_rap3.writer = WriterPool(functools.partial(vimba_rap3.write_saved_frame, cv), workers=writers,
+                                          max_queued=vimba_rap3.writer_queue) if writers > 0 else None
+    vimba_rap3.mode = 1 if gui else 0  # mode 1: the display thread sets up one window per well
+    vimba_rap3.mosaic = None
+    vimba_rap3.display_wells = None
+    vimba_rap3.preview = None
+    demux = WellDemux(wells)
+    phase_lock = PhaseLock(wells)
+    queues = WellQueues(wells)
+    save_queue = queues.subscribe("save")
+    show_queue = queues.subscribe("display", maxlen=1)
+    if display_fps is None:
+        display_fps = vimba_rap3.display_fps
+    display_thread = None
+    if display:
+        keypress = (lambda: vimba_rap3.checkkeypress(cv, handler.frnum)) if gui else None
+        display_thread = DisplayThread(show_queue, functools.partial(vimba_rap3.show_frames, cv),
+                                       keypress=keypress, max_fps=display_fps).start()
+
+    latencies = []
+    peak_queue = 0
+    peak_rss = rss_mb()
+    processed = 0
+    try:
+        cam.start_streaming(handler=timed, buffer_count=10)
+        t_start = time.perf_counter()
+        t_end = t_start + seconds
+        while (time.perf_counter() < t_end or not handler.display_queue.empty()
+               or (handler.converter is not None and handler.converter.pending())):
+            if time.perf_counter() >= t_end and cam.is_streaming():
+                cam.stop_streaming()
+                continue
+            frame, cnum = handler.get_image()
+            rnum = frame.num
+            peak_queue = max(peak_queue, handler.display_queue.qsize() + 1)
+            demux.route(frame)
+            phase_lock.observe(frame, demux)
+            queues.publish(frame)
+            frame.release()
+            for f in save_queue.drain():
+                vimba_rap3.maybesaveimage(cv, f.image, f.num, f, well=f.well)
+                f.release()
+            latencies.append(time.perf_counter() - timed.t_in.pop(rnum))
+            processed += 1
+            if processed % 100 == 0:
+                peak_rss = max(peak_rss, rss_mb())
+        elapsed = time.perf_counter() - t_start
+        if pool is not None:
+            pool.flush()
+        flush_s = time.perf_counter() - t_start - elapsed
+    finally:
+        cam.stop_streaming()
+        handler.stop_converting()
+        if display_thread is not None:
+            display_thread.stop()
+        queues.unsubscribe("save")
+        queues.unsubscribe("display")
+        if pool is not None:
+            pool.close()
+        for name, value in saved_globals.items():
+            setattr(vimba_rap3, name, value)
+        os.chdir(cwd)
+        if tmp_dir is not None:
+            shutil.rmtree(tmp_dir, ignore_errors=True)
+        if display and gui:
+            cv.destroyAllWindows()
+
+    name = "wells={} mode={} target_fps={:g}".format(wells, mode, fps)
+    if pixel_format != "Mono8":
+        name += " format={} converters={}".format(pixel_format, converters)
+    return {
+        "name": name,
+        "wells": wells,
+        "mode": mode,
+        "target_fps": fps,
+        "frames": processed,
+        "fps": processed / elapsed if elapsed > 0 else 0.0,
+        "latency_p50_ms": percentile_ms(latencies, 50),
+        "latency_p99_ms": percentile_ms(latencies, 99),
+        "callback_p50_ms": percentile_ms(timed.held, 50),
+        "callback_p99_ms": percentile_ms(timed.held, 99),
+        "peak_queue": peak_queue,
+        "queue_size": handler.display_queue.maxsize,
+        "lost_frames": cam.frames_no_buffer,
+        "writers": writers,
+        "pixel_format": pixel_format,
+        "converters": converters,
+        "flush_s": flush_s,
+        "rss_mb": peak_rss,
+        "display_fps": display_thread.frames_shown / elapsed if display_thread and elapsed > 0 else 0.0,
+        "display_skipped": display_thread.frames_skipped if display_thread else 0,
+    }
+
+
+# a case is sustained if it kept up with the camera without losing frames or backing up the queue
+def sustained(result):
+    return (result["fps"] >= 0.95 * result["target_fps"] and result["lost_frames"] == 0
+            and result["peak_queue"] < result["queue_size"] // 2)
+
+
+# doubles the frame rate until the loop stops keeping up; returns the last sustained result
+def find_max(wells, mode, start_fps=50.0, max_fps=3200.0, seconds=3.0, gui=False, writers=None,
+             pixel_format="Mono8", converters=None):
+    best = None
+    fps = start_fps
+    while fps <= max_fps:
+        result = run_case(wells, mode, fps=fps, seconds=seconds, gui=gui, writers=writers,
+                          pixel_format=pixel_format, converters=converters)
+        if not sustained(result):
+            break
+        best = result
+        fps *= 2
+    return best
+
+
+COLUMNS = (("Name", "name", "{}"), ("fps", "fps", "{:.1f}"),
+           ("p50 (ms)", "latency_p50_ms", "{:.3f}"), ("p99 (ms)", "latency_p99_ms", "{:.3f}"),
+           ("cb p50 (ms)", "callback_p50_ms", "{:.3f}"), ("cb p99 (ms)", "callback_p99_ms", "{:.3f}"), ("peak queue", "peak_queue", "{}"),
+           ("lost", "lost_frames", "{}"), ("flush (s)", "flush_s", "{:.2f}"), ("RSS (MB)", "rss_mb", "{:.1f}"))
+
+
+# prints results as a table in the style of pytest-benchmark
+def print_table(results, title="benchmark"):
+    rows = [[fmt.format(r[key]) for _, key, fmt in COLUMNS] for r in results]
+    widths = [max([len(head)] + [len(row[i]) for row in rows]) for i, (head, _, _) in enumerate(COLUMNS)]
+    header = "  ".join(head.ljust(w) if i == 0 else head.rjust(w)
+                       for i, ((head, _, _), w) in enumerate(zip(COLUMNS, widths)))
+    print("-" * len(header) + " {}: {} tests ".format(title, len(results)) + "-" * 10)
+    print(header)
+    print("-" * len(header))
+    for row in rows:
+        print("  ".join(cell.ljust(w) if i == 0 else cell.rjust(w)
+                        for i, (cell, w) in enumerate(zip(row, widths))))
+    print("-" * len(header))
+
+
+def machine_info():
+    return {"node": platform.node(), "system": platform.system(), "machine": platform.machine(),
+            "python": platform.python_version(), "numpy": np.__version__}
+
+
+def save_baseline(results, path):
+    data = {"machine_info": machine_info(), "datetime": time.strftime("%Y-%m-%dT%H:%M:%S"),
+            "benchmarks": results}
+    Path(path).write_text(json.dumps(data, indent=2))
+
+
+# returns a list of human-readable regressions against the stored baseline
+def compare_to_baseline(results, path):
+    data = json.loads(Path(path).read_text())
+    if data.get("machine_info", {}).get("node") != platform.node():
+        print("warning: baseline was recorded on {}, not this machine".format(
+            data.get("machine_info", {}).get("node")))
+    baseline = {b["name"]: b for b in data["benchmarks"]}
+    regressions = []
+    for r in results:
+        b = baseline.get(r["name"])
+        if b is None:
+            continue
+        if r["fps"] < b["fps"] * (1 - FPS_TOLERANCE):
+            regressions.append("{}: fps {:.1f} < baseline {:.1f}".format(r["name"], r["fps"], b["fps"]))
+        if r["latency_p99_ms"] > b["latency_p99_ms"] * (1 + LATENCY_TOLERANCE):
+            regressions.append("{}: p99 {:.3f} ms > baseline {:.3f} ms".format(
+                r["name"], r["latency_p99_ms"], b["latency_p99_ms"]))
+        if r["lost_frames"] > b["lost_frames"]:
+            regressions.append("{}: lost {} frames, baseline lost {}".format(
+                r["name"], r["lost_frames"], b["lost_frames"]))
+    return regressions
+
+
+def parse_bench_args(argv=None):
+    p = argparse.ArgumentParser(description="Benchmark the vimba_rap3 acquisition loop with a simulated camera.")
+    p.add_argument("--wells", type=int, nargs="+", default=list(DEFAULT_WELLS))
+    p.add_argument("--modes", nargs="+", choices=DEFAULT_MODES, default=list(DEFAULT_MODES))
+    p.add_argument("--fps", type=float, default=100.0, help="simulated camera frame rate")
+    p.add_argument("--seconds", type=float, default=5.0, help="duration of each case")
+    p.add_argument("--gui", action="store_true", help="show frames in real OpenCV windows")
+    p.add_argument("--writers", type=int, default=None,
+                   help="background writer threads (default as vimba_rap3, 0 = write inline)")
+    p.add_argument("--pixel-format", default="Mono8", choices=("Mono8", "Mono10", "Mono12", "Mono16"),
+                   help="pixel format of the simulated camera (non-Mono8 frames need converting)")
+    p.add_argument("--converters", type=int, default=None,
+                   help="threads converting frames off the callback (default as vimba_rap3, 0 = in the callback)")
+    p.add_argument("--find-max", action="store_true", help="search for the highest sustained frame rate")
+    p.add_argument("--baseline", default=str(DEFAULT_BASELINE), help="baseline json file")
+    p.add_argument("--save-baseline", action="store_true", help="store these results as the baseline")
+    p.add_argument("--compare", action="store_true", help="exit 1 if any case regresses against the baseline")
+    p.add_argument("--json", help="also write the results to this json file")
+    return p.parse_args(argv)
+
+
+def main(argv=None):
+    args = parse_bench_args(argv)
+    results = []
+    for wells in args.wells:
+        for mode in args.modes:
+            if args.find_max:
+                result = find_max(wells, mode, start_fps=args.fps, seconds=args.seconds, gui=args.gui,
+                                  writers=args.writers, pixel_format=args.pixel_format, converters=args.converters)
+                if result is None:
+                    print("wells={} mode={}: not sustained even at {:g} fps".format(wells, mode, args.fps))
+                    continue
+            else:
+                result = run_case(wells, mode, fps=args.fps, seconds=args.seconds, gui=args.gui,
+                                  writers=args.writers, pixel_format=args.pixel_format, converters=args.converters)
+            results.append(result)
+
+    print_table(results, "find-max" if args.find_max else "benchmark")
+    if args.json:
+        save_baseline(results, args.json)
+    if args.save_baseline:
+        save_baseline(results, args.baseline)
+        print("baseline saved to {}".format(args.baseline))
+    if args.compare:
+        if not Path(args.baseline).exists():
+            print("no baseline at {}; run with --save-baseline first".format(args.baseline))
+            return 1
+        regressions = compare_to_baseline(results, args.baseline)
+        for line in regressions:
+            print("REGRESSION " + line)
+        return 1 if regressions else 0
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
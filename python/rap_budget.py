@@ -0,0 +1,50 @@
+"""Memory budget and admission control for the frame pipeline.
+
+Every frame lives in a preallocated FrameRing slot from the camera callback until the
+last consumer releases it; the demux queues, the writer queue and the display only hold
+references to slots. The memory of the whole pipeline is therefore the sum of the
+preallocated pools, and MemoryBudget splits one budget (--memory-mb) between them: each
+pool is granted its share up front and the frame ring gets what is left. A pool sized by
+a setting (the per-well history) is capped with share(): at most a fraction of the total,
+and never so much that the frame ring is left with fewer than RING_MIN_FRAMES frames.
+
+Admission control keeps acquisition going when the consumers fall behind. The camera
+callback never blocks: a frame that finds the ring full is dropped there and its buffer
+goes straight back to the camera. Before it comes to that, consumers are shed in order
+of importance as the ring fills up: display frames first (from SHED_DISPLAY), then the
+per-frame analysis (from SHED_ANALYSIS). Saving is never shed. Each action is counted
+in the metrics.
+"""
+
+SHED_DISPLAY = 0.6  # ring fill from which frames are not passed to the display
+SHED_ANALYSIS = 0.8  # ring fill from which the per-frame analysis is skipped
+HISTORY_SHARE = 0.5  # largest fraction of the budget the per-well history may take
+RING_MIN_FRAMES = 32  # frames the frame ring always keeps room for
+
+
+class MemoryBudget:
+    def __init__(self, total_mb):
+        self.total = int(total_mb * 2**20)
+        self.granted = {}  # pool name -> bytes
+
+    @property
+    def remaining(self):
+        return self.total - sum(self.granted.values())
+
+    # reserves up to nbytes for a pool; returns the bytes granted
+    def grant(self, name, nbytes):
+        n = max(0, min(int(nbytes), self.remaining))
+        self.granted[name] = self.granted.get(name, 0) + n
+        return n
+
+    # the most a pool may be granted: fraction of the total, leaving keep bytes for the pools after it
+    def share(self, fraction, keep=0):
+        return max(0, min(int(self.total * fraction), self.remaining - int(keep)))
+
+    # grants everything not yet given out
+    def rest(self, name):
+        return self.grant(name, self.remaining)
+
+    def summary(self):
+        return {"total_mb": round(self.total / 2**20, 1),
+                "granted_mb": {k: round(v / 2**20, 1) for k, v in self.granted.items()}}
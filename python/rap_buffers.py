@@ -0,0 +1,53 @@
+"""Sizing of the camera frame buffer pool.
+
+The camera fills the buffers passed to start_streaming(buffer_count=...) and hands each
+one to the frame handler; a buffer only comes back once the handler re-queues it. When
+the pool runs dry the transport has nowhere to put the next frame and loses it, which
+shows up as incomplete frames.
+
+BufferTuner watches the running count of such events (incomplete / too small / invalid
+frames). When it grew during the last `interval` seconds the pool is grown by `factor`,
+up to `max_count`; the caller restarts streaming with the new count. Events during the
+interval after a change are not counted, so the restart itself is not taken as a reason
+to grow again.
+"""
+
+import time
+
+
+class BufferTuner:
+    def __init__(self, count=10, max_count=64, interval=1.0, factor=2):
+        self.count = count
+        self.max_count = max(max_count, count)
+        self.interval = interval
+        self.factor = factor
+        self.changes = 0
+        self._last = None  # starved count at the previous check
+        self._next_check = None
+        self._settling = False
+
+    # starved = events so far that point at a short buffer pool; returns the new buffer
+    # count when the pool should grow, else None
+    def check(self, starved, now=None):
+        now = time.perf_counter() if now is None else now
+        if self._next_check is None:
+            self._last = starved
+            self._next_check = now + self.interval
+            return None
+        if now < self._next_check:
+            if self._settling:
+                self._last = starved
+            return None
+        grew = starved > self._last
+        self._last = starved
+        self._next_check = now + self.interval
+        self._settling = False
+        if not grew or self.count >= self.max_count:
+            return None
+        self.count = min(self.count * self.factor, self.max_count)
+        self.changes += 1
+        self._settling = True  # let the restarted stream settle for an interval
+        return self.count
+
+    def summary(self):
+        return {"buffer_count": self.count, "max": self.max_count, "changes": self.changes}
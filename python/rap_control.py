@@ -0,0 +1,161 @@
+"""Camera control worker, so feature writes never stall the frame loop.
+
+A trigger/freerun command loads a whole camera settings XML (cam.load_settings), which
+takes hundreds of milliseconds; while it runs on the main loop nothing drains the frame
+queue. CameraControl runs every camera write in its own thread with its own queue:
+process_js_command submits the write and goes straight back to the frames.
+
+Writes are coalesced by key: a write that is still queued when a newer write with the
+same key arrives is dropped (status "superseded") and the newer one takes its place at
+the back of the queue, so a burst of exposure slider updates costs one feature write and
+the last value always wins, also over an earlier settings load. Every command reports
+its completion back through report(command) - by default a py. line on stdout for
+node.js and a log entry. A quiet command is only logged: its submitter reports the
+outcome itself (e.g. a live reconfiguration, once it has taken effect).
+"""
+
+import logging
+import sys
+import threading
+import time
+from collections import OrderedDict
+
+
+class ControlCommand:
+    def __init__(self, key, func, args, label=None, quiet=False):
+        self.key = key
+        self.func = func
+        self.args = args
+        self.label = label or key
+        self.quiet = quiet  # not passed to report()
+        self.submitted = time.perf_counter()
+        self.status = "queued"  # queued, running, ok, error, superseded, cancelled
+        self.result = None
+        self.error = None
+        self.duration = 0.0  # seconds spent in func
+        self._done = threading.Event()
+
+    @property
+    def done(self):
+        return self._done.is_set()
+
+    # waits for the command to finish; returns False on timeout
+    def wait(self, timeout=None):
+        return self._done.wait(timeout)
+
+    def _finish(self, status):
+        self.status = status
+        self._done.set()
+
+
+# default report: one py. line per finished command for node.js
+def report_to_stdout(command):
+    wait_ms = (time.perf_counter() - command.submitted) * 1000.0
+    if command.status == "error":
+        sys.stdout.write("py. Error - camera {} failed: {}\n".format(command.label, command.error))
+    else:
+        sys.stdout.write("py. camera {} {} ({:.1f} ms)\n".format(command.label, command.status, wait_ms))
+    sys.stdout.flush()
+
+
+class CameraControl:
+    def __init__(self, report=report_to_stdout, name="camera-control"):
+        self._report = report
+        self._pending = OrderedDict()  # key -> newest queued command with that key
+        self._cond = threading.Condition()
+        self._stopping = False
+        self._busy = False  # a command is running
+        self.submitted = 0
+        self.completed = 0
+        self.superseded = 0
+        self.failed = 0
+        self._thread = threading.Thread(target=self._run, name=name)
+        self._thread.daemon = True
+
+    def start(self):
+        self._thread.start()
+        return self
+
+    # queues func(*args); a queued command with the same key is superseded
+    def submit(self, key, func, *args, label=None, quiet=False):
+        command = ControlCommand(key, func, args, label, quiet)
+        with self._cond:
+            old = self._pending.pop(key, None)
+            self._pending[key] = command
+            self.submitted += 1
+            if old is not None:
+                self.superseded += 1
+            self._cond.notify()
+        if old is not None:
+            self._finished(old, "superseded")
+        return command
+
+    def pending(self):
+        with self._cond:
+            return len(self._pending)
+
+    # waits until nothing is queued or running; returns False on timeout
+    def flush(self, timeout=None):
+        deadline = None if timeout is None else time.monotonic() + timeout
+        with self._cond:
+            while self._pending or self._busy:
+                remaining = None if deadline is None else deadline - time.monotonic()
+                if remaining is not None and remaining <= 0:
+                    return False
+                self._cond.wait(remaining)
+        return True
+
+    # finishes the queued writes (up to timeout) and stops the worker; anything left is cancelled
+    def stop(self, timeout=2.0):
+        self.flush(timeout)
+        with self._cond:
+            self._stopping = True
+            left = list(self._pending.values())
+            self._pending.clear()
+            self._cond.notify_all()
+        for command in left:
+            self._finished(command, "cancelled")
+        self._thread.join(timeout)
+
+    def _finished(self, command, status):
+        command._finish(status)
+        logging.info("camera control: {} {} in {:.1f} ms".format(command.label, status, command.duration * 1000.0))
+        if self._report is not None and not command.quiet:
+            try:
+                self._report(command)
+            except Exception:
+                logging.exception("camera control: report failed")
+
+    def _run(self):
+        while True:
+            with self._cond:
+                while not self._pending and not self._stopping:
+                    self._cond.wait()
+                if self._stopping:
+                    return
+                _, command = self._pending.popitem(last=False)
+                self._busy = True
+            command.status = "running"
+            start = time.perf_counter()
+            try:
+                command.result = command.func(*command.args)
+                status = "ok"
+                self.completed += 1
+            except Exception as e:
+                command.error = e
+                status = "error"
+                self.failed += 1
+                logging.exception("camera control: {} failed".format(command.label))
+            command.duration = time.perf_counter() - start
+            self._finished(command, status)
+            with self._cond:
+                self._busy = False
+                self._cond.notify_all()
+
+    def summary(self):
+        return {
+            "submitted": self.submitted,
+            "completed": self.completed,
+            "superseded": self.superseded,
+            "failed": self.failed,
+        }
@@ -0,0 +1,136 @@
+"""Pixel format conversion off the camera callback.
+
+When the camera does not stream opencv_display_format (Mono8), each frame has to be
+converted before it can be shown or saved. Doing that in the VmbPy frame callback holds
+the camera buffer for the whole conversion (an allocation and a full pass over the
+image), which caps the frame rate the camera can sustain.
+
+ConvertPool moves that work off the callback: submit() copies the raw buffer into a
+preallocated slot of its own FrameRing (the only work left in the callback, after which
+the buffer is re-queued) and worker threads convert the frames into the destination
+ring, the one the main loop reads. Frames leave the pool in the order they were
+submitted, whichever worker converted them, and keep their frame number, camera FrameID /
+timestamp and callback time.
+
+mono8_converter() returns the conversion for a camera pixel format, or None when the
+format is not handled here (packed formats, ...); the callback then converts with VmbPy
+as before.
+"""
+
+import logging
+import threading
+from queue import Empty
+
+import numpy as np
+
+from rap_ringbuffer import FrameRing
+
+# unpacked mono formats (one uint16 per pixel): Mono8 keeps the top 8 bits
+MONO_SHIFT = {"Mono10": 2, "Mono12": 4, "Mono14": 6, "Mono16": 8}
+# formats converted with cv2.cvtColor; OpenCV names Bayer patterns from the second row,
+# so GenICam BayerRG is OpenCV BayerBG and so on
+CV2_TO_GRAY = {
+    "Bgr8": "COLOR_BGR2GRAY",
+    "Rgb8": "COLOR_RGB2GRAY",
+    "BayerRG8": "COLOR_BayerBG2GRAY",
+    "BayerBG8": "COLOR_BayerRG2GRAY",
+    "BayerGR8": "COLOR_BayerGB2GRAY",
+    "BayerGB8": "COLOR_BayerGR2GRAY",
+}
+
+
+# returns (convert, dtype): convert(raw image) -> Mono8 (height, width, 1) image, dtype the
+# numpy type of the raw buffers; None when the format has to be converted by VmbPy
+def mono8_converter(pixel_format, cv2=None):
+    name = getattr(pixel_format, "name", str(pixel_format))
+    if name in MONO_SHIFT:
+        shift = MONO_SHIFT[name]
+
+        def convert(image):
+            return (image >> shift).astype(np.uint8)
+        return convert, np.uint16
+    if name not in CV2_TO_GRAY or not hasattr(cv2, "cvtColor"):
+        return None
+    code = getattr(cv2, CV2_TO_GRAY[name])
+
+    def convert(image):
+        return cv2.cvtColor(image, code)[:, :, np.newaxis]
+    return convert, np.uint8
+
+
+class ConvertPool:
+    def __init__(self, dest, convert, dtype=np.uint8, workers=2, capacity_bytes=64 * 2**20, name="convert"):
+        self.dest = dest
+        self.convert = convert
+        self.source = FrameRing(capacity_bytes, dtype=dtype)  # raw frames waiting for a worker
+        self.converted = 0
+        self.failed = 0
+        self._take_lock = threading.Lock()
+        self._turn = threading.Condition()  # hands frames to dest in submission order
+        self._taken = 0
+        self._next = 0
+        self._stop = threading.Event()
+        self._threads = []
+        for i in range(workers):
+            t = threading.Thread(target=self._run, name="{}-{}".format(name, i + 1))
+            t.daemon = True
+            self._threads.append(t)
+
+    def start(self):
+        for t in self._threads:
+            t.start()
+        return self
+
+    # converts what was submitted, then stops the workers
+    def stop(self, timeout=2.0):
+        self._stop.set()
+        for t in self._threads:
+            t.join(timeout)
+
+    # frames submitted but not yet in the destination ring
+    def pending(self):
+        with self._turn:
+            return self.source.qsize() + self._taken - self._next
+
+    # called from the camera callback: one copy of the raw buffer into a preallocated slot.
+    # block=False raises queue.Full instead of waiting when every slot is taken
+    def submit(self, image, num, frame_id=-1, timestamp=0, received=None, block=True):
+        self.source.put(image, num, block, frame_id=frame_id, timestamp=timestamp, received=received)
+
+    def _run(self):
+        while True:
+            with self._take_lock:
+                try:
+                    raw = self.source.get(True, 0.1)
+                except Empty:
+                    if self._stop.is_set():
+                        return
+                    continue
+                seq = self._taken
+                self._taken += 1
+            try:
+                image = self.convert(raw.image)
+            except Exception:
+                logging.exception("convert: frame {} failed".format(raw.num))
+                image = None
+            with self._turn:
+                while self._next != seq:
+                    self._turn.wait()
+            try:
+                if image is not None:
+                    self.dest.put(image, raw.num, True, frame_id=raw.frame_id, timestamp=raw.timestamp,
+                                  received=raw.received)
+                    self.converted += 1
+                else:
+                    self.failed += 1
+            except Exception:
+                logging.exception("convert: frame {} could not be queued".format(raw.num))
+                self.failed += 1
+            finally:
+                raw.release()
+                with self._turn:
+                    self._next += 1
+                    self._turn.notify_all()
+
+    def summary(self):
+        return {"workers": len(self._threads), "converted": self.converted, "failed": self.failed}
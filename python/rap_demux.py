@@ -0,0 +1,229 @@
+"""Well demultiplexing keyed on the camera FrameID and timestamp.
+
+The Arduino lights one LED per trigger, so frame k of the LED cycle belongs to well
+k % wells. The host-side Handler.frnum only counts frames that reached the callback, so
+one dropped or incomplete frame used to shift every later frame into the wrong well.
+WellDemux instead follows the camera's own FrameID, which keeps counting through frames
+the host never saw. In trigger mode every FrameID step is one trigger, so a forward step
+is taken as it is: a pause of the trigger or a late frame does not move the LED sequence.
+The timestamps only re-phase the sequence when the FrameID was reset or wrapped, or in
+freerun mode, where the camera is not clocked by the LEDs; there a frame has to be more
+than `tolerance` trigger periods away from its FrameID step before the time wins.
+
+WellQueues fans routed frames out to per-well queues; every consumer (saver, display,
+analysis) subscribes once and drains its own queues at its own pace.
+"""
+
+import threading
+from collections import deque
+
+import numpy as np
+
+
+class WellDemux:
+    # period_ns: trigger period; None estimates it from the first `calibrate` unit FrameID steps.
+    # phase: well lit by FrameID 0, i.e. well = (position + phase) % wells
+    # freerun: the camera is not triggered, the timestamp overrules FrameID steps that are
+    # more than `tolerance` periods off
+    def __init__(self, wells, period_ns=None, phase=0, calibrate=16, freerun=False, tolerance=1.0):
+        self.wells = max(int(wells), 1)
+        self.period_ns = period_ns
+        self._estimated = period_ns is None
+        self.phase = phase
+        self.calibrate = calibrate
+        self.freerun = freerun
+        self.tolerance = tolerance
+        self.position = None  # LED sequence index of the last frame
+        self.last_id = None
+        self.last_timestamp = None
+        self._deltas = []
+        self.frames = 0
+        self.gaps = 0  # gaps seen
+        self.missing = 0  # frames lost in those gaps
+        self.rephased = 0  # times the timestamp overruled the FrameID
+
+    def set_wells(self, wells):
+        self.wells = max(int(wells), 1)
+
+    def set_phase(self, phase):
+        self.phase = int(phase) % self.wells
+
+    # forgets the learned trigger period (after a trigger mode or frame rate change);
+    # the LED sequence position is kept
+    def recalibrate(self):
+        if self._estimated:
+            self.period_ns = None
+        self._deltas = []
+        self.last_timestamp = None
+
+    def reset(self):
+        self.position = None
+        self.last_id = None
+        self.last_timestamp = None
+
+    # trigger periods since the previous frame, or None without a period or timestamps
+    def _periods(self, timestamp):
+        if self.period_ns is None or not timestamp or not self.last_timestamp:
+            return None
+        return (timestamp - self.last_timestamp) / self.period_ns
+
+    def _learn_period(self, id_step, timestamp):
+        if self.period_ns is not None or id_step != 1 or not timestamp or not self.last_timestamp:
+            return
+        self._deltas.append(timestamp - self.last_timestamp)
+        if len(self._deltas) >= self.calibrate:
+            self.period_ns = float(np.median(self._deltas))
+            self._deltas = []
+
+    # returns the well of the frame with this FrameID / timestamp (ns)
+    def assign(self, frame_id, timestamp=0):
+        self.frames += 1
+        if self.position is None:
+            self.position = frame_id
+        else:
+            id_step = frame_id - self.last_id
+            periods = self._periods(timestamp)
+            self._learn_period(id_step, timestamp)
+            step = id_step
+            if id_step <= 0:  # FrameID reset or wrapped: fall back on time, else assume the next frame
+                step = max(int(round(periods)), 1) if periods is not None else 1
+                self.rephased += 1
+            elif self.freerun and periods is not None and abs(periods - id_step) > self.tolerance:
+                step = max(int(round(periods)), 1)
+                self.rephased += 1
+            if step > 1:
+                self.gaps += 1
+                self.missing += step - 1
+            self.position += step
+        self.last_id = frame_id
+        self.last_timestamp = timestamp
+        return (self.position + self.phase) % self.wells
+
+    # sets frame.well from frame.frame_id / frame.timestamp and returns it
+    def route(self, frame):
+        frame.well = self.assign(frame.frame_id, frame.timestamp)
+        return frame.well
+
+    def summary(self):
+        return {
+            "frames": self.frames,
+            "gaps": self.gaps,
+            "missing": self.missing,
+            "rephased": self.rephased,
+            "freerun": self.freerun,
+            "phase": self.phase,
+            "period_ns": self.period_ns,
+        }
+
+
+class WellQueue:
+    # one consumer's per-well queues of ring frames. Each queued frame holds a retain()
+    # that the consumer gives back with release(); when a well queue is full its oldest
+    # frame is released and counted in `dropped`. With shed_at set, frames published while
+    # the ring is at least that full are not queued at all and counted in `shed`
+    def __init__(self, name, wells, maxlen=None, shed_at=None):
+        self.name = name
+        self.maxlen = maxlen
+        self.shed_at = shed_at
+        self.dropped = 0
+        self.shed = 0
+        self._lock = threading.Lock()
+        self._ready = threading.Event()  # set while anything is queued
+        self._wells = [deque() for _ in range(wells)]
+
+    def _resize(self, wells):
+        with self._lock:
+            while len(self._wells) < wells:
+                self._wells.append(deque())
+
+    def put(self, frame):
+        frame.retain()
+        with self._lock:
+            q = self._wells[frame.well]
+            q.append(frame)
+            self._ready.set()
+            if self.maxlen is not None and len(q) > self.maxlen:
+                old = q.popleft()
+                self.dropped += 1
+            else:
+                old = None
+        if old is not None:
+            old.release()
+
+    # waits until a frame is queued; returns False on timeout
+    def wait(self, timeout=None):
+        return self._ready.wait(timeout)
+
+    def qsize(self, well=None):
+        if well is None:
+            return sum(len(q) for q in self._wells)
+        return len(self._wells[well])
+
+    # oldest frame of a well (or None)
+    def get(self, well):
+        with self._lock:
+            q = self._wells[well]
+            return q.popleft() if q else None
+
+    # every queued frame in arrival order within each well
+    def drain(self):
+        with self._lock:
+            frames = []
+            for q in self._wells:
+                frames.extend(q)
+                q.clear()
+            self._ready.clear()
+        frames.sort(key=lambda f: f.num)
+        return frames
+
+    # the newest frame of every well that has one; older frames are released
+    def latest(self):
+        out, stale = [], []
+        with self._lock:
+            for q in self._wells:
+                if q:
+                    out.append(q.pop())
+                    stale.extend(q)
+                    q.clear()
+            self._ready.clear()
+        for f in stale:
+            f.release()
+        return out
+
+    # releases everything still queued
+    def clear(self):
+        for f in self.drain():
+            f.release()
+
+
+class WellQueues:
+    def __init__(self, wells):
+        self.wells = max(int(wells), 1)
+        self.consumers = {}
+
+    def subscribe(self, name, maxlen=None, shed_at=None):
+        q = WellQueue(name, self.wells, maxlen, shed_at)
+        self.consumers[name] = q
+        return q
+
+    def unsubscribe(self, name):
+        q = self.consumers.pop(name, None)
+        if q is not None:
+            q.clear()
+
+    def set_wells(self, wells):
+        self.wells = max(int(wells), 1)
+        for q in self.consumers.values():
+            q._resize(self.wells)
+
+    # queues a routed frame (frame.well set) for every consumer; fill is the frame ring's
+    # fill, consumers shed at that level are skipped. Returns the names of those skipped
+    def publish(self, frame, fill=0.0):
+        shed = []
+        for q in list(self.consumers.values()):
+            if q.shed_at is not None and fill >= q.shed_at:
+                q.shed += 1
+                shed.append(q.name)
+            else:
+                q.put(frame)
+        return shed
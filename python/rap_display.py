@@ -0,0 +1,77 @@
+"""Display consumer running in its own thread.
+
+The main loop only routes frames; DisplayThread takes the newest frame of every well
+from its WellQueue (a display subscriber with maxlen=1, so older frames are released as
+soon as a newer one of the same well arrives) and draws them at most max_fps times a
+second. Every OpenCV GUI call - window setup, imshow and waitKey - happens in this
+thread, so a slow GUI only costs skipped display frames, never saved ones.
+
+show(frames) draws a batch of ring frames and keypress() polls the keyboard after each
+refresh; a non-zero keypress() result stops the thread and sets quit_requested.
+"""
+
+import logging
+import threading
+import time
+
+
+class DisplayThread:
+    def __init__(self, queue, show, keypress=None, max_fps=30.0, idle_poll=0.05, name="display"):
+        self.queue = queue
+        self._show = show
+        self._keypress = keypress
+        self.max_fps = max_fps
+        self.idle_poll = idle_poll  # keypress() still runs this often without frames
+        self.quit_requested = False
+        self.refreshes = 0
+        self.frames_shown = 0
+        self.errors = 0
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, name=name)
+        self._thread.daemon = True
+
+    @property
+    def frames_skipped(self):
+        return self.queue.dropped
+
+    def start(self):
+        self._thread.start()
+        return self
+
+    def stop(self, timeout=1.0):
+        self._stop.set()
+        self._thread.join(timeout)
+        self.queue.clear()
+
+    def _run(self):
+        last = 0.0
+        while not self._stop.is_set():
+            self.queue.wait(self.idle_poll)
+            if self.max_fps:
+                wait = last + 1.0 / self.max_fps - time.perf_counter()
+                if wait > 0 and self._stop.wait(wait):
+                    break
+            frames = self.queue.latest()
+            if frames:
+                last = time.perf_counter()
+                try:
+                    self._show(frames)
+                    self.refreshes += 1
+                    self.frames_shown += len(frames)
+                except Exception:
+                    self.errors += 1
+                    logging.exception("display: show failed")
+                finally:
+                    for f in frames:
+                        f.release()
+            if self._keypress is not None and self._keypress() != 0:
+                self.quit_requested = True
+                break
+
+    def summary(self):
+        return {
+            "refreshes": self.refreshes,
+            "frames_shown": self.frames_shown,
+            "frames_skipped": self.frames_skipped,
+            "errors": self.errors,
+        }
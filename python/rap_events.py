@@ -0,0 +1,84 @@
+"""One wake-up source for the main loop.
+
+The main loop serves three kinds of work: frames arriving in the frame ring, commands
+arriving on stdin, and periodic jobs. Instead of polling each of them (or blocking on
+one and starving the others), every producer calls EventSource.notify() after queueing
+work, and the loop sleeps in wait() until something was notified or the next timer is
+due. The loop reads `seq` before it looks at its sources and passes it to wait(), so a
+notify that lands in between is never lost.
+
+CommandQueue is a queue.Queue that notifies on put, for the stdin reader; the frame
+ring notifies through its on_ready hook. Timers added with every() run from the loop
+thread in run_timers().
+"""
+
+import logging
+import threading
+import time
+from queue import Queue
+
+
+class EventSource:
+    def __init__(self):
+        self._cond = threading.Condition()
+        self._seq = 0
+        self._timers = []  # [next_due, interval, fn, name]
+        self.wakeups = 0
+        self.timeouts = 0
+
+    # increases with every notify
+    @property
+    def seq(self):
+        return self._seq
+
+    def notify(self):
+        with self._cond:
+            self._seq += 1
+            self._cond.notify_all()
+
+    # blocks until notify() was called after seq was read, or timeout (None = no limit) passed;
+    # returns True when woken by a notify
+    def wait(self, seen, timeout=None):
+        with self._cond:
+            woken = self._cond.wait_for(lambda: self._seq != seen, timeout)
+        if woken:
+            self.wakeups += 1
+        else:
+            self.timeouts += 1
+        return woken
+
+    # calls fn() every interval seconds from run_timers()
+    def every(self, interval, fn, name=None):
+        self._timers.append([time.perf_counter() + interval, interval, fn, name or getattr(fn, "__name__", "timer")])
+
+    # seconds until the next timer is due (0 if one is overdue), None without timers
+    def next_timeout(self, now=None):
+        if not self._timers:
+            return None
+        now = time.perf_counter() if now is None else now
+        return max(0.0, min(t[0] for t in self._timers) - now)
+
+    def run_timers(self, now=None):
+        now = time.perf_counter() if now is None else now
+        for timer in self._timers:
+            if timer[0] <= now:
+                timer[0] += timer[1]
+                if timer[0] <= now:  # late: no catch-up burst after a stall
+                    timer[0] = now + timer[1]
+                try:
+                    timer[2]()
+                except Exception:
+                    logging.exception("timer {} failed".format(timer[3]))
+
+    def summary(self):
+        return {"wakeups": self.wakeups, "timeouts": self.timeouts, "timers": len(self._timers)}
+
+
+class CommandQueue(Queue):
+    def __init__(self, events, maxsize=0):
+        super().__init__(maxsize)
+        self.events = events
+
+    def put(self, item, block=True, timeout=None):
+        super().put(item, block, timeout)
+        self.events.notify()
@@ -0,0 +1,195 @@
+"""Per-well frame history.
+
+WellHistory keeps the last `depth` frames of every well in one preallocated
+(wells, depth) + frame shape array, with the frame number and camera timestamp of each
+entry. append() copies a routed frame into the next slot of its well (one copy, no
+allocation), and the last k frames of a well, or of every well at once, come back as one
+numpy array oldest first, or as zero-copy read-only views of the history itself.
+
+It is the shared store for background subtraction, pre-trigger capture and rolling
+statistics. The history belongs to the main loop: views stay valid until that well has
+appended `depth` more frames. A reader on another thread (e.g. a writer saving the
+pre-trigger window) pins the frames it needs instead; until a HistoryHold is released
+its slot is not overwritten, and frames of that well are not kept in the meantime
+(counted in `held`).
+
+The depth is given per well in frames ("30") or in seconds of acquisition ("2s"), which
+history_depth() turns into frames from the frame rate and the well count. A capacity in
+bytes (the share granted by the memory budget) caps the depth once the frame size is
+known.
+"""
+
+import math
+import threading
+
+import numpy as np
+
+
+# frames per well for a history setting: "30" frames, or "2s" / "2.5s" of acquisition at fps
+# frames per second shared by the wells (0 = no history)
+def history_depth(setting, fps=None, wells=1):
+    text = str(setting).strip().lower()
+    if not text.endswith("s"):
+        return max(0, int(text))
+    seconds = float(text[:-1])
+    if seconds <= 0:
+        return 0
+    if not fps:
+        raise ValueError("a history of {} needs the frame rate".format(setting))
+    return int(math.ceil(seconds * fps / max(1, wells)))
+
+
+class HistoryHold:
+    # one pinned history frame; image is a read-only view of its slot
+    __slots__ = ('image', 'num', 'timestamp', 'well', 'received', '_pins', '_index', '_lock')
+
+    def __init__(self, history, well, index):
+        self.image = history.frames[well, index].view()
+        self.image.flags.writeable = False
+        self.num = int(history.nums[well, index])
+        self.timestamp = int(history.timestamps[well, index])
+        self.well = well
+        self.received = None  # not a ring frame: no callback time
+        self._pins = history._pins  # the arrays it was pinned in, also after set_wells
+        self._index = (well, index)
+        self._lock = history._pin_lock
+
+    # lets the history overwrite the slot again; safe to call more than once
+    def release(self):
+        with self._lock:
+            if self._index is not None:
+                self._pins[self._index] -= 1
+                self._index = None
+
+
+class WellHistory:
+    def __init__(self, wells, depth, capacity_bytes=None, shape=None, dtype=np.uint8):
+        self.wells = wells
+        self.requested = depth  # depth asked for; depth is what fits in capacity_bytes
+        self.capacity_bytes = capacity_bytes
+        self.dtype = np.dtype(dtype)
+        self.depth = 0
+        self.shape = None
+        self.frames = None
+        self.nums = None
+        self.timestamps = None
+        self._count = np.zeros(wells, dtype=np.int64)  # frames appended per well
+        self._pins = None  # (wells, depth) holds per slot
+        self._pin_lock = threading.Lock()
+        self.appended = 0
+        self.skipped = 0  # frames not kept: no room for even one frame per well
+        self.held = 0  # frames not kept: the slot they would overwrite is pinned
+        if shape is not None:
+            self._allocate(tuple(shape))
+
+    # allocates (and touches) the whole history once the frame shape is known
+    def _allocate(self, shape):
+        frame_bytes = int(np.prod(shape)) * self.dtype.itemsize
+        depth = self.requested
+        if self.capacity_bytes is not None:
+            depth = min(depth, int(self.capacity_bytes) // (self.wells * frame_bytes))
+        self.depth = max(0, depth)
+        self.shape = shape
+        self.frames = np.empty((self.wells, self.depth) + shape, dtype=self.dtype)
+        self.frames.fill(0)
+        self.nums = np.full((self.wells, self.depth), -1, dtype=np.int64)
+        self.timestamps = np.zeros((self.wells, self.depth), dtype=np.int64)
+        self._pins = np.zeros((self.wells, self.depth), dtype=np.int32)
+        self._count = np.zeros(self.wells, dtype=np.int64)
+
+    @property
+    def nbytes(self):
+        return 0 if self.frames is None else self.frames.nbytes
+
+    # starts over with a new well count (and depth); the capacity stays the same
+    def set_wells(self, wells, depth=None):
+        self.wells = wells
+        if depth is not None:
+            self.requested = depth
+        shape, self.frames = self.shape, None
+        self._count = np.zeros(wells, dtype=np.int64)
+        if shape is not None:
+            self._allocate(shape)
+
+    def clear(self):
+        self._count[:] = 0
+
+    def append(self, well, image, num=-1, timestamp=0):
+        if self.frames is None:
+            self._allocate(tuple(image.shape))
+        if self.depth == 0:
+            self.skipped += 1
+            return
+        i = self._count[well] % self.depth
+        if self._pins[well, i]:
+            self.held += 1
+            return
+        self.frames[well, i] = image
+        self.nums[well, i] = num
+        self.timestamps[well, i] = timestamp
+        self._count[well] += 1
+        self.appended += 1
+
+    # frames held for a well
+    def available(self, well):
+        return int(min(self._count[well], self.depth))
+
+    # slot indices of the last k frames of a well, oldest first
+    def _indices(self, well, k):
+        k = min(k, self.available(well))
+        return (self._count[well] - k + np.arange(k)) % max(1, self.depth)
+
+    # the last k frames of a well as one (k,) + shape array, oldest first
+    def last(self, well, k):
+        if self.frames is None:
+            return np.empty((0,), dtype=self.dtype)
+        return self.frames[well, self._indices(well, k)]
+
+    # the last k frames of every well as one (wells, k) + shape array, oldest first;
+    # k is capped by the well with the fewest frames
+    def last_all(self, k):
+        if self.frames is None:
+            return np.empty((0,), dtype=self.dtype)
+        k = min([k] + [self.available(w) for w in range(self.wells)])
+        idx = (self._count[:, np.newaxis] - k + np.arange(k)) % max(1, self.depth)
+        return self.frames[np.arange(self.wells)[:, np.newaxis], idx]
+
+    # the last k frames of a well without copying: up to two read-only views, oldest first
+    def views(self, well, k):
+        k = min(k, self.available(well))
+        if k == 0:
+            return []
+        end = int(self._count[well] % self.depth) or self.depth
+        start = end - k
+        parts = [(start + self.depth, self.depth), (0, end)] if start < 0 else [(start, end)]
+        views = []
+        for a, b in parts:
+            view = self.frames[well, a:b].view()
+            view.flags.writeable = False
+            views.append(view)
+        return views
+
+    # the newest frame of a well (read-only view), None if it has none
+    def latest(self, well):
+        views = self.views(well, 1)
+        return views[0][0] if views else None
+
+    # pins the last k frames of a well for another thread, oldest first
+    def pin(self, well, k):
+        if self.frames is None:
+            return []
+        with self._pin_lock:
+            indices = self._indices(well, k)
+            self._pins[well, indices] += 1
+        return [HistoryHold(self, well, int(i)) for i in indices]
+
+    # frame numbers and camera timestamps of the last k frames of a well, oldest first
+    def numbers(self, well, k):
+        return self.nums[well, self._indices(well, k)] if self.nums is not None else np.empty(0, np.int64)
+
+    def times(self, well, k):
+        return self.timestamps[well, self._indices(well, k)] if self.timestamps is not None else np.empty(0, np.int64)
+
+    def summary(self):
+        return {"wells": self.wells, "depth": self.depth, "mb": round(self.nbytes / 2**20, 1),
+                "appended": self.appended, "skipped": self.skipped, "held": self.held}
@@ -0,0 +1,194 @@
+"""Runtime telemetry: counters, gauges and latency histograms.
+
+Metrics is a small registry the acquisition path writes into from every thread: counters
+(frames received, incomplete frames, queue-full events, ...), gauges (read when a
+snapshot is taken, e.g. the ring queue depth) and histograms of per-stage latencies in
+milliseconds (callback -> dequeued -> written / displayed, command latency).
+
+MetricsReporter emits a snapshot every `interval` seconds as one py.json line of type
+"metrics" (the same channel as the JSON control protocol), with counter rates over the
+last interval and histogram percentiles, and serve_http() optionally serves the latest
+snapshot as JSON on a local port (GET /metrics) for dashboards.
+"""
+
+import bisect
+import json
+import logging
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import rap_protocol
+
+# histogram bucket upper bounds in ms: 0.05 ms .. ~100 s in steps of ~1.26 (10 per decade)
+BOUNDS_MS = tuple(round(0.05 * 10 ** (i / 10.0), 6) for i in range(64))
+
+
+class Histogram:
+    def __init__(self, bounds=BOUNDS_MS):
+        self.bounds = bounds
+        self._lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        self.buckets = [0] * (len(self.bounds) + 1)
+        self.count = 0
+        self.total = 0.0
+        self.min = None
+        self.max = None
+
+    def observe(self, value):
+        i = bisect.bisect_left(self.bounds, value)
+        with self._lock:
+            self.buckets[i] += 1
+            self.count += 1
+            self.total += value
+            if self.min is None or value < self.min:
+                self.min = value
+            if self.max is None or value > self.max:
+                self.max = value
+
+    # upper bound of the bucket holding the q-th quantile (0..1), None when empty
+    def quantile(self, q):
+        if not self.count:
+            return None
+        rank = q * self.count
+        seen = 0
+        for i, n in enumerate(self.buckets):
+            seen += n
+            if seen >= rank and n:
+                return self.bounds[i] if i < len(self.bounds) else self.max
+        return self.max
+
+    def summary(self):
+        with self._lock:
+            if not self.count:
+                return {"count": 0}
+            return {
+                "count": self.count,
+                "mean": round(self.total / self.count, 3),
+                "min": round(self.min, 3),
+                "p50": self.quantile(0.5),
+                "p99": self.quantile(0.99),
+                "max": round(self.max, 3),
+            }
+
+
+class Metrics:
+    def __init__(self):
+        self.counters = {}
+        self.gauges = {}
+        self.histograms = {}
+        self._lock = threading.Lock()
+        self._last = {}  # counter values at the previous snapshot
+        self._last_time = time.perf_counter()
+        self.latest = None  # last snapshot taken
+
+    def inc(self, name, n=1):
+        # dict updates of ints are not atomic across threads, so take the lock
+        with self._lock:
+            self.counters[name] = self.counters.get(name, 0) + n
+
+    def observe(self, name, value):
+        h = self.histograms.get(name)
+        if h is None:
+            with self._lock:
+                h = self.histograms.setdefault(name, Histogram())
+        h.observe(value)
+
+    # fn() is read at every snapshot
+    def gauge(self, name, fn):
+        self.gauges[name] = fn
+
+    def remove_gauge(self, name):
+        self.gauges.pop(name, None)
+
+    # counters, per-second rates since the last snapshot, gauges and histogram summaries;
+    # reset=True starts a new window for the rates and histograms
+    def snapshot(self, reset=True):
+        now = time.perf_counter()
+        with self._lock:
+            counters = dict(self.counters)
+            elapsed = now - self._last_time
+            rates = {k: (v - self._last.get(k, 0)) / elapsed if elapsed > 0 else 0.0 for k, v in counters.items()}
+            if reset:
+                self._last = counters
+                self._last_time = now
+            histograms = list(self.histograms.items())
+        gauges = {}
+        for name, fn in list(self.gauges.items()):
+            try:
+                gauges[name] = fn()
+            except Exception:
+                gauges[name] = None
+        snap = {
+            "interval_s": round(elapsed, 3),
+            "counters": counters,
+            "rates": {k: round(v, 2) for k, v in rates.items()},
+            "gauges": gauges,
+            "latency_ms": {},
+        }
+        for name, h in histograms:
+            snap["latency_ms"][name] = h.summary()
+            if reset:
+                with h._lock:
+                    h.reset()
+        self.latest = snap
+        return snap
+
+
+class MetricsReporter:
+    def __init__(self, metrics, interval=1.0, send=None, name="metrics"):
+        self.metrics = metrics
+        self.interval = interval
+        self._send = send if send is not None else rap_protocol.send
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, name=name)
+        self._thread.daemon = True
+
+    def start(self):
+        self._thread.start()
+        return self
+
+    def stop(self, timeout=1.0):
+        self._stop.set()
+        self._thread.join(timeout)
+
+    def report(self):
+        snap = self.metrics.snapshot()
+        message = {"v": rap_protocol.PROTOCOL_VERSION, "id": None, "type": "metrics", "ok": True}
+        message.update(snap)
+        self._send(message)
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            try:
+                self.report()
+            except Exception:
+                logging.exception("metrics: report failed")
+
+
+# serves metrics.latest (or a fresh snapshot before the first report) on http://host:port/metrics;
+# returns the server, stop it with shutdown()
+def serve_http(metrics, port, host="127.0.0.1"):
+    class MetricsHandler(BaseHTTPRequestHandler):
+        def do_GET(self):
+            if self.path.rstrip("/") not in ("", "/metrics"):
+                self.send_error(404)
+                return
+            snap = metrics.latest if metrics.latest is not None else metrics.snapshot(reset=False)
+            body = json.dumps(snap, default=str).encode()
+            self.send_response(200)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, format, *args):
+            pass
+
+    server = ThreadingHTTPServer((host, port), MetricsHandler)
+    thread = threading.Thread(target=server.serve_forever, name="metrics-http")
+    thread.daemon = True
+    thread.start()
+    return server
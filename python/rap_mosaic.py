@@ -0,0 +1,70 @@
+"""Single-window mosaic of all wells (display mode 2, "big tile").
+
+Instead of one OpenCV window per well and one imshow per frame, Mosaic keeps one
+preallocated uint8 canvas the size of the screen, laid out in the same grid as the wells
+on the plate. update() resizes a well's latest frame straight into its tile (cv2.resize
+with dst= writes into the canvas view, nothing is allocated), and show() pushes the whole
+canvas with a single imshow at most max_fps times per second.
+"""
+
+import time
+
+import numpy as np
+
+from rap_wells import well_grid
+
+
+class Mosaic:
+    def __init__(self, cv2, wells, screen=(1920, 1080), frame_size=(816, 624), max_fps=30.0,
+                 title="RAP wells", channels=1):
+        self.cv2 = cv2
+        self.screen = tuple(screen)
+        self.frame_size = tuple(frame_size)
+        self.max_fps = max_fps
+        self.title = title
+        self.channels = channels
+        self.canvas = np.zeros((self.screen[1], self.screen[0]) + ((channels,) if channels > 1 else ()),
+                               dtype=np.uint8)
+        self.shown = 0
+        self.updates = 0
+        self._last_show = 0.0
+        self._dirty = False
+        self.set_wells(wells)
+        cv2.namedWindow(title, cv2.WINDOW_NORMAL)
+
+    # lays the tiles out for a well count; tiles keep the frame aspect ratio
+    def set_wells(self, wells):
+        self.wells = max(int(wells), 1)
+        rows, cols = well_grid(self.wells)
+        pitch_x, pitch_y = self.screen[0] // cols, self.screen[1] // rows
+        scale = min(pitch_x / self.frame_size[0], pitch_y / self.frame_size[1])
+        self.tile_size = (max(1, int(self.frame_size[0] * scale)), max(1, int(self.frame_size[1] * scale)))
+        tw, th = self.tile_size
+        self.canvas[:] = 0
+        self.tiles = []
+        for well in range(self.wells):
+            r, c = divmod(well, cols)
+            self.tiles.append(self.canvas[r * pitch_y:r * pitch_y + th, c * pitch_x:c * pitch_x + tw])
+        self._dirty = True
+
+    # resizes image into the tile of well, in place
+    def update(self, well, image):
+        if well >= self.wells:
+            return
+        self.cv2.resize(image, self.tile_size, dst=self.tiles[well], interpolation=self.cv2.INTER_AREA)
+        self.updates += 1
+        self._dirty = True
+
+    # shows the canvas if anything changed and the refresh cap allows it; returns True if shown
+    def show(self, now=None):
+        if not self._dirty:
+            return False
+        if now is None:
+            now = time.perf_counter()
+        if self.max_fps and now - self._last_show < 1.0 / self.max_fps:
+            return False
+        self.cv2.imshow(self.title, self.canvas)
+        self._last_show = now
+        self._dirty = False
+        self.shown += 1
+        return True
@@ -0,0 +1,126 @@
+"""LED phase lock: checks the well assignment against what the frames actually show.
+
+The Arduino lights one well per trigger. For a camera that sees the whole plate in every
+frame, one well region (rap_wells.well_region) is then brighter than the rest. That is
+not the layout the displays and the simulated camera use (one well per frame), and it has
+not been validated on rig frames, so vimba_rap3 runs the phase lock only with
+--phase-lock=1. PhaseLock samples a fixed sparse grid of pixels in each well region (a few
+hundred pixels in total, gathered with one np.take), finds the brightest well and
+compares it with the demux position of the frame. The offset between the two is the
+phase of the LED sequence relative to the camera FrameID.
+
+Until it is locked every frame is measured, and the phase is set as soon as one LED
+cycle worth of frames agrees. After that only every `check_every`-th frame is measured;
+if `confirm` checks in a row agree on a different offset the demux is re-phased.
+Frames without a clearly lit well (LEDs off, free run) are ignored.
+"""
+
+import logging
+import sys
+from collections import Counter, deque
+
+import numpy as np
+
+from rap_wells import well_region
+
+
+class PhaseLock:
+    # width / height default to the size of the first observed frame
+    def __init__(self, wells, width=None, height=None, samples=256, check_every=50, confirm=3,
+                 agreement=0.75, min_contrast=8.0):
+        self.samples = samples
+        self.check_every = check_every
+        self.confirm = confirm
+        self.agreement = agreement
+        self.min_contrast = min_contrast
+        self.width = width
+        self.height = height
+        self.locked = False
+        self.phase = None
+        self.relocks = 0
+        self.measured = 0
+        self._since_check = 0
+        self.set_wells(wells)
+
+    # precomputes the flat pixel indices sampled in every well region
+    def set_wells(self, wells):
+        self.wells = max(int(wells), 1)
+        self._votes = deque(maxlen=self.wells)
+        self._checks = deque(maxlen=self.confirm)
+        self.locked = False
+        self.phase = None
+        if self.width is None:
+            self._index = None
+            return
+        per_well = max(4, self.samples // self.wells)
+        side = max(2, int(np.ceil(np.sqrt(per_well))))
+        index = []
+        for w in range(self.wells):
+            y0, y1, x0, x1 = well_region(w, self.wells, self.width, self.height)
+            ys = np.linspace(y0, y1 - 1, side + 2, dtype=np.intp)[1:-1]  # stay off the region borders
+            xs = np.linspace(x0, x1 - 1, side + 2, dtype=np.intp)[1:-1]
+            index.append((ys[:, None] * self.width + xs[None, :]).ravel())
+        self._index = np.stack(index)
+
+    # the well that is lit in image, or None when no well stands out
+    def lit_well(self, image):
+        index = self._index
+        if image.ndim == 3 and image.shape[2] > 1:  # colour: sample the first channel
+            index = index * image.shape[2]
+        means = np.take(image.reshape(-1), index).mean(axis=1)
+        lit = int(np.argmax(means))
+        if means[lit] - np.median(means) < self.min_contrast:
+            return None
+        return lit
+
+    # measures the frame if it is due and updates the phase of demux; returns True when the phase changed
+    def observe(self, frame, demux):
+        height, width = frame.image.shape[:2]
+        if (height, width) != (self.height, self.width):
+            self.width, self.height = width, height
+            self.set_wells(demux.wells)
+        elif demux.wells != self.wells:
+            self.set_wells(demux.wells)
+        if self.wells < 2:
+            return False
+        if self.locked:
+            self._since_check += 1
+            if self._since_check < self.check_every:
+                return False
+            self._since_check = 0
+        lit = self.lit_well(frame.image)
+        self.measured += 1
+        if lit is None:
+            return False
+        offset = (lit - (frame.well - demux.phase)) % self.wells
+        if not self.locked:
+            self._votes.append(offset)
+            if len(self._votes) < self._votes.maxlen:
+                return False
+            offset, count = Counter(self._votes).most_common(1)[0]
+            if count < self.agreement * len(self._votes):
+                return False
+            self.locked = True
+            self._checks.clear()
+            return self._apply(frame, demux, offset)
+        self._checks.append(offset)
+        if (len(self._checks) == self.confirm and offset != demux.phase
+                and all(o == offset for o in self._checks)):
+            self.relocks += 1
+            self._checks.clear()
+            return self._apply(frame, demux, offset)
+        return False
+
+    def _apply(self, frame, demux, offset):
+        changed = offset != demux.phase
+        self.phase = offset
+        if changed:
+            frame.well = (frame.well - demux.phase + offset) % self.wells
+            demux.set_phase(offset)
+            logging.info("phase lock: LED phase {} (relocks {})".format(offset, self.relocks))
+            sys.stdout.write(".py. phase lock: wells re-phased by {}\n".format(offset))
+            sys.stdout.flush()
+        return changed
+
+    def summary(self):
+        return {"locked": self.locked, "phase": self.phase, "relocks": self.relocks, "measured": self.measured}
@@ -0,0 +1,57 @@
+"""Pre-trigger capture: saving frames from before the save command.
+
+`<savebuffer,seconds>` starts a recording that begins `seconds` in the past. The frames
+from before the command come from the per-well history (rap_history), the ones after it
+are saved live as with `<startsave>`.
+
+PreTrigger pins the window in the history when it is created - the history keeps running
+for the other wells and slots, nothing is copied - and reserves the recording targets in
+acquisition order, so in a stack session the backlog comes before the live frames of each
+well. The main loop then calls step() once per iteration, which hands pinned frames to the
+background writer only while its queue has room; the backlog is written alongside the
+live frames and acquisition never waits for it. Each hold is released by the writer once
+its frame is on disk.
+"""
+
+import time
+from collections import deque
+
+
+class PreTrigger:
+    # holds: HistoryHold frames of the window (any order); reserve(num, well, timestamp) returns
+    # the recording target of a frame; timestamp is the wall time in ns the frame was taken
+    def __init__(self, holds, reserve, now_ns=None):
+        holds = sorted(holds, key=lambda h: h.num)
+        now_ns = time.time_ns() if now_ns is None else now_ns
+        newest = max((h.timestamp for h in holds), default=0)
+        self._pending = deque()
+        for h in holds:
+            # the camera clock only dates frames relative to each other: the newest one is taken as now
+            taken = now_ns - (newest - h.timestamp) if newest > 0 else now_ns
+            self._pending.append((reserve(h.num, h.well, taken), h))
+        self.total = len(holds)
+        self.submitted = 0
+        self.started = time.perf_counter()
+
+    @property
+    def done(self):
+        return not self._pending
+
+    def pending(self):
+        return len(self._pending)
+
+    # submits backlog frames, oldest first, as long as room() is true (and at most limit);
+    # submit(target, image, hold) must release the hold once the frame is written.
+    # Returns the number submitted
+    def step(self, submit, room=None, limit=None):
+        n = 0
+        while self._pending and (limit is None or n < limit) and (room is None or room()):
+            target, hold = self._pending.popleft()
+            submit(target, hold.image, hold)
+            n += 1
+        self.submitted += n
+        return n
+
+    def summary(self):
+        return {"frames": self.total, "submitted": self.submitted,
+                "seconds": round(time.perf_counter() - self.started, 3)}
@@ -0,0 +1,65 @@
+"""Reduced-resolution preview frames for display and live analysis.
+
+Preview bins full-resolution frames down to about salliedxy (256x208) by block means:
+816x624 frames are cropped to 768x624 and every 3x3 block is averaged. The block sums
+are strided numpy adds into a preallocated accumulator, and each key (usually the well)
+gets its own output buffer that is reused for every frame of that key, so nothing is
+allocated per frame. Full-resolution frames still go to the writer untouched.
+
+One Preview is meant for one consumer thread: the accumulator is shared between keys,
+and a key's output buffer is overwritten by the next bin() for that key.
+"""
+
+import numpy as np
+
+
+class Preview:
+    # size is (width, height), like salliedxy
+    def __init__(self, size=(256, 208)):
+        self.size = tuple(size)
+        self.shape = None
+        self.factor = (1, 1)
+        self.out_shape = None
+        self._buffers = {}
+
+    def _setup(self, shape):
+        height, width = shape[:2]
+        fy = max(1, height // self.size[1])
+        fx = max(1, width // self.size[0])
+        out_h = min(self.size[1], height // fy)
+        out_w = min(self.size[0], width // fx)
+        y0 = (height - out_h * fy) // 2
+        x0 = (width - out_w * fx) // 2
+        self.crop = (y0, y0 + out_h * fy, x0, x0 + out_w * fx)
+        self.factor = (fy, fx)
+        self.out_shape = (out_h, out_w) + tuple(shape[2:])
+        acc_dtype = np.uint16 if fy * fx * 255 <= np.iinfo(np.uint16).max else np.uint32
+        self._acc = np.empty(self.out_shape, dtype=acc_dtype)
+        self._buffers = {}
+        self.shape = tuple(shape)
+
+    # block-mean binned copy of image in the reused buffer of key
+    def bin(self, image, key=0):
+        if image.shape != self.shape:
+            self._setup(image.shape)
+        out = self._buffers.get(key)
+        if out is None:
+            out = self._buffers[key] = np.empty(self.out_shape, dtype=np.uint8)
+        fy, fx = self.factor
+        y0, y1, x0, x1 = self.crop
+        out_h, out_w = self.out_shape[:2]
+        blocks = image[y0:y1, x0:x1].reshape((out_h, fy, out_w, fx) + self.out_shape[2:])
+        n = fy * fx
+        if n == 1:
+            np.copyto(out, blocks[:, 0, :, 0])
+            return out
+        acc = self._acc
+        np.copyto(acc, blocks[:, 0, :, 0])
+        for i in range(fy):
+            for j in range(fx):
+                if i or j:
+                    np.add(acc, blocks[:, i, :, j], out=acc)
+        np.add(acc, n // 2, out=acc)  # round to nearest
+        np.floor_divide(acc, n, out=acc)
+        np.copyto(out, acc, casting='unsafe')
+        return out
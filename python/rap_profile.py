@@ -0,0 +1,163 @@
+"""Opt-in profiling of the acquisition loop.
+
+LoopProfiler times the stages of the main loop with time.perf_counter(): begin() marks
+the start of an iteration and lap(stage) charges the time since the previous mark to
+that stage, so the stages of one iteration add up to the whole loop. Other threads
+(display, writers) can add their own stage times with record(). Every stage keeps the
+last `window` timings; summary() turns them into mean / p50 / p99 / max in ms and each
+stage's share of the time. While disabled, begin() and lap() return after one attribute
+check.
+
+For a closer look two heavier tools can run alongside the timers:
+- a sampler thread that records the stack of every thread every `interval` seconds and
+  writes them as folded stacks ("thread;outer;inner count" lines), the input format of
+  flamegraph.pl, speedscope and similar flame-graph viewers;
+- cProfile on the main loop thread, dumped as a pstats file.
+"""
+
+import cProfile
+import logging
+import os
+import sys
+import threading
+import time
+from collections import Counter, deque
+
+import numpy as np
+
+
+class StackSampler:
+    def __init__(self, interval=0.005, name="profile-sampler"):
+        self.interval = interval
+        self.samples = Counter()
+        self.count = 0
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, name=name)
+        self._thread.daemon = True
+
+    def start(self):
+        self._thread.start()
+        return self
+
+    def stop(self, timeout=1.0):
+        self._stop.set()
+        self._thread.join(timeout)
+
+    def _run(self):
+        me = threading.get_ident()
+        while not self._stop.wait(self.interval):
+            names = {t.ident: t.name for t in threading.enumerate()}
+            for ident, frame in sys._current_frames().items():
+                if ident == me:
+                    continue
+                stack = []
+                while frame is not None:
+                    code = frame.f_code
+                    stack.append("{} ({}:{})".format(code.co_name, os.path.basename(code.co_filename), code.co_firstlineno))
+                    frame = frame.f_back
+                stack.append(names.get(ident, str(ident)))
+                self.samples[";".join(reversed(stack))] += 1
+            self.count += 1
+
+    # writes the samples as folded stacks; returns the number of distinct stacks
+    def write_folded(self, path):
+        with open(path, "w") as f:
+            for stack, n in self.samples.most_common():
+                f.write("{} {}\n".format(stack, n))
+        return len(self.samples)
+
+
+class LoopProfiler:
+    def __init__(self, window=2000, directory=None):
+        self.window = window
+        self.directory = directory  # dumps go here, None = the working directory at the time
+        self.enabled = False
+        self.stages = {}  # stage -> deque of seconds
+        self.sampler = None
+        self.profile = None
+        self._cprofiling = False  # cProfile is collecting
+        self._mark = 0.0
+        self.dumps = 0
+
+    # starts the stage timers; sample=True also samples stacks, cprofile=True runs cProfile
+    # on the calling thread (call it from the main loop)
+    def start(self, sample=True, cprofile=False, interval=0.005):
+        if not self.enabled:
+            self.stages = {}
+            self._mark = time.perf_counter()  # the first lap may come before the next begin()
+            self.enabled = True
+        if sample and self.sampler is None:
+            self.sampler = StackSampler(interval).start()
+        if cprofile and self.profile is None:
+            self.profile = cProfile.Profile()
+            self.profile.enable()
+            self._cprofiling = True
+
+    # stops everything and dumps what was collected; returns the dump (see dump())
+    def stop(self):
+        if not self.enabled and self.sampler is None and self.profile is None:
+            return None
+        if self.profile is not None:
+            self.profile.disable()
+            self._cprofiling = False
+        if self.sampler is not None:
+            self.sampler.stop()
+        out = self.dump()
+        self.enabled = False
+        self.sampler = None
+        self.profile = None
+        return out
+
+    def begin(self):
+        if self.enabled:
+            self._mark = time.perf_counter()
+
+    def lap(self, stage):
+        if self.enabled:
+            now = time.perf_counter()
+            self.record(stage, now - self._mark)
+            self._mark = now
+
+    def record(self, stage, seconds):
+        q = self.stages.get(stage)
+        if q is None:
+            q = self.stages.setdefault(stage, deque(maxlen=self.window))
+        q.append(seconds)
+
+    # per-stage stats over the rolling window, slowest stage first
+    def summary(self):
+        stats = {}
+        for stage, q in list(self.stages.items()):
+            t = np.array(q, dtype=np.float64) * 1000.0
+            if t.size:
+                stats[stage] = {"n": int(t.size), "mean": float(t.mean()), "p50": float(np.percentile(t, 50)),
+                                "p99": float(np.percentile(t, 99)), "max": float(t.max()), "total": float(t.sum())}
+        total = sum(s["total"] for s in stats.values())
+        for s in stats.values():
+            s["share"] = s["total"] / total if total > 0 else 0.0
+        return dict(sorted(stats.items(), key=lambda kv: -kv[1]["total"]))
+
+    # logs the stage stats and writes the folded stacks / pstats collected so far;
+    # returns {"stages": summary, "files": [paths written]}
+    def dump(self, prefix="rap_profile"):
+        self.dumps += 1
+        stages = self.summary()
+        for stage, s in stages.items():
+            logging.info("profile {}: n={} mean={:.3f} ms p50={:.3f} p99={:.3f} max={:.3f} share={:.0%}".format(
+                stage, s["n"], s["mean"], s["p50"], s["p99"], s["max"], s["share"]))
+        files = []
+        directory = self.directory if self.directory is not None else os.getcwd()
+        stamp = "{}_{}_{}".format(prefix, time.strftime("%Y%m%d_%H%M%S"), self.dumps)
+        if self.sampler is not None and self.sampler.samples:
+            path = os.path.join(directory, stamp + ".folded")
+            self.sampler.write_folded(path)
+            files.append(path)
+        if self.profile is not None:
+            path = os.path.join(directory, stamp + ".pstats")
+            self.profile.dump_stats(path)  # disables the profiler, so it is enabled again until stop()
+            if self._cprofiling:
+                self.profile.enable()
+            files.append(path)
+        for path in files:
+            logging.info("profile written to {}".format(path))
+        return {"stages": stages, "files": files}
@@ -0,0 +1,92 @@
+"""Versioned JSON control protocol for the node.js <-> python channel.
+
+A command frame whose text starts with '{' is a JSON request instead of a free-text
+<cmd,arg> command (the two can be mixed on the same stdin):
+
+    <{"v": 1, "id": "step3", "set": {"trigger": true, "fps": 50, "wells": 12},
+      "cmds": [["startsave", "/data/step3"]]}>
+
+"set" is a batch of settings applied together, "cmds" a list of text commands run after
+it, each as [name, arg, ...]. A '>' inside a JSON string must be sent as \\u003e, since
+'>' closes the frame.
+
+Every reply is one line on stdout, "py.json " followed by a JSON object carrying the
+protocol version, the request id and a type: "ack" (the request was accepted; "applied"
+holds the values after clamping), "done" (a set applied while streaming has taken effect;
+with the frames affected) or "error" ("error" holds a type from ERROR_TYPES and a
+message). A request with invalid settings is rejected as a whole; commands run in order
+and stop at the first one that fails, whose error message names the ones that ran.
+"""
+
+import json
+import sys
+import threading
+
+PROTOCOL_VERSION = 1
+REPLY_PREFIX = "py.json "
+ERROR_TYPES = ("bad_request", "unsupported_version", "unknown_command", "invalid_value", "camera_error")
+
+_out_lock = threading.Lock()  # replies come from the main loop and the camera control worker
+
+
+class ProtocolError(Exception):
+    def __init__(self, type_, message, request_id=None):
+        super().__init__(message)
+        self.type = type_
+        self.request_id = request_id
+
+
+class Request:
+    def __init__(self, id, settings, cmds):
+        self.id = id
+        self.settings = settings  # name -> value
+        self.cmds = cmds  # [[name, arg, ...], ...]
+
+
+def is_json_command(text):
+    return text.lstrip().startswith("{")
+
+
+# validates the envelope of a JSON request; raises ProtocolError
+def parse_request(text):
+    try:
+        message = json.loads(text)
+    except ValueError as e:
+        raise ProtocolError("bad_request", "not valid JSON: {}".format(e))
+    if not isinstance(message, dict):
+        raise ProtocolError("bad_request", "a request must be a JSON object")
+    request_id = message.get("id")
+    version = message.get("v")
+    if version != PROTOCOL_VERSION:
+        raise ProtocolError("unsupported_version", "protocol version {} is not supported (use {})".format(
+            version, PROTOCOL_VERSION), request_id)
+    settings = message.get("set", {})
+    cmds = message.get("cmds", [])
+    if not isinstance(settings, dict):
+        raise ProtocolError("bad_request", "\"set\" must be an object", request_id)
+    if not isinstance(cmds, list) or not all(isinstance(c, list) and c and isinstance(c[0], str) for c in cmds):
+        raise ProtocolError("bad_request", "\"cmds\" must be a list of [name, arg, ...] lists", request_id)
+    if not settings and not cmds:
+        raise ProtocolError("bad_request", "nothing to do: give \"set\" and/or \"cmds\"", request_id)
+    return Request(request_id, settings, [[str(part) for part in c] for c in cmds])
+
+
+def send(message, stream=None):
+    stream = stream if stream is not None else sys.stdout
+    line = REPLY_PREFIX + json.dumps(message, default=str) + "\n"
+    with _out_lock:
+        stream.write(line)
+        stream.flush()
+
+
+def reply(request_id, type_, **fields):
+    message = {"v": PROTOCOL_VERSION, "id": request_id, "type": type_, "ok": type_ != "error"}
+    message.update(fields)
+    send(message)
+    return message
+
+
+# fields are added to the reply, e.g. what a request had already applied when it failed
+def reply_error(request_id, error, **fields):
+    type_ = error.type if isinstance(error, ProtocolError) else "camera_error"
+    return reply(request_id, "error", error={"type": type_, "message": str(error)}, **fields)
@@ -0,0 +1,177 @@
+"""Reader for saved sessions.
+
+RapRecording opens a save folder lazily and gives every well the same interface, whether
+the folder holds a stacked session (--format=stack, see rap_stack) or one TIFF per frame
+written by maybesaveimage, img#########_wellKK.tif (img#########.tif in older folders):
+
+    rec = RapRecording(folder)              # wells= is needed for an older TIFF folder
+    block = rec.well(3)[100:200]            # (T, H, W) array
+    for t0, block in rec.chunks(3, 256):    # the whole well, 256 frames at a time
+        ...
+
+For stacked sessions well(k) is an np.memmap over the well file, so slicing it is a
+zero-copy view and nothing is read until the pixels are touched. For TIFF folders well(k)
+is a TiffWell: the frames are listed once from the folder and only the sliced ones are
+decoded. A TIFF frame goes to the well in its name; only frames saved without one (older
+folders) are assigned by frame number, num % wells.
+"""
+
+import re
+from pathlib import Path
+
+import numpy as np
+
+from rap_stack import open_stack, is_stack_session
+
+TIFF_NAME = re.compile(r'img(\d+)(?:_well(\d+))?\.tiff?$')
+
+
+def _imread(path):
+    import cv2  # only needed for legacy TIFF folders
+    image = cv2.imread(str(path), cv2.IMREAD_UNCHANGED)
+    if image is None:
+        raise IOError('could not read {}'.format(path))
+    return image
+
+
+class TiffWell:
+    # the frames of one well in a TIFF folder; indexing and slicing decode on demand
+    def __init__(self, paths, nums, imread=_imread):
+        self.paths = paths
+        self.nums = np.asarray(nums, dtype=np.int64)
+        self._imread = imread
+        self._first = None
+
+    def __len__(self):
+        return len(self.paths)
+
+    def _probe(self):
+        if self._first is None:
+            if not self.paths:
+                raise IndexError('well has no frames')
+            self._first = np.asarray(self._imread(self.paths[0]))
+        return self._first
+
+    @property
+    def shape(self):
+        return (len(self),) + self._probe().shape
+
+    @property
+    def dtype(self):
+        return self._probe().dtype
+
+    def __getitem__(self, key):
+        if isinstance(key, slice):
+            paths = self.paths[key]
+            if not paths:
+                return np.empty((0,) + self.shape[1:], dtype=self.dtype)
+            out = np.empty((len(paths),) + self.shape[1:], dtype=self.dtype)
+            for i, path in enumerate(paths):
+                out[i] = self._imread(path)
+            return out
+        return np.asarray(self._imread(self.paths[key]))
+
+    def __array__(self, dtype=None, copy=None):
+        out = self[:]
+        return out if dtype is None else out.astype(dtype)
+
+
+class RapRecording:
+    def __init__(self, path, wells=None, imread=_imread):
+        self.path = Path(path)
+        if is_stack_session(self.path):
+            self.format = 'stack'
+            self.info, self._files = open_stack(self.path)
+            self.wells = self.info['wells']
+            self._tiff = None
+        else:
+            self.format = 'tiff'
+            self.info = {}
+            self._files = {}
+            self._tiff = self._list_tiffs(wells, imread)
+        self._maps = {}
+
+    # wells defaults to the highest well named in the folder; frames without a well in their
+    # name need it to be given
+    def _list_tiffs(self, wells, imread):
+        frames = []
+        for p in self.path.iterdir():
+            m = TIFF_NAME.match(p.name)
+            if m:
+                frames.append((int(m.group(1)), None if m.group(2) is None else int(m.group(2)), p))
+        if not frames:
+            raise FileNotFoundError('{} holds neither a stack session nor img*.tif frames'.format(self.path))
+        named = [well for _, well, _ in frames if well is not None]
+        if wells is None:
+            if len(named) < len(frames):
+                raise ValueError('wells= is required to split a TIFF folder without wells in the file names')
+            wells = max(named) + 1
+        elif named and max(named) >= wells:
+            raise ValueError('{} holds frames of well {}, more than wells={}'.format(self.path, max(named), wells))
+        self.wells = wells
+        frames.sort(key=lambda f: f[0])
+        per_well = [([], []) for _ in range(wells)]
+        for num, well, p in frames:
+            paths, nums = per_well[num % wells if well is None else well]
+            paths.append(p)
+            nums.append(num)
+        return [TiffWell(paths, nums, imread) for paths, nums in per_well]
+
+    def __repr__(self):
+        return 'RapRecording({!r}, format={}, wells={}, frames={})'.format(
+            str(self.path), self.format, self.wells, self.frames())
+
+    # number of frames of one well, or the per-well list
+    def frames(self, well=None):
+        if well is None:
+            return [self.frames(w) for w in range(self.wells)]
+        if self._tiff is not None:
+            return len(self._tiff[well])
+        f = self._files.get(well)
+        return len(f) if f is not None else 0
+
+    # all frames of a well as a (T, H, W) array-like (np.memmap for stacks, TiffWell for TIFF folders)
+    def well(self, well):
+        if not 0 <= well < self.wells:
+            raise IndexError('well {} out of range (0..{})'.format(well, self.wells - 1))
+        if self._tiff is not None:
+            return self._tiff[well]
+        if well not in self._maps:
+            f = self._files.get(well)
+            if f is not None:
+                self._maps[well] = f.memmap()
+            else:  # nothing was saved for this well; keep the session frame shape
+                shape = tuple(self.info.get('shape') or (0, 0))
+                if len(shape) == 3 and shape[2] == 1:
+                    shape = shape[:2]
+                self._maps[well] = np.empty((0,) + shape, dtype=self.info.get('dtype') or np.uint8)
+        return self._maps[well]
+
+    # acquisition frame numbers of a well
+    def nums(self, well):
+        if self._tiff is not None:
+            return self._tiff[well].nums
+        f = self._files.get(well)
+        return f.index()[0] if f is not None else np.empty(0, dtype=np.int64)
+
+    # capture timestamps (ns) of a well; None for TIFF folders, which do not record them
+    def timestamps(self, well):
+        if self._tiff is not None:
+            return None
+        f = self._files.get(well)
+        return f.index()[1] if f is not None else np.empty(0, dtype=np.int64)
+
+    # yields (t0, frames[t0:t0+size]) over a well without loading the rest
+    def chunks(self, well, size=256):
+        frames = self.well(well)
+        for t0 in range(0, len(frames), size):
+            yield t0, frames[t0:t0 + size]
+
+    def close(self):
+        self._maps.clear()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
@@ -0,0 +1,185 @@
+"""Fixed-size ring of preallocated frame slots.
+
+FrameRing replaces the Queue of freshly allocated numpy arrays between the VmbPy frame
+callback and the main loop. All slots live in one uint8 array allocated (and written,
+so every page is faulted in) once, sized from a byte budget; the producer copies each
+frame into a free slot exactly once, and the consumer gets a RingFrame holding a
+read-only view of that slot. The slot is recycled when every holder has called release().
+Free slots are reused last in, first out, so a ring that is mostly idle keeps cycling
+through the few slots that are still in the CPU caches.
+
+The queue-like methods (put/get/qsize/empty/full/maxsize) mirror queue.Queue, and get
+raises queue.Empty / put raises queue.Full in the same situations.
+"""
+
+import threading
+import time
+import weakref
+from collections import deque
+from queue import Empty, Full
+
+import numpy as np
+
+
+class RingFrame:
+    # one per slot, reused for every frame that passes through that slot
+    __slots__ = ('image', 'num', 'frame_id', 'timestamp', 'received', 'well', 'index', '_ring', '_refs')
+
+    def __init__(self, ring, index, image):
+        self._ring = weakref.ref(ring)  # no reference cycle: a ring is freed as soon as it is dropped
+        self.index = index
+        self.image = image
+        self.num = -1
+        self.frame_id = -1  # camera FrameID
+        self.timestamp = 0  # camera timestamp (ns)
+        self.received = 0.0  # time.perf_counter() when put() was called
+        self.well = None  # set by the demux stage
+        self._refs = 0
+
+    def __iter__(self):
+        # allows  display, num = frame
+        return iter((self.image, self.num))
+
+    # keep the slot alive for another holder (e.g. a writer thread); each retain needs a release
+    def retain(self):
+        ring = self._ring()
+        if ring is None:
+            raise ValueError('retain() on a frame of a closed ring')
+        with ring._cond:
+            if self._refs <= 0:
+                raise ValueError('retain() on a released ring frame')
+            self._refs += 1
+        return self
+
+    # hand the slot back to the ring once the last holder is done with it
+    # (nothing to do once the ring itself is gone; the image view keeps its memory alive)
+    def release(self):
+        ring = self._ring()
+        if ring is not None:
+            ring._release(self)
+
+
+class FrameRing:
+    def __init__(self, capacity_bytes, shape=None, dtype=np.uint8, min_slots=2, max_slots=4096):
+        self.capacity_bytes = int(capacity_bytes)
+        self.min_slots = min_slots
+        self.max_slots = max_slots
+        self.dtype = np.dtype(dtype)
+        self.maxsize = 0
+        self.shape = None
+        self._slabs = None
+        self._slots = []
+        self._frames = []
+        self._free = deque()
+        self._ready = deque()
+        self._cond = threading.Condition()
+        self.on_ready = None  # called after each put, e.g. to wake a loop waiting on several sources
+        if shape is not None:
+            self._allocate(tuple(shape))
+
+    # allocates every slot up front and writes it, so the hot path never faults a page in
+    # (np.zeros maps untouched zero pages that would only be faulted in by the first put)
+    def _allocate(self, shape):
+        frame_bytes = int(np.prod(shape)) * self.dtype.itemsize
+        nslots = min(self.max_slots, max(self.min_slots, self.capacity_bytes // frame_bytes))
+        self._slabs = np.empty((nslots,) + shape, dtype=self.dtype)
+        self._slabs.fill(0)
+        self._slots = list(self._slabs)
+        self._frames = []
+        for i in range(nslots):
+            view = self._slabs[i].view()
+            view.flags.writeable = False
+            self._frames.append(RingFrame(self, i, view))
+        self._free = deque(range(nslots - 1, -1, -1))  # a stack: slot 0 is taken first
+        self._ready = deque()
+        self.shape = shape
+        self.maxsize = nslots
+
+    @property
+    def nbytes(self):
+        return 0 if self._slabs is None else self._slabs.nbytes
+
+    def qsize(self):
+        return len(self._ready)
+
+    def empty(self):
+        return len(self._ready) == 0
+
+    def full(self):
+        return self._slabs is not None and len(self._free) == 0
+
+    # fraction of the slots that are queued or held (0.0 before the first frame)
+    def fill(self):
+        if not self.maxsize:
+            return 0.0
+        return 1.0 - len(self._free) / self.maxsize
+
+    # number of slots held by consumers (dequeued but not yet released)
+    def in_use(self):
+        return self.maxsize - len(self._free) - len(self._ready)
+
+    # copies image into a free slot and queues it; blocks like Queue.put when all slots are taken
+    # (received defaults to now; a stage that forwards frames passes on the original time)
+    def put(self, image, num, block=True, timeout=None, frame_id=-1, timestamp=0, received=None):
+        if received is None:
+            received = time.perf_counter()
+        with self._cond:
+            if self._slabs is None:
+                self._allocate(tuple(image.shape))
+            elif tuple(image.shape) != self.shape:
+                raise ValueError('frame shape {} does not match ring slots {}'.format(image.shape, self.shape))
+            if not self._free:
+                if not block:
+                    raise Full
+                if timeout is None:
+                    while not self._free:
+                        self._cond.wait()
+                else:
+                    deadline = time.monotonic() + timeout
+                    while not self._free:
+                        remaining = deadline - time.monotonic()
+                        if remaining <= 0:
+                            raise Full
+                        self._cond.wait(remaining)
+            index = self._free.pop()  # the most recently released slot, still warm
+        # the copy happens outside the lock: the slot is owned by the producer until queued
+        np.copyto(self._slots[index], image, casting='unsafe')
+        with self._cond:
+            frame = self._frames[index]
+            frame.num = num
+            frame.frame_id = frame_id
+            frame.timestamp = timestamp
+            frame.received = received
+            frame.well = None
+            frame._refs = 1
+            self._ready.append(index)
+            self._cond.notify_all()
+        if self.on_ready is not None:
+            self.on_ready()
+
+    # returns the oldest queued RingFrame; the caller must release() it
+    def get(self, block=True, timeout=None):
+        with self._cond:
+            if not self._ready:
+                if not block:
+                    raise Empty
+                if timeout is None:
+                    while not self._ready:
+                        self._cond.wait()
+                else:
+                    deadline = time.monotonic() + timeout
+                    while not self._ready:
+                        remaining = deadline - time.monotonic()
+                        if remaining <= 0:
+                            raise Empty
+                        self._cond.wait(remaining)
+            return self._frames[self._ready.popleft()]
+
+    def _release(self, frame):
+        with self._cond:
+            if frame._refs <= 0:
+                raise ValueError('ring frame released more often than retained')
+            frame._refs -= 1
+            if frame._refs == 0:
+                self._free.append(frame.index)
+                self._cond.notify_all()
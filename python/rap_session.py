@@ -0,0 +1,171 @@
+"""Hot reconfiguration of a running acquisition session.
+
+Protocol steps of a multi-set experiment change the trigger mode, frame rate, exposure,
+gain or well count while the camera streams. LiveSession applies such a change set
+without stopping the stream: the frame pool, the writer and the display stay open.
+
+reconfigure(changes) hands the camera part (trigger, framerate, exposure, gain) to the
+camera control worker as one command, so the writes happen together and off the frame
+loop. The main loop calls frame(num) once per frame and tick() once per iteration; that
+is where the rest of a change takes effect, always between two frames: a new well count
+is passed to on_wells before the frame is routed, and once the camera writes are done the
+demultiplexer re-learns the trigger period. tick() finishes a change while no frames come
+in (e.g. in trigger mode with no triggers); wake() is called when the camera writes are
+done, so a sleeping loop does not wait for its timeout. Each finished change is reported
+once, by report(), with how many frames arrived while it was in flight (and their frame
+numbers), so those frames can be told apart in the recording.
+"""
+
+import logging
+import sys
+import threading
+import time
+
+CAMERA_KEYS = ("trigger", "framerate", "exposure", "gain")
+KEYS = CAMERA_KEYS + ("wells",)
+
+
+class Reconfiguration:
+    def __init__(self, number, changes, requested_frame, on_done=None):
+        self.number = number
+        self.on_done = on_done
+        self.changes = changes
+        self.requested_frame = requested_frame  # frames up to this one were taken with the old settings
+        self.applied_frame = None  # first frame taken after the change was complete
+        self.status = "pending"  # pending, applied, error
+        self.error = None
+        self.submitted = time.perf_counter()
+        self.duration = 0.0  # seconds until the change was complete
+        self._camera_done = threading.Event()
+        self._done = threading.Event()
+
+    # frames that arrived while the change was in flight
+    @property
+    def affected(self):
+        if self.applied_frame is None:
+            return 0
+        return max(self.applied_frame - self.requested_frame - 1, 0)
+
+    @property
+    def done(self):
+        return self._done.is_set()
+
+    def wait(self, timeout=None):
+        return self._done.wait(timeout)
+
+
+# default report: one py. line per finished change for node.js
+def report_to_stdout(rec):
+    changes = " ".join("{}={}".format(k, v) for k, v in rec.changes.items())
+    if rec.status == "error":
+        sys.stdout.write("py. Error - reconfigure {} failed: {}\n".format(changes, rec.error))
+    elif rec.affected:
+        sys.stdout.write("py. reconfigured {} in {:.1f} ms, {} frames during the change ({}-{})\n".format(
+            changes, rec.duration * 1000.0, rec.affected, rec.requested_frame + 1, rec.applied_frame - 1))
+    else:
+        sys.stdout.write("py. reconfigured {} in {:.1f} ms, no frames affected\n".format(changes, rec.duration * 1000.0))
+    sys.stdout.flush()
+
+
+class LiveSession:
+    # apply(cam, changes) writes the camera part of a change set; control is the
+    # CameraControl worker (None = apply inline); on_wells(wells) sets the well count;
+    # wake() is called from the worker once the camera writes of a change are done
+    def __init__(self, cam, apply, control=None, on_wells=None, demux=None, report=report_to_stdout, wake=None):
+        self.cam = cam
+        self._apply = apply
+        self.control = control
+        self.on_wells = on_wells
+        self.demux = demux
+        self._report = report
+        self._wake = wake
+        self._lock = threading.Lock()
+        self._in_flight = []
+        self.last_frame = 0
+        self.reconfigurations = 0
+        self.failed = 0
+        self.last = None
+
+    # starts a change set, e.g. {"trigger": True, "wells": 12}; returns its Reconfiguration.
+    # on_done(rec) is called once the change has taken effect (or failed)
+    def reconfigure(self, changes, on_done=None):
+        unknown = [k for k in changes if k not in KEYS]
+        if unknown:
+            raise ValueError("cannot reconfigure {}".format(", ".join(unknown)))
+        with self._lock:
+            self.reconfigurations += 1
+            rec = Reconfiguration(self.reconfigurations, dict(changes), self.last_frame, on_done)
+            self._in_flight.append(rec)
+        camera = {k: v for k, v in rec.changes.items() if k in CAMERA_KEYS}
+        if not camera:
+            rec._camera_done.set()
+        elif self.control is not None:
+            self.control.submit(("reconfigure", rec.number), self._apply_camera, rec, camera,
+                                label="reconfigure", quiet=True)  # reported once it has taken effect
+        else:
+            self._apply_camera(rec, camera)
+        return rec
+
+    # a failure is kept in the Reconfiguration and reported when the change is finished
+    def _apply_camera(self, rec, camera):
+        try:
+            self._apply(self.cam, camera)
+        except Exception as e:
+            rec.error = e
+        finally:
+            rec._camera_done.set()
+        if self._wake is not None:
+            self._wake()
+
+    # called by the main loop before frame num is routed; finishes changes between frames
+    def frame(self, num):
+        with self._lock:
+            self.last_frame = num
+        self._finish_done(num)
+
+    # called by the main loop every iteration, frames or not; finishes the changes whose camera
+    # writes are done, as of the next frame
+    def tick(self):
+        self._finish_done(self.last_frame + 1)
+
+    def _finish_done(self, num):
+        with self._lock:
+            if not self._in_flight:
+                return
+            finished = [rec for rec in self._in_flight if rec._camera_done.is_set()]
+            if not finished:
+                return
+            self._in_flight = [rec for rec in self._in_flight if rec not in finished]
+        for rec in finished:
+            self._finish(rec, num)
+
+    def _finish(self, rec, num):
+        rec.applied_frame = num
+        rec.duration = time.perf_counter() - rec.submitted
+        if rec.error is None:
+            if "wells" in rec.changes and self.on_wells is not None:
+                self.on_wells(rec.changes["wells"])
+            if self.demux is not None and ("trigger" in rec.changes or "framerate" in rec.changes):
+                self.demux.recalibrate()  # the trigger period changed
+                if "trigger" in rec.changes:
+                    self.demux.freerun = not rec.changes["trigger"]
+            rec.status = "applied"
+        else:
+            rec.status = "error"
+            self.failed += 1
+        self.last = rec
+        rec._done.set()
+        logging.info("reconfigure {} {}: frames {}..{} affected {} in {:.1f} ms{}".format(
+            rec.changes, rec.status, rec.requested_frame, rec.applied_frame, rec.affected, rec.duration * 1000.0,
+            "" if rec.error is None else " ({})".format(rec.error)))
+        if self._report is not None:
+            self._report(rec)
+        if rec.on_done is not None:
+            rec.on_done(rec)
+
+    def summary(self):
+        return {
+            "reconfigurations": self.reconfigurations,
+            "failed": self.failed,
+            "in_flight": len(self._in_flight),
+        }
@@ -0,0 +1,212 @@
+"""Differential camera settings: switch trigger/freerun profiles with a few feature writes.
+
+config/trigger.xml and config/freerun.xml are full VmbPy feature dumps (~100 KB, several
+hundred camera features) that differ in about twenty of them, yet cam.load_settings writes
+all of them on every switch. SettingsEngine parses each profile once into a feature map
+(cached until the file changes) and remembers what it last applied to the camera. The
+first apply is a normal full load_settings; after that only the features whose profile
+value differs from the remembered state are read back from the camera and written if
+they really differ.
+
+Writes go in dependency order - FEATURE_ORDER first (trigger before exposure before
+frame rate, ...), then file order - with the features of a selector group written after
+setting their selector, and the selectors put back afterwards. Writes the camera rejects
+are retried in further passes, like VmbPy does, up to the profile's MaxIterations.
+Features written outside the engine (set_gain, set_exposure...) must be forget()-ten so
+the next apply checks them against the camera again.
+"""
+
+import logging
+import math
+import os
+import threading
+import time
+import xml.etree.ElementTree as ET
+
+# written before every other feature, in this order
+FEATURE_ORDER = (
+    "AcquisitionMode", "PixelFormat", "BinningHorizontal", "BinningVertical",
+    "Width", "Height", "OffsetX", "OffsetY",
+    "TriggerSelector", "TriggerMode", "TriggerSource", "TriggerActivation", "TriggerDelay",
+    "ExposureMode", "ExposureAuto", "ExposureTime",
+    "GainSelector", "GainAuto", "Gain",
+    "AcquisitionFrameRateEnable", "AcquisitionFrameRate",
+)
+
+_profiles = {}  # abspath -> (mtime, SettingsProfile)
+
+
+class SettingsProfile:
+    # features maps (selector, selector_value, name) -> (value, type); selector is None
+    # for features outside a SelectorGroup. Only RemoteDevice (camera) features are kept.
+    def __init__(self, path, features, max_iterations=10):
+        self.path = path
+        self.features = features
+        self.max_iterations = max_iterations
+
+    def __len__(self):
+        return len(self.features)
+
+
+def parse_profile(path):
+    root = ET.parse(path).getroot()
+    max_iterations = 10
+    el = root.find("SettingsStruct/MaxIterations")
+    if el is not None and el.get("Value", "").isdigit():
+        max_iterations = int(el.get("Value"))
+    features = {}
+    for device in root.iter("RemoteDevice"):
+        for el in device:
+            if el.tag == "Feature":
+                features[(None, None, el.get("Name"))] = (el.get("Value"), el.get("Type"))
+            elif el.tag == "SelectorGroup":
+                for child in el.iter("Feature"):
+                    features[(el.get("Name"), el.get("Value"), child.get("Name"))] = (child.get("Value"), child.get("Type"))
+    return SettingsProfile(str(path), features, max_iterations)
+
+
+# parsed profile of path, cached until the file is modified
+def load_profile(path):
+    key = os.path.abspath(path)
+    mtime = os.path.getmtime(key)
+    cached = _profiles.get(key)
+    if cached is not None and cached[0] == mtime:
+        return cached[1]
+    profile = parse_profile(key)
+    _profiles[key] = (mtime, profile)
+    return profile
+
+
+# profile value as the python value a feature get()/set() uses
+def convert(value, type_):
+    match type_:
+        case "Float":
+            return float(value)
+        case "Int":
+            return int(value)
+        case "Bool":
+            return value not in ("0", "false", "False")
+    return value
+
+
+def same_value(current, value, type_):
+    target = convert(value, type_)
+    if type_ == "Float":
+        try:
+            return math.isclose(float(current), target, rel_tol=1e-6, abs_tol=1e-9)
+        except (TypeError, ValueError):
+            return False
+    if type_ in ("Enum", "String"):
+        return str(current) == target
+    return current == target
+
+
+def write_order(key, index):
+    selector, _, name = key
+    rank_name = selector if selector is not None else name
+    rank = FEATURE_ORDER.index(rank_name) if rank_name in FEATURE_ORDER else len(FEATURE_ORDER)
+    return (rank, index)
+
+
+class SettingsEngine:
+    def __init__(self, cam, persist_type=None):
+        self.cam = cam
+        self.persist_type = persist_type
+        self.state = None  # key -> profile value the camera holds; None until the first full load
+        self.last = None  # result of the last apply()
+        self._lock = threading.Lock()
+
+    # features written outside the engine are checked against the camera at the next apply
+    def forget(self, *names):
+        with self._lock:
+            if self.state is None:
+                return
+            for key in [k for k in self.state if k[2] in names]:
+                del self.state[key]
+
+    # brings the camera to the profile in path; returns a summary dict
+    def apply(self, path):
+        with self._lock:
+            start = time.perf_counter()
+            if not os.path.isfile(path):  # let the camera report (or ignore) a missing file as before
+                self.cam.load_settings(path, self.persist_type)
+                return None
+            profile = load_profile(path)
+            if self.state is None:
+                self.cam.load_settings(path, self.persist_type)
+                self.state = {key: value for key, (value, _) in profile.features.items()}
+                result = {"full": True, "changed": len(profile), "written": len(profile), "failed": []}
+            else:
+                result = self._apply_diff(profile)
+            result["file"] = os.path.basename(path)
+            result["ms"] = (time.perf_counter() - start) * 1000.0
+            logging.info("camera settings {}".format(result))
+            self.last = result
+            return result
+
+    def _apply_diff(self, profile):
+        changed = [(write_order(key, i), key) for i, (key, (value, _)) in enumerate(profile.features.items())
+                   if self.state.get(key) != value]
+        changed.sort()
+        pending = [key for _, key in changed]
+        selectors = {}  # selector -> value before the engine moved it
+        written = []
+        missing = []  # features this camera does not have
+        readonly = []  # features the camera would not let us write
+        for _ in range(max(profile.max_iterations, 1)):
+            failed = []
+            for key in pending:
+                value, type_ = profile.features[key]
+                try:
+                    outcome = self._write(key, value, type_, selectors)
+                    if outcome in ("written", "same"):  # only then does the camera hold the value
+                        self.state[key] = value
+                        if outcome == "written":
+                            written.append(key[2])
+                    else:
+                        self.state.pop(key, None)
+                        (missing if outcome == "missing" else readonly).append(key[2])
+                except Exception as e:
+                    failed.append((key, e))
+            if not failed or len(failed) == len(pending):
+                break
+            pending = [key for key, _ in failed]
+        self._restore_selectors(profile, selectors)
+        for key, e in failed:
+            self.state.pop(key, None)
+            logging.warning("camera settings: could not write {}: {}".format(key[2], e))
+        return {"full": False, "changed": len(changed), "written": len(written),
+                "missing": len(missing), "readonly": len(readonly), "failed": [key[2] for key, _ in failed]}
+
+    # writes one feature if the camera does not hold the value yet;
+    # returns "written", "same", "readonly" or "missing"
+    def _write(self, key, value, type_, selectors):
+        selector, selector_value, name = key
+        try:
+            sel = self.cam.get_feature_by_name(selector) if selector is not None else None
+            feature = self.cam.get_feature_by_name(name)
+        except Exception:
+            return "missing"
+        if sel is not None:
+            current = str(sel.get())
+            selectors.setdefault(selector, current)
+            if current != selector_value:
+                sel.set(selector_value)
+        if not feature.is_writeable():
+            return "readonly"
+        if same_value(feature.get(), value, type_):
+            return "same"
+        feature.set(convert(value, type_))
+        return "written"
+
+    # puts every selector the engine moved back to the profile's value (or where it was)
+    def _restore_selectors(self, profile, selectors):
+        for selector, before in selectors.items():
+            target = profile.features.get((None, None, selector), (before, "Enum"))[0]
+            try:
+                sel = self.cam.get_feature_by_name(selector)
+                if str(sel.get()) != target:
+                    sel.set(target)
+                self.state[(None, None, selector)] = target
+            except Exception as e:
+                logging.warning("camera settings: could not restore {}: {}".format(selector, e))
@@ -0,0 +1,370 @@
+"""Simulated VmbPy camera for running vimba_rap3 without hardware.
+
+SimCamera produces Mono8 frames (816x624 by default) at a set frame rate with the
+same one-LED-per-frame well interleave that the Arduino produces, and can inject
+incomplete and dropped frames. It implements the parts of the VmbPy Camera/Frame
+API that vimba_rap3 uses, so the acquisition -> save -> display path runs unchanged.
+
+When VimbaX is not installed, vmbpy fails on import; this module then also provides
+minimal stand-ins for the vmbpy names vimba_rap3 needs (FrameStatus, PixelFormat, ...)
+so the program can still be started with --sim on a headless box.
+"""
+
+import logging
+import threading
+import time
+import xml.etree.ElementTree as ET
+from collections import deque
+from pathlib import Path
+
+import numpy as np
+
+from rap_convert import MONO_SHIFT
+
+try:
+    from vmbpy import (FrameStatus, PixelFormat, PersistType, VmbCameraError, VmbFeatureError,
+                       intersect_pixel_formats, COLOR_PIXEL_FORMATS, MONO_PIXEL_FORMATS)
+    VMBPY_AVAILABLE = True
+except Exception:  # vmbpy raises VmbSystemError (not ImportError) when no transport layer is found
+    from enum import IntEnum
+
+    VMBPY_AVAILABLE = False
+
+    class FrameStatus(IntEnum):
+        Complete = 0
+        Incomplete = -1
+        TooSmall = -2
+        Invalid = -3
+
+    class PersistType(IntEnum):
+        All = 0
+        Streamable = 1
+        NoLUT = 2
+
+    class PixelFormat(IntEnum):
+        Mono8 = 0x01080001
+        Mono10 = 0x01100003
+        Mono12 = 0x01100005
+        Mono16 = 0x01100007
+        Bgr8 = 0x02180015
+        Rgb8 = 0x02180014
+
+        def get_convertible_formats(self):
+            return (PixelFormat.Mono8, PixelFormat.Bgr8, PixelFormat.Rgb8)
+
+    MONO_PIXEL_FORMATS = (PixelFormat.Mono8, PixelFormat.Mono10, PixelFormat.Mono12, PixelFormat.Mono16)
+    COLOR_PIXEL_FORMATS = (PixelFormat.Bgr8, PixelFormat.Rgb8)
+
+    def intersect_pixel_formats(fmts1, fmts2):
+        return tuple(set(fmts1).intersection(set(fmts2)))
+
+    class VmbCameraError(Exception):
+        pass
+
+    class VmbFeatureError(Exception):
+        pass
+
+
+__all__ = [
+    'VmbSystem', 'Camera', 'Stream', 'Frame',
+    'FrameStatus', 'PixelFormat', 'PersistType',
+    'VmbCameraError', 'VmbFeatureError',
+    'intersect_pixel_formats', 'COLOR_PIXEL_FORMATS', 'MONO_PIXEL_FORMATS',
+]
+
+logger = logging.getLogger(__name__)
+
+
+class SimFeature:
+    def __init__(self, name, value, writeable=True):
+        self._name = name
+        self._value = value
+        self._writeable = writeable
+        self.on_set = None
+
+    def get_name(self):
+        return self._name
+
+    def get(self):
+        return self._value
+
+    def set(self, value):
+        if not self._writeable:
+            raise VmbFeatureError('Feature \'{}\' is not writeable.'.format(self._name))
+        self._value = value
+        if self.on_set is not None:
+            self.on_set(value)
+
+    def is_writeable(self):
+        return self._writeable
+
+
+class SimFrame:
+    def __init__(self, width, height, pixel_format=None):
+        self._pixel_format = PixelFormat.Mono8 if pixel_format is None else pixel_format
+        self._buffer = np.zeros((height, width, 1), dtype=np.uint16 if self._pixel_format.name in MONO_SHIFT else np.uint8)
+        self._status = FrameStatus.Complete
+        self._id = 0
+        self._timestamp = 0
+
+    def __str__(self):
+        return 'SimFrame(id={}, status={})'.format(self._id, self._status)
+
+    def get_status(self):
+        return self._status
+
+    def get_id(self):
+        return self._id
+
+    def get_timestamp(self):
+        return self._timestamp
+
+    def get_width(self):
+        return self._buffer.shape[1]
+
+    def get_height(self):
+        return self._buffer.shape[0]
+
+    def get_pixel_format(self):
+        return self._pixel_format
+
+    # like VmbPy, a conversion allocates a new frame
+    def convert_pixel_format(self, fmt):
+        if fmt == self._pixel_format:
+            return self
+        if fmt == PixelFormat.Mono8 and self._pixel_format.name in MONO_SHIFT:
+            converted = SimFrame(self.get_width(), self.get_height())
+            converted._buffer = (self._buffer >> MONO_SHIFT[self._pixel_format.name]).astype(np.uint8)
+            converted._status, converted._id, converted._timestamp = self._status, self._id, self._timestamp
+            return converted
+        converted = SimFrame(self.get_width(), self.get_height())
+        converted._buffer = np.repeat(self._buffer, 3, axis=2)
+        converted._status, converted._id, converted._timestamp = self._status, self._id, self._timestamp
+        return converted
+
+    # like VmbPy, both of these are views on the frame buffer, not copies
+    def as_numpy_ndarray(self):
+        return self._buffer
+
+    def as_opencv_image(self):
+        return self._buffer
+
+
+class SimStream:
+    def __init__(self, cam):
+        self._cam = cam
+
+
+class SimCamera:
+    def __init__(self, fps=100.0, wells=24, width=816, height=624,
+                 incomplete_rate=0.0, drop_rate=0.0, seed=0, camera_id='SIM0', pixel_format=None):
+        self._id = camera_id
+        self.width = width
+        self.height = height
+        self.wells = wells
+        self.incomplete_rate = incomplete_rate
+        self.drop_rate = drop_rate
+        self._rng = np.random.default_rng(seed)
+        # Mono8, or an unpacked Mono10/12/16 format whose frames need converting like a real sensor
+        self._pixel_format = PixelFormat.Mono8 if pixel_format is None else pixel_format
+        self._templates = self._make_templates()
+        self._stream = SimStream(self)
+        self._features = {}
+        for name, value in (('ExposureAuto', 'Off'), ('BalanceWhiteAuto', 'Off'),
+                            ('ExposureTime', 9689.838), ('Gain', 0.0),
+                            ('AcquisitionFrameRateEnable', True), ('AcquisitionFrameRate', float(fps)),
+                            ('TriggerSelector', 'FrameStart'), ('TriggerMode', 'Off'),
+                            ('TriggerSource', 'Line0'), ('TriggerActivation', 'RisingEdge')):
+            self._features[name] = SimFeature(name, value)
+        self._features['DeviceTemperature'] = SimFeature('DeviceTemperature', 40.0, writeable=False)
+        self._features['Width'] = SimFeature('Width', width, writeable=False)
+        self._features['Height'] = SimFeature('Height', height, writeable=False)
+        self._features['AcquisitionFrameRate'].on_set = self._set_fps
+        self._period = 1.0 / fps
+
+        self._handler = None
+        self._thread = None
+        self._running = False
+        self._free = deque()
+        self._free_lock = threading.Lock()
+
+        # what the simulation did, for benchmarks and tests
+        self.frames_generated = 0
+        self.frames_delivered = 0
+        self.frames_incomplete = 0
+        self.frames_dropped = 0
+        self.frames_no_buffer = 0
+        self.settings_loaded = []
+
+    def __str__(self):
+        return 'SimCamera(id={})'.format(self._id)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.stop_streaming()
+        return False
+
+    def __getattr__(self, name):
+        features = self.__dict__.get('_features', {})
+        if name in features:
+            return features[name]
+        raise AttributeError(name)
+
+    def _set_fps(self, val):
+        self._period = 1.0 / float(val)
+
+    # the mean brightness of the frames of a well: every well is lit a little differently
+    def well_level(self, well):
+        return 40 + 160 * well // self.wells
+
+    # one pre-rendered Mono8 image per well, the whole frame showing that well: textured
+    # background at the well's brightness level
+    def _make_templates(self):
+        y, x = np.mgrid[0:self.height, 0:self.width]
+        texture = (10 * np.sin(x / 37.0) * np.cos(y / 23.0)
+                   + self._rng.normal(0, 3, (self.height, self.width)))
+        templates = np.empty((self.wells, self.height, self.width, 1), dtype=np.uint8)
+        for w in range(self.wells):
+            templates[w, :, :, 0] = np.clip(texture + self.well_level(w), 0, 255)
+        if self._pixel_format.name in MONO_SHIFT:
+            templates = templates.astype(np.uint16) << MONO_SHIFT[self._pixel_format.name]
+        return templates
+
+    def get_id(self):
+        return self._id
+
+    def get_streams(self):
+        return []
+
+    def get_feature_by_name(self, name):
+        try:
+            return self._features[name]
+        except KeyError:
+            raise VmbFeatureError('Feature \'{}\' not found.'.format(name))
+
+    def get_all_features(self):
+        return tuple(self._features.values())
+
+    def get_pixel_formats(self):
+        return (self._pixel_format,)
+
+    def get_pixel_format(self):
+        return self._pixel_format
+
+    def set_pixel_format(self, fmt):
+        self._pixel_format = fmt
+
+    # applies the features of a VmbPy settings file that the simulation knows about
+    def load_settings(self, settings_file, persist_type=None):
+        path = Path(settings_file)
+        if not path.exists():
+            logger.warning('sim camera: settings file {} not found, ignored'.format(settings_file))
+            return
+        for el in ET.parse(path).getroot().iter('Feature'):
+            feature = self._features.get(el.get('Name'))
+            if feature is None or not feature.is_writeable():
+                continue
+            value = el.get('Value')
+            match el.get('Type'):
+                case 'Float':
+                    value = float(value)
+                case 'Int':
+                    value = int(value)
+                case 'Bool':
+                    value = value not in ('0', 'false', 'False')
+            feature.set(value)
+        self.settings_loaded.append(str(settings_file))
+
+    def is_streaming(self):
+        return self._running
+
+    def start_streaming(self, handler, buffer_count=5, allocation_mode=None):
+        if self._running:
+            raise VmbCameraError('Camera \'{}\' is already streaming.'.format(self._id))
+        self._handler = handler
+        self._free = deque(SimFrame(self.width, self.height, self._pixel_format) for _ in range(buffer_count))
+        self._running = True
+        self._thread = threading.Thread(target=self._run, name='SimCamera')
+        self._thread.daemon = True
+        self._thread.start()
+
+    def stop_streaming(self):
+        self._running = False
+        if self._thread is not None and self._thread is not threading.current_thread():
+            self._thread.join()
+        self._thread = None
+
+    def queue_frame(self, frame):
+        with self._free_lock:
+            self._free.append(frame)
+
+    # acquisition thread: emits one frame per period, paced against absolute deadlines
+    def _run(self):
+        frame_id = 0
+        t_start = time.perf_counter()
+        deadline = t_start
+        while self._running:
+            now = time.perf_counter()
+            if now < deadline:
+                time.sleep(deadline - now)
+            deadline += self._period
+            well = frame_id % self.wells
+            fid = frame_id
+            frame_id += 1
+            self.frames_generated += 1
+
+            if self.drop_rate > 0 and self._rng.random() < self.drop_rate:
+                self.frames_dropped += 1
+                continue
+            with self._free_lock:
+                frame = self._free.popleft() if self._free else None
+            if frame is None:
+                # no buffer queued: the camera loses the frame, exactly like the real transport
+                self.frames_no_buffer += 1
+                continue
+
+            np.copyto(frame._buffer, self._templates[well])
+            frame._id = fid
+            frame._timestamp = time.perf_counter_ns()
+            if self.incomplete_rate > 0 and self._rng.random() < self.incomplete_rate:
+                frame._status = FrameStatus.Incomplete
+                frame._buffer[self.height // 2:] = 0
+                self.frames_incomplete += 1
+            else:
+                frame._status = FrameStatus.Complete
+
+            self.frames_delivered += 1
+            try:
+                self._handler(self, self._stream, frame)
+            except Exception:
+                logger.exception('sim camera: frame handler raised')
+
+
+class VmbSystem:
+    # stand-in for vmbpy.VmbSystem; only used when VimbaX is not installed
+    _instance = None
+
+    @classmethod
+    def get_instance(cls):
+        if cls._instance is None:
+            cls._instance = cls()
+        return cls._instance
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        return False
+
+    def get_all_cameras(self):
+        return ()
+
+    def get_camera_by_id(self, camera_id):
+        raise VmbCameraError('No camera with id \'{}\' (VimbaX not installed).'.format(camera_id))
+
+
+Camera = SimCamera
+Stream = SimStream
+Frame = SimFrame
@@ -0,0 +1,183 @@
+"""Per-well stacked recording format.
+
+A recording session is a directory holding, for every well k:
+
+    wellKK.rap   a 64 byte header followed by raw frames at a fixed stride, so frame t
+                 of a well starts at HEADER_BYTES + t * frame_bytes
+    wellKK.idx   one 16 byte record per frame: (frame number, timestamp in ns)
+
+plus session.json with the session metadata. Frames are appended per well instead of
+written as one TIFF per frame, so writes are sequential and reading frame (well, t)
+back is one seek.
+
+StackSession is the writing side: reserve() hands out the next t of a well in
+acquisition order (main loop), and the returned target is called with the image by
+a writer thread. Writers may finish out of order; each frame goes to its own offset.
+StackFile reads one well file back.
+"""
+
+import functools
+import json
+import os
+import struct
+import threading
+import time
+from pathlib import Path
+
+import numpy as np
+
+MAGIC = b'RAPSTACK'
+VERSION = 1
+HEADER = struct.Struct('<8sHHIII8sQ')  # magic, version, well, height, width, channels, dtype, frame_bytes
+HEADER_BYTES = 64
+INDEX = struct.Struct('<qq')  # frame number, timestamp (ns)
+SESSION_FILE = 'session.json'
+
+
+def well_filename(well, suffix):
+    return 'well{:02d}.{}'.format(well, suffix)
+
+
+def is_stack_session(directory):
+    return (Path(directory) / SESSION_FILE).exists()
+
+
+class StackSession:
+    def __init__(self, directory, wells, metadata=None):
+        self.directory = Path(directory)
+        self.directory.mkdir(parents=True, exist_ok=True)
+        self.wells = wells
+        self.metadata = dict(metadata or {})
+        self.created = time.strftime('%Y-%m-%dT%H:%M:%S')
+        self.reserved = [0] * wells  # next t per well (main loop only)
+        self.written = [0] * wells
+        self.shape = None
+        self.dtype = None
+        self._files = [None] * wells
+        self._locks = [threading.Lock() for _ in range(wells)]
+        self._write_session_file()
+
+    def _write_session_file(self):
+        info = {
+            'format': 'rapstack',
+            'version': VERSION,
+            'wells': self.wells,
+            'created': self.created,
+            'header_bytes': HEADER_BYTES,
+            'shape': list(self.shape) if self.shape else None,
+            'dtype': self.dtype.str if self.dtype is not None else None,
+            'frames': self.written,
+            'metadata': self.metadata,
+        }
+        (self.directory / SESSION_FILE).write_text(json.dumps(info, indent=2))
+
+    # allocates the next frame slot of a well; returns a target the writer calls with the image
+    def reserve(self, well, num, timestamp=None):
+        while well >= self.wells:  # the well count was raised mid-session
+            self.reserved.append(0)
+            self.written.append(0)
+            self._files.append(None)
+            self._locks.append(threading.Lock())
+            self.wells += 1
+        t = self.reserved[well]
+        self.reserved[well] = t + 1
+        if timestamp is None:
+            timestamp = time.time_ns()
+        return functools.partial(self.write, well, t, num, timestamp)
+
+    def _open_well(self, well, image):
+        if self.shape is None:
+            self.shape = tuple(image.shape)
+            self.dtype = image.dtype
+        elif tuple(image.shape) != self.shape or image.dtype != self.dtype:
+            raise ValueError('frame {} {} does not match session frames {} {}'.format(
+                image.shape, image.dtype, self.shape, self.dtype))
+        height, width = self.shape[:2]
+        channels = self.shape[2] if len(self.shape) > 2 else 1
+        data = open(self.directory / well_filename(well, 'rap'), 'wb+')
+        header = HEADER.pack(MAGIC, VERSION, well, height, width, channels,
+                             self.dtype.str.encode(), image.nbytes)
+        data.write(header.ljust(HEADER_BYTES, b'\0'))
+        index = open(self.directory / well_filename(well, 'idx'), 'wb+')
+        self._files[well] = (data, index)
+        return self._files[well]
+
+    # writes frame t of a well at its fixed offset (thread safe, any order)
+    def write(self, well, t, num, timestamp, image):
+        with self._locks[well]:
+            files = self._files[well] or self._open_well(well, image)
+            data, index = files
+            data.seek(HEADER_BYTES + t * image.nbytes)
+            data.write(np.ascontiguousarray(image).data)
+            index.seek(t * INDEX.size)
+            index.write(INDEX.pack(num, timestamp))
+            self.written[well] += 1
+        return True
+
+    # closes the well files and records the final frame counts; pending writes must be flushed first
+    def close(self):
+        for well in range(self.wells):
+            with self._locks[well]:
+                if self._files[well] is not None:
+                    for f in self._files[well]:
+                        f.close()
+                    self._files[well] = None
+        self._write_session_file()
+
+
+class StackFile:
+    # reads back one well file; frames are counted from the file sizes, so a session
+    # that was never closed (e.g. after a crash) can still be read
+    def __init__(self, path):
+        self.path = Path(path)
+        with open(self.path, 'rb') as f:
+            magic, version, well, height, width, channels, dtype, frame_bytes = \
+                HEADER.unpack(f.read(HEADER.size))
+        if magic != MAGIC:
+            raise ValueError('{} is not a RAP stack file'.format(self.path))
+        if version > VERSION:
+            raise ValueError('{} has unsupported version {}'.format(self.path, version))
+        self.well = well
+        self.dtype = np.dtype(dtype.rstrip(b'\0').decode())
+        self.shape = (height, width, channels) if channels > 1 else (height, width)
+        self.frame_bytes = frame_bytes
+        self.index_path = self.path.with_suffix('.idx')
+        data_frames = (os.path.getsize(self.path) - HEADER_BYTES) // frame_bytes
+        index_frames = os.path.getsize(self.index_path) // INDEX.size if self.index_path.exists() else data_frames
+        self.frames = int(min(data_frames, index_frames))
+
+    def __len__(self):
+        return self.frames
+
+    # frame t as an array - one seek and one read
+    def read(self, t):
+        if not 0 <= t < self.frames:
+            raise IndexError('frame {} out of range (0..{})'.format(t, self.frames - 1))
+        with open(self.path, 'rb') as f:
+            f.seek(HEADER_BYTES + t * self.frame_bytes)
+            buf = f.read(self.frame_bytes)
+        return np.frombuffer(buf, dtype=self.dtype).reshape(self.shape)
+
+    # all frames as a read-only (T, H, W[, C]) np.memmap; slicing it does not copy or read
+    def memmap(self):
+        if self.frames == 0:
+            return np.empty((0,) + self.shape, dtype=self.dtype)
+        return np.memmap(self.path, dtype=self.dtype, mode='r', offset=HEADER_BYTES,
+                         shape=(self.frames,) + self.shape)
+
+    # (frame numbers, timestamps) of all frames
+    def index(self):
+        records = np.fromfile(self.index_path, dtype=np.dtype([('num', '<i8'), ('timestamp', '<i8')]),
+                              count=self.frames)
+        return records['num'], records['timestamp']
+
+
+def open_stack(directory):
+    directory = Path(directory)
+    info = json.loads((directory / SESSION_FILE).read_text())
+    files = {}
+    for well in range(info['wells']):
+        path = directory / well_filename(well, 'rap')
+        if path.exists():
+            files[well] = StackFile(path)
+    return info, files
@@ -0,0 +1,115 @@
+"""Framed command reader for the node.js -> python stdin channel.
+
+node.js sends commands as <command,arg,...> frames. read_commands reads stdin in blocks
+(os.read on the file descriptor returns whatever is available, so a command is handled
+as soon as its closing '>' arrives), splits the frames with an incremental
+CommandParser and puts only whole commands on the command queue.
+
+Each command is a Command - a str carrying `received`, the time.perf_counter() at which
+its last byte was read, so the main loop can log how long commands wait. Text outside
+<...> is discarded, a frame split across reads is completed by the next read, and a
+frame longer than max_length is dropped up to its closing '>'.
+"""
+
+import codecs
+import io
+import logging
+import os
+import time
+
+
+class Command(str):
+    received = 0.0
+
+    def __new__(cls, text, received):
+        cmd = super().__new__(cls, text)
+        cmd.received = received
+        return cmd
+
+
+class CommandParser:
+    def __init__(self, max_length=65536):
+        self.max_length = max_length
+        self._parts = []
+        self._length = 0
+        self._in_frame = False
+        self._oversize = False
+        self.commands = 0
+        self.discarded = 0  # characters outside any frame
+        self.oversize = 0  # frames dropped for exceeding max_length
+
+    @property
+    def pending(self):
+        return self._in_frame
+
+    # parses the next chunk of text; returns the commands completed by it
+    def feed(self, text, received=None):
+        if received is None:
+            received = time.perf_counter()
+        out = []
+        pos, end = 0, len(text)
+        while pos < end:
+            if not self._in_frame:
+                start = text.find('<', pos)
+                if start < 0:
+                    self.discarded += end - pos
+                    break
+                self.discarded += start - pos
+                self._in_frame = True
+                pos = start + 1
+                continue
+            close = text.find('>', pos)
+            piece = text[pos:end if close < 0 else close]
+            if not self._oversize:
+                self._length += len(piece)
+                if self._length > self.max_length:
+                    self._oversize = True
+                    self._parts = []
+                    logging.warning("stdin: dropping a command longer than {} characters".format(self.max_length))
+                else:
+                    self._parts.append(piece)
+            if close < 0:
+                break
+            if self._oversize:
+                self.oversize += 1
+            else:
+                out.append(Command("".join(self._parts), received))
+                self.commands += 1
+            self._parts = []
+            self._length = 0
+            self._in_frame = False
+            self._oversize = False
+            pos = close + 1
+        return out
+
+
+# returns a function reading the next block of text from stream ('' at end of input)
+def block_reader(stream, block_size=4096):
+    try:
+        fd = stream.fileno()
+    except (AttributeError, OSError, io.UnsupportedOperation):
+        fd = None
+    if fd is None:
+        return lambda: stream.read(block_size)
+    decoder = codecs.getincrementaldecoder(getattr(stream, 'encoding', None) or 'utf-8')(errors='replace')
+
+    def read():
+        while True:
+            data = os.read(fd, block_size)
+            text = decoder.decode(data, final=not data)
+            if text or not data:  # a block can end inside a multi-byte character
+                return text
+    return read
+
+
+# reads framed commands from stream until end of input and queues each one
+def read_commands(stream, command_queue, parser=None, block_size=4096):
+    if parser is None:
+        parser = CommandParser()
+    read = block_reader(stream, block_size)
+    while True:
+        text = read()
+        if not text:
+            return parser
+        for cmd in parser.feed(text):
+            command_queue.put(cmd)
@@ -0,0 +1,28 @@
+"""Well layout of the plate.
+
+The wells sit on the plate in a grid of rows x columns; well k is at row k // columns,
+column k % columns. well_grid() gives that grid for a well count, and the mosaic lays
+out its tiles in it. Every camera frame shows one well, the one whose LED was lit, and
+the displays and the simulated camera treat it that way.
+
+well_region() is the part of a frame a well would occupy if one frame showed the whole
+plate. Only the phase lock (off by default) samples frames in these regions.
+"""
+
+import math
+
+
+# rows x columns of the LED/well layout; 24 wells is the 4x6 plate used on the rig
+def well_grid(wells):
+    if wells == 24:
+        return (4, 6)
+    cols = int(math.ceil(math.sqrt(wells)))
+    rows = int(math.ceil(wells / cols))
+    return (rows, cols)
+
+
+# the pixel region (y0, y1, x0, x1) a well occupies in a frame of the given size
+def well_region(well, wells, width, height):
+    rows, cols = well_grid(wells)
+    r, c = divmod(well, cols)
+    return (r * height // rows, (r + 1) * height // rows, c * width // cols, (c + 1) * width // cols)
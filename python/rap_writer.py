@@ -0,0 +1,144 @@
+"""Background writer pool for saving frames without stalling the main loop.
+
+maybesaveimage hands each frame to a WriterPool instead of calling cv2.imwrite itself.
+The pool has a bounded queue and N worker threads (cv2.imwrite and file writes release
+the GIL, so threads overlap encoding and disk I/O without copying frames to another
+process). It keeps ordered completion accounting - every submission gets a sequence
+number and `completed_through` is the highest number up to which everything has been
+written - plus per-worker throughput stats, and flush() drains it.
+"""
+
+import logging
+import threading
+import time
+from queue import Queue
+
+logger = logging.getLogger(__name__)
+
+_STOP = object()
+
+
+class WriterStats:
+    def __init__(self, name):
+        self.name = name
+        self.frames = 0
+        self.bytes = 0
+        self.errors = 0
+        self.busy = 0.0  # seconds spent writing
+
+    def as_dict(self, elapsed):
+        return {
+            "name": self.name,
+            "frames": self.frames,
+            "bytes": self.bytes,
+            "errors": self.errors,
+            "busy_s": self.busy,
+            "fps": self.frames / self.busy if self.busy > 0 else 0.0,
+            "mb_per_s": self.bytes / 2**20 / self.busy if self.busy > 0 else 0.0,
+            "utilisation": self.busy / elapsed if elapsed > 0 else 0.0,
+        }
+
+
+class WriterPool:
+    # write(target, image) does the actual writing, e.g. cv2.imwrite(filename, image);
+    # it may return False to signal a failed write. on_written(frame, image, ok) is called
+    # by the worker after each write, before the ring frame is released
+    def __init__(self, write, workers=2, max_queued=64, name="writer", on_written=None):
+        self._write = write
+        self._on_written = on_written
+        self._queue = Queue(max_queued)
+        self._cond = threading.Condition()
+        self.submitted = 0
+        self.completed = 0
+        self.failed = 0
+        self.completed_through = -1  # every seq <= this has been written (or failed)
+        self._done_ahead = set()  # finished seqs above completed_through
+        self._started = time.perf_counter()
+        self.stats = [WriterStats("{}-{}".format(name, i)) for i in range(workers)]
+        self._threads = []
+        for st in self.stats:
+            t = threading.Thread(target=self._run, args=(st,), name=st.name)
+            t.daemon = True
+            t.start()
+            self._threads.append(t)
+
+    @property
+    def pending(self):
+        return self.submitted - self.completed
+
+    def qsize(self):
+        return self._queue.qsize()
+
+    # queues one frame; `frame` is an optional ring frame released once written.
+    # Blocks while the queue is full. Returns the sequence number of the submission.
+    def submit(self, target, image, frame=None):
+        with self._cond:
+            seq = self.submitted
+            self.submitted += 1
+        self._queue.put((seq, target, image, frame))
+        return seq
+
+    def _run(self, st):
+        while True:
+            item = self._queue.get()
+            if item is _STOP:
+                return
+            seq, target, image, frame = item
+            ok = False
+            t0 = time.perf_counter()
+            try:
+                ok = self._write(target, image) is not False
+            except Exception:
+                logger.exception("writer: failed to write {}".format(target))
+            st.busy += time.perf_counter() - t0
+            if self._on_written is not None:
+                try:
+                    self._on_written(frame, image, ok)
+                except Exception:
+                    logger.exception("writer: on_written failed")
+            if frame is not None:
+                frame.release()
+            if ok:
+                st.frames += 1
+                st.bytes += getattr(image, "nbytes", 0)
+            else:
+                st.errors += 1
+                logger.error("writer: could not write {}".format(target))
+            self._complete(seq, ok)
+
+    def _complete(self, seq, ok):
+        with self._cond:
+            self.completed += 1
+            if not ok:
+                self.failed += 1
+            self._done_ahead.add(seq)
+            while self.completed_through + 1 in self._done_ahead:
+                self.completed_through += 1
+                self._done_ahead.discard(self.completed_through)
+            self._cond.notify_all()
+
+    # waits until everything submitted so far is written; returns False on timeout
+    def flush(self, timeout=None):
+        with self._cond:
+            target = self.submitted - 1
+            return self._cond.wait_for(lambda: self.completed_through >= target, timeout)
+
+    # drains the queue and stops the workers
+    def close(self, timeout=None):
+        ok = self.flush(timeout)
+        for _ in self._threads:
+            self._queue.put(_STOP)
+        for t in self._threads:
+            t.join(timeout)
+        return ok
+
+    def summary(self):
+        elapsed = time.perf_counter() - self._started
+        return {
+            "submitted": self.submitted,
+            "completed": self.completed,
+            "failed": self.failed,
+            "completed_through": self.completed_through,
+            "queued": self.qsize(),
+            "writers": [st.as_dict(elapsed) for st in self.stats],
+        }
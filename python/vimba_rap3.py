@@ -28,22 +28,47 @@ OF THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
 
 # Imports to support specific programming functionalities
 from typing import Optional
-from queue import Queue
-from collections import deque
-import numpy as np
+from queue import Empty, Full
 import time
 import logging
 
 # Imports to access computer, files and internet
 import sys
-import requests
 import os
 import threading
 from pathlib import Path
 import re
 
-# Vimba sdk import
-from vmbpy import *
+# Vimba sdk import - when VimbaX is not installed, vmbpy raises on import and only the
+# simulated camera (--sim) can be used; rap_simcam then supplies the vmbpy names used here
+try:
+    from vmbpy import *
+except Exception:
+    from rap_simcam import *
+from rap_simcam import SimCamera
+from rap_ringbuffer import FrameRing
+from rap_writer import WriterPool
+from rap_stack import StackSession
+from rap_demux import WellDemux, WellQueues
+from rap_phaselock import PhaseLock
+from rap_mosaic import Mosaic
+from rap_display import DisplayThread
+from rap_preview import Preview
+from rap_stdin import CommandParser, read_commands
+from rap_control import CameraControl
+from rap_settings import SettingsEngine
+from rap_session import LiveSession
+from rap_protocol import ProtocolError, is_json_command, parse_request, reply, reply_error
+from rap_metrics import Metrics, MetricsReporter, serve_http
+from rap_profile import LoopProfiler
+from rap_buffers import BufferTuner
+from rap_convert import ConvertPool, mono8_converter
+from rap_events import EventSource, CommandQueue
+from rap_budget import MemoryBudget, SHED_DISPLAY, SHED_ANALYSIS, HISTORY_SHARE, RING_MIN_FRAMES
+from rap_history import WellHistory, history_depth
+from rap_pretrigger import PreTrigger
+from rap_wellstats import WellStats
+import functools
 
 
 # Setting config and data saving paths
@@ -69,9 +94,15 @@ save_max=1000 # Counter for how many frames have been saved so far
 number_of_wells=1
 process_well=-1
 alliedxy=[816,624] # Camera resolution
-salliedxy=[256,208]
+salliedxy=[256,208] # Preview resolution: frames are binned down to this for display
 #alliedxy=[int(816/4),int(624/4)]
 screenres=[1920,1080] # Full screen display resolution
+display_fps=30.0 # refresh cap of the display thread; 0 = as fast as frames arrive
+display_thread=None # shows the newest frame of each well, separate from acquisition and saving
+mosaic=None # mode 2 canvas, owned by the display thread
+display_wells=None # well count the windows are currently set up for
+preview_enabled=1 # 1 = display binned salliedxy previews, 0 = full resolution frames
+preview=None # owned by the display thread
 windowtitle = 'Well \'{}\'.'
 frame_array=[[1,1,1,1,1,1],
               [2,2,2,2,2,2],
@@ -87,16 +118,73 @@ vimbaconfigdirectory=defaultCameraConfigDirectory
 
 mode = 1 #indicate current mode
 
+# Simulated camera options (set with --sim... on the command line)
+simulate_camera=0 # 0 = use a real camera, 1 = use rap_simcam.SimCamera
+sim_fps=100.0
+sim_wells=24 # LEDs in the simulated interleave
+sim_incomplete=0.0 # fraction of frames delivered incomplete
+sim_drop=0.0 # fraction of frames dropped before delivery
+sim_pixel_format="" # pixel format name the simulated camera streams, e.g. Mono12 (default Mono8)
+
+memory_budget_mb=320 # memory for all frames in flight: the frame ring, the converter ring... (rap_budget)
+history_setting="2s" # per-well history of recent frames (rap_history): frames per well ("30") or seconds ("2s"); 0 = none
+# Frame buffers handed to the camera at start_streaming; with auto-tune the pool grows on incomplete frames (rap_buffers)
+buffer_count=10
+buffer_auto=0 # 1 = grow buffer_count up to buffer_max while streaming
+buffer_max=64
+# Threads converting frames that are not in opencv_display_format, so the camera callback only copies (rap_convert); 0 = convert in the callback
+convert_threads=2
+
+# Background writers used by maybesaveimage (None = write synchronously in the main loop)
+writer=None
+writer_threads=2
+writer_queue=64 # frames waiting to be written before maybesaveimage blocks
+
+# Recording format: "tiff" = one img#########_wellKK.tif per frame, "stack" = one raw stack file per well (rap_stack)
+save_format="tiff"
+stack_session=None
+
+# Checks the well assignment against the lit well in the frames and corrects the LED phase (rap_phaselock).
+# Off by default: it needs frames that show the whole plate, and has not been validated on rig frames
+phase_lock_enabled=0
+
+# Camera feature writes run in this worker while streaming (rap_control); None = write directly
+camera_control=None
+# Applies settings files as a diff against what the camera already holds (rap_settings); None = full load every time
+camera_settings=None
+# Reconfigures the running acquisition between frames (rap_session); None before streaming
+live_session=None
+# Recent frames of every well (rap_history) and the frame rate its depth was set for; None before streaming or with --history=0
+history=None
+history_fps=None
+# Backlog of a <savebuffer> still being handed to the writer (rap_pretrigger)
+pretrigger=None
+
+# Telemetry (rap_metrics): counters and per-stage latencies, reported as py.json metrics lines
+metrics=Metrics()
+metrics_interval=1.0 # seconds between reports, 0 = no reports
+metrics_port=0 # serve the latest report on http://127.0.0.1:port/metrics, 0 = off
+# Per-well brightness statistics (rap_wellstats), sent to node.js as py.json wellstats lines
+well_stats_interval=1.0 # seconds between reports, 0 = no statistics
+well_stats_step=2 # analyse every n-th pixel in both directions
+well_stats_every=1 # analyse every n-th frame of each well
+# Opt-in profiling (rap_profile): per-stage timers of the main loop, stack samples and cProfile
+profiler=LoopProfiler()
+profile_at_start="" # "on" or "cprofile" = start profiling with the stream (--profile)
+profile_directory=None # where profile dumps are written, None = the save root directory
+
 oldnodetext=""
 dosub=0
 cancel_main_loop=0 # Flag to terminate main loop
 
-#boolean variable to keep track of string start and stop from javascript.
-js_input_started=0
+#splits <...> commands from javascript out of the stdin stream (rap_stdin)
+stdin_parser=CommandParser()
 
+# The main loop sleeps on this until a frame or a command arrives or a timer is due (rap_events)
+events=EventSource()
+idle_timeout=0.25 # longest sleep, so a quit from a display window is noticed without frames
 # Queues allow multi-threaded handling of input and command processing
-stdin_input_queue = Queue()
-stdin_command_queue = Queue()
+stdin_command_queue = CommandQueue(events)
 
 # Sets up a logger for the current module to track errors, info, and debug output.
 logger = logging.getLogger(__name__)
@@ -128,6 +216,31 @@ def print_usage():
     print('    look at the process_js_command function in this program for details')
     print('examples:')
     print('    <startcamera> ; <quit> ;  <trigger,true> ')
+    print('options:')
+    print('    --sim[=fps]              use a simulated camera instead of a VmbPy camera')
+    print('    --sim-wells=n            number of LEDs in the simulated interleave (default 24)')
+    print('    --sim-incomplete=frac    fraction of simulated frames delivered incomplete')
+    print('    --sim-drop=frac          fraction of simulated frames dropped')
+    print('    --sim-format=name        pixel format of the simulated camera (Mono8, Mono10, Mono12, Mono16)')
+    print('    --savedir=path           root directory for saved images')
+    print('    --configdir=path         directory holding trigger.xml and freerun.xml')
+    print('    --memory-mb=n            MB preallocated for frames in flight (default 320); over it, display then analysis are shed')
+    print('    --history=n|Ns           keep the last n frames (or N seconds) of every well in memory for <savebuffer> (default 2s, 0 = none)')
+    print('    --buffers=n|auto         frame buffers queued to the camera (default 10); auto grows them on incomplete frames')
+    print('    --buffers-max=n          largest buffer count auto may grow to (default 64)')
+    print('    --converters=n           threads converting non-Mono8 frames off the camera callback (default 2, 0 = none)')
+    print('    --writers=n              background threads writing saved frames (default 2, 0 = none)')
+    print('    --format=tiff|stack      save one tif per frame, or one stacked file per well')
+    print('    --phase-lock=0|1         correct the well assignment from the lit well region of whole-plate frames (default 0)')
+    print('    --display-fps=n          refresh cap of the display (default 30, 0 = uncapped)')
+    print('    --preview=0|1            display binned 256x208 previews instead of full frames (default 1)')
+    print('    --metrics=s              seconds between py.json metrics reports on stdout (default 1, 0 = off)')
+    print('    --metrics-port=n         also serve the metrics on http://127.0.0.1:n/metrics')
+    print('    --well-stats=s           seconds between py.json per-well brightness statistics (default 1, 0 = off)')
+    print('    --well-stats-step=n      analyse every n-th pixel in x and y (default 2)')
+    print('    --well-stats-every=n     analyse every n-th frame of each well (default 1)')
+    print('    --profile[=cprofile]     time the main loop stages and sample stacks (cprofile: also run cProfile)')
+    print('    --profile-dir=path       directory for the profile dumps (default: the save root directory)')
     print()
 
 
@@ -177,6 +290,13 @@ def parse_args() -> Optional[str]:
             print_usage()
             sys.exit(0)
 
+    #options start with -- and may appear anywhere; the rest are positional
+    for arg in args:
+        if arg.startswith('--'):
+            parse_option(arg)
+    args = [arg for arg in args if not arg.startswith('--')]
+    argc = len(args)
+
     if argc > 2:
         abort(reason="Invalid number of arguments. Abort.", return_code=2, usage=True)
     
@@ -187,8 +307,91 @@ def parse_args() -> Optional[str]:
 
     return (mode,wells,slave_mode)
 
+# handles a single --name[=value] command line option
+def parse_option(arg):
+    global simulate_camera, sim_fps, sim_wells, sim_incomplete, sim_drop, sim_pixel_format, convert_threads
+    global savedirectory, defaultSaveRootDirectory, memory_budget_mb, history_setting, writer_threads, save_format, phase_lock_enabled, display_fps, preview_enabled
+    global metrics_interval, metrics_port, well_stats_interval, well_stats_step, well_stats_every, profile_at_start, profile_directory, buffer_count, buffer_auto, buffer_max
+    global defaultCameraConfigDirectory, defaultFreerunConfigfile, defaultTriggerConfigfile
+    name, _, value = arg[2:].partition('=')
+    try:
+        match name:
+            case "sim":
+                simulate_camera=1
+                if value:
+                    sim_fps=float(value)
+            case "sim-wells":
+                sim_wells=int(value)
+            case "sim-incomplete":
+                sim_incomplete=float(value)
+            case "sim-drop":
+                sim_drop=float(value)
+            case "sim-format":
+                if value not in ("Mono8", "Mono10", "Mono12", "Mono16"):
+                    raise ValueError(value)
+                sim_pixel_format=value
+            case "savedir":
+                savedirectory=value
+                defaultSaveRootDirectory=value
+            case "configdir":
+                defaultCameraConfigDirectory=value
+                defaultFreerunConfigfile=value+"/freerun.xml"
+                defaultTriggerConfigfile=value+"/trigger.xml"
+            case "memory-mb":
+                memory_budget_mb=int(value)
+            case "history":
+                history_depth(value, 1.0) #rejects what is neither frames nor seconds
+                history_setting=value
+            case "buffers":
+                if value=="auto":
+                    buffer_auto=1
+                else:
+                    buffer_count=int(value)
+                    if buffer_count<1:
+                        raise ValueError(value)
+            case "buffers-max":
+                buffer_max=int(value)
+            case "converters":
+                convert_threads=int(value)
+            case "writers":
+                writer_threads=int(value)
+            case "format":
+                if value not in ("tiff", "stack"):
+                    raise ValueError(value)
+                save_format=value
+            case "phase-lock":
+                phase_lock_enabled=int(value)
+            case "display-fps":
+                display_fps=float(value)
+            case "preview":
+                preview_enabled=int(value)
+            case "metrics":
+                metrics_interval=float(value)
+            case "metrics-port":
+                metrics_port=int(value)
+            case "well-stats":
+                well_stats_interval=float(value)
+            case "well-stats-step":
+                well_stats_step=max(1,int(value))
+            case "well-stats-every":
+                well_stats_every=max(1,int(value))
+            case "profile":
+                if value not in ("", "on", "cprofile"):
+                    raise ValueError(value)
+                profile_at_start=value or "on"
+            case "profile-dir":
+                profile_directory=value
+            case _:
+                abort(reason="Unknown option {}. Abort.".format(arg), return_code=2, usage=True)
+    except ValueError:
+        abort(reason="Invalid value for option {}. Abort.".format(arg), return_code=2, usage=True)
+
 # responsible for accessing and returning a camera object
 def get_camera(camera_id: Optional[str]) -> Camera:
+    if simulate_camera==1:
+        return SimCamera(fps=sim_fps, wells=sim_wells, incomplete_rate=sim_incomplete, drop_rate=sim_drop,
+                         pixel_format=PixelFormat[sim_pixel_format] if sim_pixel_format else None)
+
     with VmbSystem.get_instance() as vmb: #Initializes the Vimba system
         if camera_id:
             try:
@@ -208,14 +411,30 @@ def get_camera(camera_id: Optional[str]) -> Camera:
 
 # For loading specific settings for the camera
 
+# runs a camera write on the camera control worker (coalesced with queued writes of the same key), or directly before streaming
+def camera_call(key, func, cam, *args, label=None):
+     if camera_control is not None:
+          return camera_control.submit(key, func, cam, *args, label=label)
+     return func(cam, *args)
+
 def load_camera_settings(cam: Camera, settings_file):
-     cam.load_settings(settings_file, PersistType.All)
+     if camera_settings is not None and camera_settings.cam is cam:
+          camera_settings.apply(settings_file) #only the features that differ are written
+     else:
+          cam.load_settings(settings_file, PersistType.All)
+
+# tells the settings engine that a feature was written directly
+def settings_changed(cam, *names):
+     if camera_settings is not None and camera_settings.cam is cam:
+          camera_settings.forget(*names)
 
 def set_gain(cam: Camera, val):
      cam.Gain.set(val)
+     settings_changed(cam, "Gain")
      
 def set_exposure(cam: Camera, val): 
      cam.ExposureTime.set(val)
+     settings_changed(cam, "ExposureTime")
 
 
 
@@ -226,17 +445,56 @@ def set_framerate(cam: Camera, val):
   feature.set(True) #specifies 30FPS
   feature = cam.get_feature_by_name("AcquisitionFrameRate")
   feature.set(val)
+  settings_changed(cam, "AcquisitionFrameRateEnable", "AcquisitionFrameRate")
   # set the other features TriggerSelector and TriggerMode
   #feature = cam.get_feature_by_name("TriggerSelector")
   #feature.set("FrameStart")
   #feature = cam.get_feature_by_name("TriggerMode")
   #feature.set("Off")
+
+# applies the camera part of a reconfigure in dependency order: trigger profile, exposure, gain, frame rate
+def apply_camera_changes(cam: Camera, changes):
+     if "trigger" in changes:
+          load_camera_settings(cam, defaultTriggerConfigfile if changes["trigger"] else defaultFreerunConfigfile)
+     if "exposure" in changes:
+          set_exposure(cam, changes["exposure"])
+     if "gain" in changes:
+          set_gain(cam, changes["gain"])
+     if "framerate" in changes:
+          set_framerate(cam, changes["framerate"])
+
+# parses reconfigure arguments (trigger=1, fps=50, exposure=2000, gain=3, wells=12) into clamped values
+def parse_reconfigure(args):
+     changes={}
+     for arg in args:
+          name,_,value=arg.partition("=")
+          name=name.strip().lower()
+          value=value.strip().lower()
+          match name:
+               case "trigger" | "cameratrigger":
+                    if value not in ("1","true","0","false"):
+                         raise ValueError("trigger must be true/false or 1/0")
+                    changes["trigger"]=value in ("1","true")
+               case "framerate" | "rate" | "fps":
+                    changes["framerate"]=float(value)
+               case "exposure" | "exposuretime":
+                    changes["exposure"]=min(max(float(value),20),1000000)
+               case "gain":
+                    changes["gain"]=min(max(float(value),0),45)
+               case "wells" | "well" | "windows":
+                    changes["wells"]=min(max(int(value),1),24)
+               case _:
+                    raise ValueError("cannot reconfigure {}".format(name))
+     if not changes:
+          raise ValueError("nothing to reconfigure")
+     return changes
      
 def set_windows(val):
      import cv2
      global number_of_wells
      number_of_wells=val
-     setupdisplaywindows(cv2,val)
+     if display_thread is None: #otherwise the display thread rearranges its windows
+         setupdisplaywindows(cv2,val)
      
 
 def setup_camera(cam: Camera):
@@ -273,6 +531,20 @@ def setup_camera(cam: Camera):
             # no streams or no packet‐size feature → quietly skip
             pass
 
+# frames per second the camera is set to, None if it has no frame rate feature
+def camera_fps(cam: Camera):
+    try:
+        return float(cam.get_feature_by_name("AcquisitionFrameRate").get())
+    except (AttributeError, VmbFeatureError):
+        return None
+
+# bytes of one Mono8 frame at the camera's Width x Height, None if unknown
+def frame_bytes(cam: Camera):
+    try:
+        return int(cam.get_feature_by_name("Width").get())*int(cam.get_feature_by_name("Height").get())
+    except (AttributeError, VmbFeatureError):
+        return None
+
 def setup_pixel_format(cam: Camera):
     # Query available pixel formats. Prefer color formats over monochrome formats
     cam_formats = cam.get_pixel_formats()
@@ -301,17 +573,37 @@ def setup_pixel_format(cam: Camera):
 
 
 class Handler:
-    def __init__(self,cv2): #OpenCV module is passed in
-        self.display_queue = Queue(1000) #Thread safe processing
+    def __init__(self,cv2,capacity_bytes=None): #OpenCV module is passed in
+        if capacity_bytes is None:
+            capacity_bytes=memory_budget_mb*2**20
+        self.display_queue = FrameRing(capacity_bytes) #preallocated frame slots, thread safe
         self.frnum=0 #frame counter
         self.verbose=1 #Enables/disables print logging (1 = on)
         self.cv2=cv2 #Stores the OpenCV module locally
-
-    def get_image(self):
-        return (self.display_queue.get(True),self.frnum) #returns tuple of: openCV image and frame number
+        self.statuses={} #frames received per FrameStatus name
+        self.queue_full=0 #frames that arrived at a full ring
+        self.dropped=0 #frames dropped in the callback because the ring was full
+        self.requeue_failed=0 #buffers the camera would not take back
+        self.converter=None #ConvertPool for frames that are not in opencv_display_format, see start_converting
+        self.convert_format=None #the pixel format it converts
+
+    # returns tuple of: ring frame (.image is a read-only view, .num its frame number) and the current frame number
+    # the ring frame must be released once the image is no longer needed
+    # block=False raises queue.Empty when no frame is queued
+    def get_image(self,block=True):
+        return (self.display_queue.get(block),self.frnum)
 
     def __call__(self, cam: Camera, stream: Stream, frame: Frame):
-        if frame.get_status() == FrameStatus.Complete: #ensures frame was successfully captured
+        metrics.inc("frames_received")
+        status=frame.get_status()
+        self.statuses[status.name]=self.statuses.get(status.name,0)+1
+        try:
+            if status != FrameStatus.Complete: #incomplete, too small or invalid: nothing to show or save
+                metrics.inc("frames_"+status.name.lower())
+                return
+            if self.display_queue.full():
+              metrics.inc("queue_full")
+              self.queue_full+=1
  
             if self.verbose==1:
               #print('queue size = {}'.format(self.display_queue.qsize()))  
@@ -324,16 +616,75 @@ class Handler:
             # Convert frame if it is not already the correct format
             if frame.get_pixel_format() == opencv_display_format:
                 display = frame
+            elif self.converter is not None and frame.get_pixel_format() == self.convert_format:
+                # only a copy of the raw buffer here; the converter threads queue the converted frame
+                try:
+                    self.converter.submit(frame.as_numpy_ndarray(), self.frnum, frame_id=frame.get_id(), timestamp=frame.get_timestamp(), block=False)
+                except Full:
+                    self.drop_frame()
+                return
             else:
                 # This creates a copy of the frame. The original `frame` object can be requeued
                 # safely while `display` is used
                 display = frame.convert_pixel_format(opencv_display_format)
 
-            # converts frame to numpy array and queues it
-            self.display_queue.put((display.as_opencv_image(),self.frnum), True)
-
-            #Required to recycle the frame buffer back to the camera
-            cam.queue_frame(frame)
+            # copies the frame into a preallocated ring slot and queues it, with the camera FrameID / timestamp for the demux
+            try:
+                self.display_queue.put(display.as_opencv_image(),self.frnum, False, frame_id=frame.get_id(), timestamp=frame.get_timestamp())
+            except Full: #over the memory budget: drop the frame rather than stall the camera
+                self.drop_frame()
+        finally:
+            #Required to recycle the frame buffer back to the camera - whatever the status, a buffer that is not re-queued is lost to the stream
+            try:
+                cam.queue_frame(frame)
+            except Exception: #streaming stopped in the meantime
+                metrics.inc("requeue_failed")
+                self.requeue_failed+=1
+
+    def drop_frame(self):
+        metrics.inc("admission_frames_dropped")
+        self.dropped+=1
+
+    # converts frames of the camera's pixel_format on worker threads instead of in the callback;
+    # returns False when the format is left to convert_pixel_format in the callback
+    def start_converting(self, pixel_format, workers=2, capacity_bytes=64*2**20):
+        if pixel_format == opencv_display_format or workers<1:
+            return False
+        conversion=mono8_converter(pixel_format, self.cv2)
+        if conversion is None:
+            logging.info("{} frames are converted in the camera callback".format(getattr(pixel_format,"name",pixel_format)))
+            return False
+        convert,dtype=conversion
+        self.converter=ConvertPool(self.display_queue, convert, dtype, workers, capacity_bytes).start()
+        self.convert_format=pixel_format
+        logging.info("{} frames are converted by {} threads".format(getattr(pixel_format,"name",pixel_format), workers))
+        return True
+
+    def stop_converting(self):
+        if self.converter is not None:
+            self.converter.stop()
+            logging.info("convert {}".format(self.converter.summary()))
+            self.converter=None
+
+    # frames so far that point at a short buffer pool: not complete (a full ring drops frames in the callback,
+    # the buffers still go straight back)
+    def starved(self):
+        return sum(n for name,n in self.statuses.items() if name!="Complete")
+
+
+# restarts the stream with a new number of frame buffers; runs on the camera control worker so the main loop
+# keeps draining the ring (a callback blocked on a full ring would otherwise hold up stop_streaming)
+def restart_streaming(cam: Camera, handler, count):
+    cam.stop_streaming()
+    cam.start_streaming(handler=handler, buffer_count=count)
+    logging.info("streaming restarted with {} frame buffers".format(count))
+
+
+# auto-tune timer: restarts the stream with a bigger pool when buffers ran short
+def check_buffers(cam: Camera, handler, tuner):
+    count=tuner.check(handler.starved())
+    if count is not None:
+        camera_call("buffers", restart_streaming, cam, handler, count, label="buffer_count {}".format(count))
 
 
 # reads a file called "RAPcommand.txt"
@@ -474,9 +825,16 @@ def checkkeypress(cv2,cnum):
 def start_save(str1):
     global SAVETOGGLE
     global savedframes
+    global stack_session
     savedframes=0 #reset counter
     logging.info("startsave called, with {}".format(str1)) #logs the action
+    finish_pretrigger()
+    flush_writer() #frames of a previous save go to the previous folder
+    close_stack_session()
+    folder=os.path.abspath(str1)
     os.chdir(str1) #Sets where saved files will go
+    if save_format=="stack":
+        stack_session=StackSession(folder, max(number_of_wells,1), metadata={"save_max": save_max})
     SAVETOGGLE=1 #activates saving mode
     
 
@@ -485,85 +843,241 @@ def stop_save():
     global SAVETOGGLE
     logging.info("stopsave called"); #logs action
     SAVETOGGLE=0 #ends saving mode
+    finish_pretrigger()
+    flush_writer()
+    close_stack_session()
+
+def close_stack_session():
+    global stack_session
+    if stack_session is not None:
+        stack_session.close()
+        logging.info("stack session closed: {} frames per well".format(stack_session.written))
+        stack_session=None
+
+# begin a saving session that starts seconds before the command: the history's frames of that window are written in
+# the background (rap_pretrigger), followed by the live frames as with start_save
+def start_save_buffer(seconds,folder):
+    global pretrigger
+    frames=history_depth("{}s".format(seconds), history_fps, history.wells)
+    start_save(folder)
+    holds=[h for well in range(history.wells) for h in history.pin(well, frames)]
+    pretrigger=PreTrigger(holds, save_target)
+    metrics.inc("pretrigger_frames", pretrigger.total)
+    kept=history.depth*history.wells/history_fps #seconds the history holds
+    sys.stdout.write("py. savebuffer {} frames from the last {:g} s (history holds {:.1f} s), then live frames\n".format(pretrigger.total, seconds, kept))
+    sys.stdout.flush()
+
+# hands savebuffer backlog frames to the writer while its queue is less than half full, so live frames keep priority;
+# without background writers a couple are written per loop. Returns True if any were
+def step_pretrigger():
+    global pretrigger
+    if pretrigger is None:
+        return False
+    if writer is not None:
+        n=pretrigger.step(writer.submit, lambda: writer.qsize()<writer_queue//2)
+    else:
+        n=pretrigger.step(write_backlog_frame, limit=2)
+    if pretrigger.done:
+        logging.info("savebuffer backlog submitted {}".format(pretrigger.summary()))
+        pretrigger=None
+    return n>0
+
+# submits what is left of a savebuffer backlog before its recording is flushed and closed
+def finish_pretrigger():
+    global pretrigger
+    if pretrigger is None:
+        return
+    pretrigger.step(writer.submit if writer is not None else write_backlog_frame)
+    logging.info("savebuffer backlog submitted {}".format(pretrigger.summary()))
+    pretrigger=None
+
+# writes a backlog frame in the main loop (no background writers) and releases its history slot
+def write_backlog_frame(target,image,hold):
+    import cv2
+    try:
+        frame_written(hold, image, write_saved_frame(cv2, target, image) is not False)
+    finally:
+        hold.release()
+
+# recording target of a frame: a tif filename carrying its well (img#########_wellKK.tif, img#########.tif
+# when the well is not known), or the next slot of its well in the stack session (well defaults to num % number_of_wells)
+def save_target(num,well=None,timestamp=None):
+    if stack_session is not None:
+        if well is None:
+            well=num%max(number_of_wells,1)
+        return stack_session.reserve(well, num, timestamp)
+    if well is None:
+        return "img{:09d}.tif".format(num)
+    return "img{:09d}_well{:02d}.tif".format(num, well)
+
+# writes one saved frame: target is a tif filename, or a stack slot (callable) from StackSession.reserve
+def write_saved_frame(cv2,target,image):
+    if callable(target):
+        return target(image)
+    return cv2.imwrite(target, image)
+
+# telemetry for a written frame (runs in the writer threads)
+def frame_written(frame,image,ok):
+    if not ok:
+        metrics.inc("frames_write_failed")
+        return
+    metrics.inc("frames_written")
+    metrics.inc("bytes_written",getattr(image,"nbytes",0))
+    if frame is not None and frame.received is not None: #history frames of a savebuffer have no callback time
+        metrics.observe("callback_to_written",(time.perf_counter()-frame.received)*1000)
+
+# waits until the background writers have written every submitted frame, and reports their throughput
+def flush_writer():
+    if writer is None or writer.submitted==0:
+        return
+    writer.flush()
+    summary=writer.summary()
+    logging.info("writer flushed: {}".format(summary))
+    for st in summary["writers"]:
+        sys.stdout.write(".py. {} wrote {} frames ({} errors), {:.1f} fps, {:.1f} MB/s while busy\n".format(
+            st["name"],st["frames"],st["errors"],st["fps"],st["mb_per_s"]))
+    sys.stdout.flush()
+
+# a text command with missing or invalid arguments
+class CommandError(ValueError):
+    pass
+
+# the argument of a one-argument command converted by convert; raises CommandError(message) when it is missing or invalid
+def command_arg(command_array,convert,message):
+    if len(command_array)!=2:
+        raise CommandError(message)
+    try:
+        return convert(command_array[1].strip().lower())
+    except ValueError:
+        raise CommandError(message) from None
 
 #central system for processing javascript commands to the camera
+#returns False if the command was not understood or its arguments were invalid (reported as py. Error)
 def process_js_command(str,cam):
 
+    if is_json_command(str): #versioned JSON request (rap_protocol)
+        return process_json_command(str,cam)
+    try:
+        return run_js_command(str,cam)
+    except CommandError as e:
+        sys.stdout.write("py. Error - {}\n".format(e))
+        sys.stdout.flush()
+        return False
+
+# checks the arguments of a text command without running it: returns False if the command is not
+# understood, raises CommandError on missing or invalid arguments. A JSON request checks all of its
+# cmds this way before anything is applied
+def check_js_command(command_array):
+    match command_array[0].strip():
+        case "loadcamerasettings" | "loadcamera" | "camerasettings":
+            if (len(command_array)!=2):
+                raise CommandError("require a path to an xml file")
+        case "cameratrigger" | "trigger":
+            if (len(command_array)!=2):
+                raise CommandError("this requires (true/false or 1/0) argument")
+            if command_array[1].strip().lower() not in ("1","true","0","false"):
+                raise CommandError("true/false argument not parsed")
+        case "framerate" | "rate" | "fps":
+            command_arg(command_array, float, "this requires a frame rate")
+        case "gain" | "cameragain":
+            command_arg(command_array, float, "this requires a value between 0 and 45")
+        case "exposure" | "exposuretime" | "cameraexposure" | "cameraexposuretime":
+            command_arg(command_array, float, "this requires an exposure time in us")
+        case "wells" | "well" | "windows":
+            command_arg(command_array, int, "this requires a value between 1 and 24")
+        case "savebuffer":
+            try:
+                seconds=float(command_array[1]) if len(command_array)>1 else -1
+            except ValueError:
+                seconds=-1
+            if seconds<0:
+                raise CommandError("savebuffer requires the seconds to save from before the command")
+            if history is None or not history_fps:
+                raise CommandError("savebuffer needs the frame history while streaming (--history=Ns)")
+        case "mode":
+            command_arg(command_array, int, "mode requires a number")
+        case "savedir":
+            if len(command_array)!=2:
+                raise CommandError("savedir requires a folder")
+        case "phaselock":
+            if len(command_array)!=2 or command_array[1].strip() not in ("0","1"):
+                raise CommandError("this requires a 0/1 argument")
+        case "reconfigure" | "reconfig":
+            try:
+                parse_reconfigure(command_array[1:])
+            except ValueError as e:
+                raise CommandError(e) from None
+        case "profile":
+            if len(command_array)!=2 or command_array[1].strip().lower() not in ("on","cprofile","dump","off"):
+                raise CommandError("profile requires on, cprofile, dump or off")
+        case "saveformat" | "format":
+            if len(command_array)!=2 or command_array[1].strip().lower() not in ("tiff","stack"):
+                raise CommandError("format must be tiff or stack")
+        case "hello" | "jmessage" | "quit" | "startsave" | "stopsave" | "free" | "freerun":
+            pass
+        case _:
+            return False
+    return True
+
+# runs one text command; returns False if it was not understood, raises CommandError on bad arguments
+def run_js_command(str,cam):
     #process and logs input
     global cancel_main_loop
     global cancel_save
     global mode
+    global save_format
+    global phase_lock_enabled
     command_array=str.split(",")
     commandstring=command_array[0].strip()
     sys.stdout.write(".py. processing command {}\n".format(commandstring))
     sys.stdout.flush()
     logging.info("command string = {}".format(commandstring))
-
+    if not check_js_command(command_array):
+        sys.stdout.write("py. command {} not understood\n".format(command_array[0]))
+        sys.stdout.flush()
+        return False
 
     match commandstring:
         #alter settings file
         case "hello":
              sys.stdout.write("py. hi there\n")
         case "loadcamerasettings" | "loadcamera" | "camerasettings":
-            if (len(command_array)!=2):
-                sys.stdout.write("py. Error - require a path to an xml file\n")
-                sys.stdout.flush() 
-            else:
-                logging.info("process_js_command understood = loadcamerasettings")
-                load_camera_settings(cam, command_array[1].strip())
+            logging.info("process_js_command understood = loadcamerasettings")
+            camera_call("settings", load_camera_settings, cam, command_array[1].strip())
         #turn camera trigger on/off
         case "cameratrigger" | "trigger":
-            if (len(command_array)!=2):
-                sys.stdout.write("py. Error - this requires (true/false or 1/0) argument\n")
-                sys.stdout.flush() 
+            logging.info("process_js_command understood = cameratrigger")
+            tf=command_array[1].strip().lower()
+            if ((tf=="1") or (tf=="true")):
+                camera_call("settings", load_camera_settings, cam, defaultTriggerConfigfile, label="trigger")
             else:
-                logging.info("process_js_command understood = cameratrigger")
-                tf=command_array[1].strip().lower()
-                if ((tf=="1") or (tf=="true")):
-                    load_camera_settings(cam,defaultTriggerConfigfile)
-                elif ((tf=="0") or (tf=="false")):
-                    load_camera_settings(cam,defaultFreerunConfigfile)
-                else:
-                    sys.stdout.write("py. Error - true/false argument not parsed\n")
-                    sys.stdout.flush()
+                camera_call("settings", load_camera_settings, cam, defaultFreerunConfigfile, label="freerun")
         #alter Framerate / Gain / Exposure
         case "framerate" | "rate" | "fps":
              logging.info("process_js_command understood = framerate")
-             tf=command_array[1].strip().lower()
-             fpsval=float(tf)
-             set_framerate(cam,fpsval)
+             fpsval=command_arg(command_array, float, "this requires a frame rate")
+             camera_call("framerate", set_framerate, cam, fpsval)
         case "gain" | "cameragain":
-            if (len(command_array)!=2):
-                sys.stdout.write("py. Error - this requires a value between 0 and 45\n")
-                sys.stdout.flush()
-            else:
-                tf=command_array[1].strip().lower()
-                gainval=float(tf)
-                if (gainval<0):
-                  gainval=0
-                if (gainval>45):
-                  gainval=45
-                set_gain(cam,gainval)
+            gainval=command_arg(command_array, float, "this requires a value between 0 and 45")
+            if (gainval<0):
+              gainval=0
+            if (gainval>45):
+              gainval=45
+            camera_call("gain", set_gain, cam, gainval)
         case "exposure" | "exposuretime" | "cameraexposure" | "cameraexposuretime":
-                tf=command_array[1].strip().lower()
-                expval=float(tf)
+                expval=command_arg(command_array, float, "this requires an exposure time in us")
                 if (expval<20):
                   expval=20
                 if (expval>1000000):
                   expval=1000000
-                set_exposure(cam,expval)  
+                camera_call("exposure", set_exposure, cam, expval)
         case "wells" | "well" | "windows":
-            if (len(command_array)!=2):
-                sys.stdout.write("py. Error - this requires a value between 1 and 24 \n")     
-                sys.stdout.flush()
-            else:
-                tf=command_array[1].strip().lower()
-                wellval=int(tf)
-                if (wellval<1): 
-                  wellval=1
-                if (wellval>24):
-                  wellval=24
-                set_windows(wellval)
+            wellval=command_arg(command_array, int, "this requires a value between 1 and 24")
+            if (wellval<1): 
+              wellval=1
+            if (wellval>24):
+              wellval=24
+            set_windows(wellval)
         case "jmessage":
             sys.stdout.write("py. Generic message received\n")
             sys.stdout.flush()
@@ -582,41 +1096,162 @@ def process_js_command(str,cam):
                 start_save(globals()["currentSaveDirectory"])
             else:    
                 start_save(command_array[1].strip())
+        #<savebuffer,seconds[,folder]>: save from seconds before the command on, taken from the per-well history
+        case "savebuffer":
+            seconds=float(command_array[1])
+            cancel_save=0
+            if len(command_array)<3:
+                create_folder(defaultSaveRootDirectory+"/temp1")
+                start_save_buffer(seconds, globals()["currentSaveDirectory"])
+            else:
+                start_save_buffer(seconds, command_array[2].strip())
+            sys.stdout.flush()
         case "stopsave":
              cancel_save=1
              stop_save()
         case "free" | "freerun":
-              load_camera_settings(cam, defaultFreerunConfigfile)
+              camera_call("settings", load_camera_settings, cam, defaultFreerunConfigfile, label="freerun")
         case "mode":
-            if (command_array[1].isdigit()):
-                mode=int(command_array[1].strip())
+            mode=command_arg(command_array, int, "mode requires a number")
         case "savedir":
             logging.info("save directory set to ={}".format(command_array[1]))
+        case "phaselock":
+            phase_lock_enabled=int(command_array[1].strip())
+        #several settings at once, applied between two frames while streaming
+        case "reconfigure" | "reconfig":
+            changes=parse_reconfigure(command_array[1:])
+            if live_session is not None:
+                live_session.reconfigure(changes)
+            else:
+                apply_camera_changes(cam, changes)
+                if "wells" in changes:
+                    set_windows(changes["wells"])
+                sys.stdout.write("py. reconfigured {}\n".format(" ".join("{}={}".format(k,v) for k,v in changes.items())))
+                sys.stdout.flush()
+        #profiling: on = stage timers + stack samples, cprofile = also cProfile, dump = write what was collected, off = stop and dump
+        case "profile":
+            action=command_array[1].strip().lower()
+            match action:
+                case "on" | "cprofile":
+                    profiler.start(cprofile=action=="cprofile")
+                    sys.stdout.write("py. profiling {}\n".format(action))
+                    sys.stdout.flush()
+                case "dump":
+                    report_profile(profiler.dump())
+                case "off":
+                    report_profile(profiler.stop())
+        case "saveformat" | "format":
+            save_format=command_array[1].strip().lower() #takes effect at the next startsave
+    return True
+
+# one py. line per profiled stage (slowest first) and per file written
+def report_profile(out):
+    if out is None:
+        sys.stdout.write("py. profiling is off\n")
+    else:
+        for stage,s in out["stages"].items():
+            sys.stdout.write("py. profile {} mean {:.3f} ms p99 {:.3f} ms max {:.3f} ms ({:.0%})\n".format(
+                stage,s["mean"],s["p99"],s["max"],s["share"]))
+        for path in out["files"]:
+            sys.stdout.write("py. profile written to {}\n".format(path))
+    sys.stdout.flush()
 
-        case _:
-            sys.stdout.write("py. command {} not understood\n".format(command_array[0]))
-            sys.stdout.flush()
-
-
-#run in its own thread - uses two queues, first is filled with characters, second complete commands
-#used for live command input
-def add_stdin_input(stdin_input_queue,stdin_command_queue):
-    global js_input_started #track whether a command has started
-    while True:
-        ch=sys.stdin.read(1)
-       
-        if (ch=='<'):
-            js_input_started=True
-        elif (ch=='>'):
-            le=stdin_input_queue.qsize()
-            res=[]
-            for i in range(le):
-                res.append(stdin_input_queue.get())
-            res_str="".join(res)
-            stdin_command_queue.put(res_str) 
-            sj_input_started=False;
-        else:
-            stdin_input_queue.put(ch)
+# runs func(*args), charging its time to stage while profiling; used for the display thread stages
+def timed(stage,func,*args):
+    if not profiler.enabled:
+        return func(*args)
+    t=time.perf_counter()
+    try:
+        return func(*args)
+    finally:
+        profiler.record(stage,time.perf_counter()-t)
+
+# handles a JSON request: {"v":1,"id":...,"set":{settings applied together},"cmds":[[name,arg,...],...]}
+# and answers with py.json ack / done / error lines carrying the request id. The ack lists what was
+# applied before it and what was only queued: a set while streaming (its done reply follows) and the
+# cmds whose camera writes went to the camera control worker (reported as py. camera lines)
+def process_json_command(text,cam):
+    try:
+        request=parse_request(text)
+        try:
+            changes=parse_reconfigure(["{}={}".format(k,v) for k,v in request.settings.items()]) if request.settings else {}
+        except ValueError as e:
+            raise ProtocolError("invalid_value", e, request.id)
+        for cmd in request.cmds: #every cmd is checked before anything is applied, so a bad one rejects the whole request
+            try:
+                understood=check_js_command(",".join(cmd).split(","))
+            except ValueError as e: #CommandError
+                raise ProtocolError("invalid_value", "{}: {}".format(cmd[0], e), request.id)
+            if not understood:
+                raise ProtocolError("unknown_command", "command {} not understood".format(cmd[0]), request.id)
+    except ProtocolError as e:
+        logging.info("json request rejected: {}".format(e))
+        reply_error(e.request_id, e)
+        return True
+    logging.info("json request {} set {} cmds {}".format(request.id, changes, request.cmds))
+    applied,queued={},{}
+    rec=None
+    if changes:
+        try:
+            if live_session is not None:
+                rec=live_session.reconfigure(changes, on_done=functools.partial(reply_reconfigured, request.id))
+                queued=changes #a done reply follows between two frames
+            else:
+                apply_camera_changes(cam, changes)
+                if "wells" in changes:
+                    set_windows(changes["wells"])
+                applied=changes
+        except Exception as e:
+            logger.exception("json request {}: set failed".format(request.id))
+            reply_error(request.id, ProtocolError("camera_error", e, request.id))
+            return True
+    ran,queued_cmds=[],[]
+    for cmd in request.cmds:
+        submitted=camera_control.submitted if camera_control is not None else 0
+        try:
+            run_js_command(",".join(cmd), cam)
+        except Exception as e:
+            if isinstance(e, ValueError): #CommandError: state changed since the check, e.g. streaming stopped
+                error_type="invalid_value"
+            else: #the camera or the file system
+                error_type="camera_error"
+                logger.exception("json request {}: {} failed".format(request.id, cmd[0]))
+            if rec is not None:
+                rec.on_done=None #the error reply below is the only answer to this request
+            reply_error(request.id, ProtocolError(error_type, "{}: {}".format(cmd[0], e), request.id),
+                        applied=applied, queued=queued, cmds=ran)
+            return True
+        ran.append(cmd[0])
+        if camera_control is not None and camera_control.submitted>submitted:
+            queued_cmds.append(cmd[0])
+    reply(request.id, "ack", applied=applied, queued=queued, cmds=ran, queued_cmds=queued_cmds, pending=bool(queued))
+    return True
+
+# done reply of a JSON set that was applied while streaming
+def reply_reconfigured(request_id, rec):
+    if rec.status=="error":
+        reply_error(request_id, ProtocolError("camera_error", rec.error, request_id))
+    else:
+        reply(request_id, "done", applied=rec.changes, affected=rec.affected,
+              frames=[rec.requested_frame+1, rec.applied_frame-1] if rec.affected else [], ms=round(rec.duration*1000.0,1))
+
+
+#run in its own thread for live command input
+# reads stdin in blocks and queues each complete <...> command (a str with a .received timestamp)
+# returns at end of input
+def add_stdin_input(stdin_command_queue,stream=None):
+    global stdin_parser
+    stdin_parser=CommandParser()
+    read_commands(sys.stdin if stream is None else stream, stdin_command_queue, stdin_parser)
+    logging.info("stdin closed: {} commands, {} oversize, {} characters outside commands".format(
+        stdin_parser.commands, stdin_parser.oversize, stdin_parser.discarded))
+
+# milliseconds a command waited between arriving on stdin and being processed
+def command_latency_ms(command):
+    received=getattr(command,"received",None)
+    if received is None:
+        return -1.0
+    return (time.perf_counter()-received)*1000
 
 """"
 never used
@@ -629,6 +1264,7 @@ def maybechecknodejs_stdin(cv2,num1,num2):
 def maybechecknodejs_localhost(cv2,num1,num2):
         global oldnodetext #stores last command so that nothing happens if new one is the same
         global dosub
+        import requests #only this legacy http polling needs it
     
         try:
             result = requests.get('http://localhost:3030/')
@@ -666,7 +1302,9 @@ def maybechecknodejs_localhost(cv2,num1,num2):
 """
 
 # if in save mode, save a number of images to specified location
-def maybesaveimage(cv2,display,num):
+# with background writers, frame (a ring frame holding display) is kept until written
+# well defaults to num % number_of_wells and is only used by the stack format
+def maybesaveimage(cv2,display,num,frame=None,well=None):
     global mode
     global savedframes
     global save_max
@@ -674,8 +1312,13 @@ def maybesaveimage(cv2,display,num):
     #print("in maybe save image with mode =")
     #print(mode)
     if SAVETOGGLE==1:
-        filename="img{:09d}.tif".format(num)
-        cv2.imwrite(filename, display)
+        target=save_target(num, well)
+        if writer is None:
+            frame_written(frame, display, write_saved_frame(cv2, target, display) is not False)
+        else:
+            if frame is not None:
+                frame.retain()
+            writer.submit(target, display, frame)
         savedframes=savedframes+1
         if savedframes>=save_max:
             SAVETOGGLE=0
@@ -712,12 +1355,46 @@ def setupdisplaywindows(cv2,number_of_wells):
 
    
 
+# runs in the display thread: (re)creates the windows when the well count changed, then shows
+# the newest frame of each well - one window per well, or the mosaic canvas in mode 2
+# with previews on, frames are binned to salliedxy first (full resolution only goes to the writer)
+def show_frames(cv2,frames):
+    global mosaic
+    global display_wells
+    global preview
+    if preview is None and preview_enabled==1:
+        preview=Preview(salliedxy)
+    if display_wells!=number_of_wells:
+        display_wells=number_of_wells
+        if mode==2:
+            if mosaic is None:
+                frame_size=salliedxy if preview_enabled==1 else alliedxy
+                mosaic=Mosaic(cv2,number_of_wells,screenres,frame_size,max_fps=0) #the thread already caps the rate
+            else:
+                mosaic.set_wells(number_of_wells)
+        elif mode==1:
+            setupdisplaywindows(cv2,number_of_wells)
+    for f in frames:
+        image=preview.bin(f.image,f.well) if preview_enabled==1 else f.image
+        if mosaic is not None:
+            mosaic.update(f.well,image)
+        else:
+            maybeshowimage(cv2,image,f.num,number_of_wells,well=f.well)
+    if mosaic is not None:
+        mosaic.show()
+    now=time.perf_counter()
+    for f in frames:
+        metrics.observe("callback_to_displayed",(now-f.received)*1000)
+
 # display an image frame
-def maybeshowimage(cv2,display,num,number_of_wells):
+# well comes from the demux stage; without it the well is guessed as num % number_of_wells
+def maybeshowimage(cv2,display,num,number_of_wells,well=None):
     global mode
     #print(mode)
     if 1==1:
-      wtitle=windowtitle.format(num%number_of_wells)
+      if well is None:
+          well=num%number_of_wells
+      wtitle=windowtitle.format(well)
       #print(wtitle)
       cv2.imshow(wtitle,display)
                       
@@ -725,8 +1402,6 @@ def maybeshowimage(cv2,display,num,number_of_wells):
 
 #central entry point
 def main():
-    cb=deque([],3*6) #creates a rolling buffer to store image frames
-    
     import cv2
     
     cam_id = None
@@ -737,9 +1412,17 @@ def main():
     global windowtitle
     global alliedxy
     global mode  #display all to screen=0, display 1 to screen and save=1
-    global stdin_input_queue
     global stdin_command_queue
     global cancel_main_loop
+    global writer
+    global display_thread
+    global mosaic
+    global display_wells
+    global preview
+    global camera_control
+    global camera_settings
+    global live_session
+    global history, history_fps
 
     #mode 0 = save, mode 1 = display full windows mode 2 display big tile
     mode,number_of_wells,slave_mode=parse_args() #command line input
@@ -753,26 +1436,20 @@ def main():
                     level=logging.DEBUG)
     logging.info("*******starting the program*******")
 
-    xpanels=6
-    ypanels=4
-    xdim=alliedxy[0]
-    ydim=alliedxy[1]
-    
-    a1=np.zeros((xdim*xpanels,xdim*xpanels,3)) #nitializes a large blank image
-    
     global frame_array
     global savedirectory
     makepanels(2,2)
     tlast=0
 
     #Starts a thread to read commands from stdin
-    input_thread = threading.Thread(target=add_stdin_input, args=(stdin_input_queue,stdin_command_queue,))
+    input_thread = threading.Thread(target=add_stdin_input, args=(stdin_command_queue,))
     input_thread.daemon = True
     input_thread.start()
 
     #receive instructions and wait for 'start' signal.
 
 
+    profiler.directory=os.path.abspath(profile_directory if profile_directory is not None else savedirectory)
     os.chdir(savedirectory)
 
     #initialises vimba system and camera
@@ -781,64 +1458,168 @@ def main():
             # setup general camera settings and the pixel format in which frames are recorded
             setup_camera(cam)
             
-            
+            camera_settings=SettingsEngine(cam, PersistType.All) #the first load is a full one, later switches write the differences
             load_camera_settings(cam, defaultFreerunConfigfile)
 
             wait_for_start=1
             while wait_for_start==1:
-               if not stdin_command_queue.empty():
-                command=stdin_command_queue.get()
-                logging.info("command queue pre start  = {}".format(command))
+                command=stdin_command_queue.get() #blocks until node.js sends a command - there is nothing else to do before <startcamera>
+                logging.info("command queue pre start  = {} ({:.1f} ms queued)".format(command,command_latency_ms(command)))
                 if "startcamera" not in command: 
                   process_js_command(command,cam)
-                  time.sleep(0.1)
                 else:
                    wait_for_start=0
 
 
             #cam.load_settings("v.xml", PersistType.All)
             setup_pixel_format(cam)
-            handler = Handler(cv2)
+            #one memory budget for the frames in flight: the converter ring (if frames need converting) gets a fifth, the frame ring the rest
+            budget = MemoryBudget(memory_budget_mb)
+            converting = convert_threads>0 and cam.get_pixel_format()!=opencv_display_format
+            convert_bytes = budget.grant("convert", budget.total//5) if converting else 0
+            #the per-well history gets what its depth needs (a quarter if the frame size is unknown), at most
+            #HISTORY_SHARE of the budget and always leaving the frame ring RING_MIN_FRAMES frames; capacity caps the depth
+            history_fps = camera_fps(cam)
+            try:
+                history_frames = history_depth(history_setting, history_fps, number_of_wells)
+            except ValueError as e:
+                logging.warning("no frame history: {}".format(e))
+                history_frames = 0
+            if history_frames>0:
+                nbytes = frame_bytes(cam)
+                if nbytes:
+                    fit = budget.share(HISTORY_SHARE, keep=RING_MIN_FRAMES*nbytes)//(number_of_wells*nbytes)
+                    if fit<history_frames:
+                        logging.warning("history of {} frames per well needs {:.0f} MB of the {:.0f} MB memory budget: cut to {} frames".format(
+                            history_frames, number_of_wells*history_frames*nbytes/2**20, budget.total/2**20, fit))
+                        history_frames = fit
+                    history_bytes = number_of_wells*history_frames*nbytes
+                else:
+                    history_bytes = budget.total//4
+            if history_frames>0:
+                history = WellHistory(number_of_wells, history_frames, budget.grant("history", history_bytes))
+            handler = Handler(cv2, budget.rest("ring"))
+            handler.start_converting(cam.get_pixel_format(), convert_threads, convert_bytes)
+            logging.info("memory budget {}".format(budget.summary()))
+            demux = WellDemux(number_of_wells) #assigns wells from the camera FrameID
+            well_queues = WellQueues(number_of_wells) #per-well fan-out to the consumers below
+            save_queue = well_queues.subscribe("save")
+            show_queue = well_queues.subscribe("display", maxlen=1, shed_at=SHED_DISPLAY) #only the newest frame of a well is shown, none when the ring fills up
+            phase_lock = PhaseLock(number_of_wells) #sized from the first frame
+            well_stats = WellStats(number_of_wells, well_stats_step, every=well_stats_every) if well_stats_interval>0 else None
+            if writer_threads>0:
+                writer = WriterPool(functools.partial(write_saved_frame, cv2), workers=writer_threads, max_queued=writer_queue,
+                                    on_written=frame_written)
             
-            #creates openCV windows for displaying each well
-            if mode==1:
-                windowtitles=setupdisplaywindows(cv2,number_of_wells)
-                print(len(windowtitles))
+            #the display thread creates the openCV windows (mode 1: one per well, mode 2: one mosaic) and owns every GUI call
+            mosaic=None
+            display_wells=None
+            preview=None
+            display_thread=DisplayThread(show_queue, functools.partial(timed,"maybeshowimage",show_frames,cv2),
+                                         keypress=lambda: timed("checkkeypress",checkkeypress,cv2,handler.frnum), max_fps=display_fps)
+            display_thread.start()
+            #feature writes from node.js commands (settings loads, exposure...) run off the frame loop from here on
+            camera_control=CameraControl().start()
+            live_session=LiveSession(cam, apply_camera_changes, control=camera_control, on_wells=set_windows, demux=demux,
+                                     wake=events.notify)
+            metrics.gauge("queue_depth", lambda: handler.display_queue.qsize())
+            metrics.gauge("ring_in_use", lambda: handler.display_queue.in_use())
+            metrics.gauge("save_queue", lambda: writer.qsize() if writer is not None else save_queue.qsize())
+            metrics.gauge("display_skipped", lambda: show_queue.dropped)
+            metrics.gauge("ring_fill", lambda: round(handler.display_queue.fill(), 3))
+            metrics.gauge("demux_missing", lambda: demux.missing)
+            metrics.gauge("buffer_count", lambda: buffer_tuner.count if buffer_tuner is not None else buffer_count)
+            buffer_tuner=BufferTuner(buffer_count, buffer_max) if buffer_auto==1 else None
+            reporter=MetricsReporter(metrics, metrics_interval).start() if metrics_interval>0 else None
+            metrics_server=serve_http(metrics, metrics_port) if metrics_port>0 else None
 
             try:
-                # Start Streaming with a custom a buffer of 10 Frames (defaults to 5)
-                cam.start_streaming(handler=handler, buffer_count=10)
+                # Start Streaming with buffer_count frame buffers (vmbpy defaults to 5)
+                cam.start_streaming(handler=handler, buffer_count=buffer_count)
 
                 
                 
                 
                 framenum=0
                 titlelist=[]
+                if profile_at_start:
+                    profiler.start(cprofile=profile_at_start=="cprofile")
+                if well_stats is not None: #one line for all wells, so node.js is not flooded at the frame rate
+                    events.every(well_stats_interval, lambda: reply(None, "wellstats", **well_stats.report()), "wellstats")
+                if buffer_tuner is not None:
+                    events.every(0.5, lambda: check_buffers(cam, handler, buffer_tuner), "buffers")
+                handler.display_queue.on_ready=events.notify #frames wake the loop like commands do
                 while cancel_main_loop==0:
+                  seen=events.seq #read before looking at the sources, so a notify in between is not lost
+                  busy=False
+                  profiler.begin() #stage timers, a no-op unless profiling
                   #get an image (display), the number it was received (rnum) and the current frame (cnum)
-                  (display,rnum),cnum = handler.get_image()  #Gets the latest image and frame numbers
-                  
-                  
-                  #stick the image on an internal queue (deque)
-                  cb.append(display)
+                  try:
+                      frame,cnum = handler.get_image(False)  #Gets the oldest queued frame and the current frame number
+                  except Empty:
+                      frame=None
+                  profiler.lap("get_image")
+                  if frame is not None:
+                    busy=True
+                    rnum = frame.num
+                    metrics.observe("callback_to_dequeue",(time.perf_counter()-frame.received)*1000)
+                    live_session.frame(rnum) #finishes reconfigurations between frames
+                    if demux.wells!=number_of_wells: #wells changed by a command
+                        demux.set_wells(number_of_wells)
+                        well_queues.set_wells(number_of_wells)
+                        if well_stats is not None:
+                            well_stats.set_wells(number_of_wells)
+                        if history is not None: #same memory, depth recomputed for the new well count
+                            history.set_wells(number_of_wells, history_depth(history_setting, history_fps, number_of_wells))
+                    demux.route(frame) #sets frame.well
+                    fill=handler.display_queue.fill() #admission control: shed display, then analysis, as the ring fills up
+                    if fill<SHED_ANALYSIS:
+                        if phase_lock_enabled==1:
+                            phase_lock.observe(frame, demux) #may re-phase demux (and frame.well)
+                        if well_stats is not None:
+                            well_stats.observe(frame.image, frame.well)
+                    elif phase_lock_enabled==1 or well_stats is not None:
+                        metrics.inc("admission_analysis_shed")
+                    for name in well_queues.publish(frame, fill):
+                        metrics.inc("admission_{}_shed".format(name))
+                    if history is not None:
+                        history.append(frame.well, frame.image, rnum, frame.timestamp)
+                    frame.release() #the consumer queues hold their own references
+                    profiler.lap("route")
                  
-                  #maybe write image to file
-                  maybesaveimage(cv2,display,rnum)
+                    #maybe write image to file
+                    for f in save_queue.drain():
+                        maybesaveimage(cv2,f.image,f.num,f,well=f.well)
+                        f.release()
+                    profiler.lap("maybesaveimage")
                  
-                  #print a warning if running slowly
-                  if rnum!=cnum:
-                       print("running slow: backlog {}".format(rnum-cnum))
-                  #check if the enter key is pressed on an open window
+                    #print a warning if running slowly
+                    if rnum!=cnum:
+                         print("running slow: backlog {}".format(rnum-cnum))
 
                   
                   if not stdin_command_queue.empty(): #process commands
-                       
+                       busy=True
                        command=stdin_command_queue.get()
-                       logging.info("command queue get = {}".format(command))
+                       latency=command_latency_ms(command)
+                       metrics.observe("command",latency)
+                       logging.info("command queue get = {} ({:.1f} ms queued)".format(command,latency))
                        process_js_command(command,cam)
-
-                  if (checkkeypress(cv2,cnum)!=0):
+                  live_session.tick() #finishes reconfigurations also while no frames come in (trigger mode)
+                  profiler.lap("process_js_command")
+                  if step_pretrigger(): #savebuffer backlog, as the writer has room
+                      busy=True
+                  profiler.lap("savebuffer")
+                  events.run_timers()
+
+                  if display_thread.quit_requested: #enter pressed on a display window
                       break
+                  if not busy: #sleep until a frame or a command arrives, or a timer is due
+                      timeout=events.next_timeout()
+                      if pretrigger is not None: #the writer does not wake the loop: look again soon
+                          timeout=0.01 if timeout is None else min(timeout, 0.01)
+                      events.wait(seen, idle_timeout if timeout is None else min(timeout, idle_timeout))
+                      profiler.lap("wait")
                   
                   
                   #if (handler.display_queue.qsize()==0) and cnum==rnum:
@@ -846,15 +1627,46 @@ def main():
                   #  num = rnum
                   #  
                   #  if num>24 and dosub==1:
-                  #     display=cv2.absdiff(display,cb[3*6-1-3*3])*10
+                  #     display=cv2.absdiff(display,history.last(frame.well,2)[0])*10
                   #     print("processed well")
                     
-                  maybeshowimage(cv2,display,rnum,number_of_wells) #show image
                   #print(dosub)
                     
 
             finally:
+                if profiler.enabled:
+                    report_profile(profiler.stop()) #so a slow run can be diagnosed from the log
+                if reporter is not None:
+                    reporter.stop()
+                if metrics_server is not None:
+                    metrics_server.shutdown()
+                logging.info("metrics {}".format(metrics.snapshot(reset=False)))
+                camera_control.stop() #finishes queued feature writes before streaming stops
+                logging.info("live session {} events {}".format(live_session.summary(), events.summary()))
+                live_session=None
+                logging.info("camera control {}".format(camera_control.summary()))
+                logging.info("frame status {} queue full {} dropped {} requeue failed {} buffers {}".format(handler.statuses, handler.queue_full,
+                             handler.dropped, handler.requeue_failed, buffer_tuner.summary() if buffer_tuner is not None else buffer_count))
+                camera_control=None
                 cam.stop_streaming()
+                handler.stop_converting()
+                display_thread.stop()
+                logging.info("display {}".format(display_thread.summary()))
+                display_thread=None
+                logging.info("demux {} phase lock {}".format(demux.summary(), phase_lock.summary()))
+                if well_stats is not None:
+                    logging.info("well stats {}".format(well_stats.summary()))
+                if history is not None:
+                    logging.info("history {}".format(history.summary()))
+                    history=None
+                if demux.gaps>0:
+                    print(".py. demux: {} gaps, {} frames missing, {} re-phased".format(demux.gaps, demux.missing, demux.rephased))
+                finish_pretrigger()
+                if writer is not None:
+                    flush_writer() #nothing queued for saving is lost on quit
+                    writer.close()
+                    writer=None
+                close_stack_session()
 
 
 if __name__ == '__main__':
@@ -19,6 +19,7 @@ _fake_cv2.namedWindow    = lambda *args, **kwargs: None
 _fake_cv2.moveWindow     = lambda *args, **kwargs: None
 _fake_cv2.imshow         = lambda *args, **kwargs: None
 _fake_cv2.resizeWindow   = lambda *args, **kwargs: None
+_fake_cv2.imwrite        = lambda *args, **kwargs: True
 _fake_cv2.WINDOW_NORMAL  = 0
 # (if you see any more cv2.* names used in your code, stub them here)
 sys.modules["cv2"] = _fake_cv2
@@ -35,11 +36,23 @@ class DummyThread:
     @daemon.setter
     def daemon(self, v): pass
     def start(self): pass
+    def join(self, timeout=None): pass
 
 @pytest.fixture(autouse=True)
 def disable_backgrounds(monkeypatch):
     # 2a) replace threading.Thread inside vimba_rap3
     monkeypatch.setattr(vimba_rap3.threading, "Thread", DummyThread)
     # 2b) replace the stdin‐reader so even if started it does nothing
-    monkeypatch.setattr(vimba_rap3, "add_stdin_input", lambda iq, cq: None)
+    monkeypatch.setattr(vimba_rap3, "add_stdin_input", lambda *args, **kwargs: None)
+    yield
+
+# ─── 3) Opt-in fixture for tests that need real worker threads ───
+# disable_backgrounds swaps Thread on the shared threading module, so grab the
+# real class at import time and put it back for modules that ask for it.
+import threading
+_RealThread = threading.Thread
+
+@pytest.fixture
+def real_threads(monkeypatch):
+    monkeypatch.setattr(threading, "Thread", _RealThread)
     yield
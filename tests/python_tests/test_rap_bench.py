@@ -0,0 +1,116 @@
+import json
+import pytest
+
+import rap_bench
+
+pytestmark = pytest.mark.usefixtures("real_threads")
+
+
+class FakeCV:
+    """Headless OpenCV double that records writes and shows."""
+    WINDOW_NORMAL = 0
+
+    def __init__(self):
+        self.written = []
+        self.shown = []
+
+    def imwrite(self, filename, img):
+        self.written.append(filename)
+
+    def imshow(self, title, img):
+        self.shown.append(title)
+
+    def waitKey(self, delay):
+        return -1
+
+
+def result(name, fps=100.0, p99=1.0, lost=0):
+    return {"name": name, "fps": fps, "latency_p99_ms": p99, "lost_frames": lost}
+
+
+@pytest.mark.parametrize("mode, saves, shows", [
+    ("save", True, False),
+    ("display", False, True),
+    ("save+display", True, True),
+])
+def test_run_case_drives_the_loop(tmp_path, mode, saves, shows):
+    cv = FakeCV()
+    r = rap_bench.run_case(6, mode, fps=200, seconds=0.3, save_dir=str(tmp_path), cv=cv, display_fps=0)
+    assert r["frames"] > 0
+    assert bool(cv.written) == saves
+    assert bool(cv.shown) == shows
+    if saves:
+        assert len(cv.written) == r["frames"]
+    if shows:
+        # frames cycle through the 6 well windows
+        assert len(set(cv.shown)) == min(6, r["frames"])
+        assert r["display_fps"] > 0
+    for key in ("fps", "latency_p50_ms", "latency_p99_ms", "callback_p99_ms", "peak_queue", "rss_mb"):
+        assert r[key] == r[key]  # not NaN
+    assert r["latency_p99_ms"] >= r["latency_p50_ms"]
+
+
+def test_run_case_restores_globals(tmp_path):
+    import vimba_rap3
+    vimba_rap3.SAVETOGGLE = 0
+    vimba_rap3.number_of_wells = 3
+    rap_bench.run_case(24, "save", fps=200, seconds=0.1, save_dir=str(tmp_path), cv=FakeCV())
+    assert vimba_rap3.SAVETOGGLE == 0
+    assert vimba_rap3.number_of_wells == 3
+
+
+def test_slow_display_never_costs_saved_frames(tmp_path):
+    import time
+
+    class SlowCV(FakeCV):
+        def imshow(self, title, img):
+            time.sleep(0.02)
+            super().imshow(title, img)
+
+    cv = SlowCV()
+    r = rap_bench.run_case(6, "save+display", fps=300, seconds=0.3, save_dir=str(tmp_path), cv=cv,
+                           display_fps=0)
+    assert len(cv.written) == r["frames"]
+    assert r["display_skipped"] > 0
+    assert len(cv.shown) < r["frames"]
+
+
+def test_run_case_converts_off_the_callback(tmp_path):
+    cv = FakeCV()
+    r = rap_bench.run_case(6, "save", fps=200, seconds=0.3, save_dir=str(tmp_path), cv=cv,
+                           pixel_format="Mono12", converters=2)
+    assert r["frames"] > 0
+    assert len(cv.written) == r["frames"]
+    assert r["name"].endswith("format=Mono12 converters=2")
+
+
+def test_sustained():
+    ok = {"fps": 99.0, "target_fps": 100.0, "lost_frames": 0, "peak_queue": 3, "queue_size": 1000}
+    assert rap_bench.sustained(ok)
+    assert not rap_bench.sustained(dict(ok, fps=50.0))
+    assert not rap_bench.sustained(dict(ok, lost_frames=1))
+    assert not rap_bench.sustained(dict(ok, peak_queue=900))
+
+
+def test_baseline_roundtrip_and_regressions(tmp_path):
+    path = tmp_path / "baseline.json"
+    rap_bench.save_baseline([result("a"), result("b"), result("c")], path)
+    assert "machine_info" in json.loads(path.read_text())
+
+    assert rap_bench.compare_to_baseline([result("a"), result("new")], path) == []
+    regressions = rap_bench.compare_to_baseline(
+        [result("a", fps=50.0), result("b", p99=10.0), result("c", lost=2)], path)
+    assert len(regressions) == 3
+    assert regressions[0].startswith("a: fps")
+    assert regressions[1].startswith("b: p99")
+    assert regressions[2].startswith("c: lost")
+
+
+def test_print_table(capsys):
+    r = dict(result("wells=1 mode=save target_fps=100"), latency_p50_ms=0.5, callback_p50_ms=0.05, callback_p99_ms=0.1,
+             peak_queue=2, flush_s=0.0, rss_mb=80.0)
+    rap_bench.print_table([r])
+    out = capsys.readouterr().out
+    assert "benchmark: 1 tests" in out
+    assert "wells=1 mode=save target_fps=100" in out
+    rap_bench.print_table([])
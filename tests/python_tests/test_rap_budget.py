@@ -0,0 +1,26 @@
+from rap_budget import MemoryBudget
+
+
+def test_grants_are_capped_by_what_is_left():
+    budget = MemoryBudget(10)
+    assert budget.total == 10 * 2**20
+    assert budget.grant("convert", 2 * 2**20) == 2 * 2**20
+    assert budget.grant("history", 20 * 2**20) == 8 * 2**20  # only what is left
+    assert budget.remaining == 0
+    assert budget.grant("extra", 2**20) == 0
+
+
+def test_rest_goes_to_the_last_pool_and_summary_in_mb():
+    budget = MemoryBudget(8)
+    budget.grant("convert", 2**20)
+    budget.grant("convert", 2**20)  # grants to one pool add up
+    assert budget.rest("ring") == 6 * 2**20
+    assert budget.summary() == {"total_mb": 8.0, "granted_mb": {"convert": 2.0, "ring": 6.0}}
+
+
+def test_share_is_a_fraction_of_the_total_that_leaves_room_for_the_ring():
+    budget = MemoryBudget(10)
+    assert budget.share(0.5) == 5 * 2**20
+    assert budget.share(0.5, keep=7 * 2**20) == 3 * 2**20
+    budget.grant("convert", 8 * 2**20)
+    assert budget.share(0.5, keep=4 * 2**20) == 0
@@ -0,0 +1,21 @@
+from rap_buffers import BufferTuner
+
+
+def test_pool_grows_when_starved_and_settles_after_a_change():
+    t = BufferTuner(count=10, max_count=64, interval=1.0)
+    assert t.check(0, now=0.0) is None  # first call sets the baseline
+    assert t.check(0, now=1.0) is None  # nothing went wrong
+    assert t.check(3, now=1.5) is None  # not due yet
+    assert t.check(3, now=2.0) == 20
+    assert t.check(5, now=2.5) is None  # the restart's own losses are ignored
+    assert t.check(5, now=3.0) is None
+    assert t.check(6, now=4.0) == 40
+    assert t.summary() == {"buffer_count": 40, "max": 64, "changes": 2}
+
+
+def test_pool_stops_at_the_maximum():
+    t = BufferTuner(count=40, max_count=64, interval=1.0)
+    t.check(0, now=0.0)
+    assert t.check(1, now=1.0) == 64
+    assert t.check(2, now=3.0) is None
+    assert t.count == 64
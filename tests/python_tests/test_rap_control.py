@@ -0,0 +1,93 @@
+import threading
+
+import pytest
+
+from rap_control import CameraControl
+
+pytestmark = pytest.mark.usefixtures("real_threads")
+
+
+def test_commands_run_off_the_caller_and_report_back():
+    reports = []
+    writes = []
+    control = CameraControl(report=reports.append).start()
+    caller = threading.current_thread()
+    cmd = control.submit("gain", lambda v: writes.append((threading.current_thread(), v)), 12.0)
+    assert cmd.wait(2)
+    control.stop()
+    assert writes[0][1] == 12.0
+    assert writes[0][0] is not caller
+    assert cmd.status == "ok"
+    assert reports == [cmd]
+    assert control.summary()["completed"] == 1
+
+
+def test_burst_of_writes_is_coalesced_to_the_last_value():
+    gate = threading.Event()
+    writes = []
+    control = CameraControl(report=None).start()
+    slow = control.submit("settings", lambda: gate.wait(2) and writes.append("settings"))
+    burst = [control.submit("exposure", writes.append, v) for v in (100.0, 200.0, 300.0)]
+    gain = control.submit("gain", writes.append, 5.0)
+    gate.set()
+    assert control.flush(2)
+    control.stop()
+    assert writes == ["settings", 300.0, 5.0]
+    assert slow.status == "ok"
+    assert [c.status for c in burst] == ["superseded", "superseded", "ok"]
+    assert gain.status == "ok"
+    assert control.superseded == 2
+
+
+def test_a_newer_write_moves_behind_an_earlier_settings_load():
+    gate = threading.Event()
+    writes = []
+    control = CameraControl(report=None).start()
+    control.submit("busy", gate.wait, 2)
+    control.submit("exposure", writes.append, 100.0)
+    control.submit("settings", writes.append, "freerun.xml")
+    control.submit("exposure", writes.append, 200.0)
+    gate.set()
+    assert control.flush(2)
+    control.stop()
+    assert writes == ["freerun.xml", 200.0]
+
+
+def test_failures_are_reported_and_the_worker_keeps_going(capsys):
+    control = CameraControl().start()
+
+    def fail():
+        raise RuntimeError("feature is read-only")
+
+    bad = control.submit("gain", fail)
+    good = control.submit("exposure", lambda: None)
+    assert control.flush(2)
+    control.stop()
+    assert bad.status == "error"
+    assert isinstance(bad.error, RuntimeError)
+    assert good.status == "ok"
+    out = capsys.readouterr().out
+    assert "py. Error - camera gain failed: feature is read-only" in out
+    assert "py. camera exposure ok" in out
+    assert control.summary()["failed"] == 1
+
+
+def test_quiet_commands_are_not_reported():
+    reports = []
+    control = CameraControl(report=reports.append).start()
+    quiet = control.submit("reconfigure", lambda: None, quiet=True)
+    loud = control.submit("gain", lambda: None)
+    assert control.flush(2)
+    control.stop()
+    assert (quiet.status, loud.status) == ("ok", "ok")
+    assert reports == [loud]
+
+
+def test_stop_cancels_what_it_cannot_finish():
+    gate = threading.Event()
+    control = CameraControl(report=None).start()
+    control.submit("busy", gate.wait, 2)
+    left = control.submit("gain", lambda: None)
+    control.stop(timeout=0.05)
+    assert left.status == "cancelled"
+    gate.set()
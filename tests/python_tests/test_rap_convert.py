@@ -0,0 +1,65 @@
+import threading
+import time
+
+import numpy as np
+import pytest
+
+from rap_convert import ConvertPool, mono8_converter
+from rap_ringbuffer import FrameRing
+from rap_simcam import PixelFormat
+
+pytestmark = pytest.mark.usefixtures("real_threads")
+
+
+def test_mono12_keeps_the_top_8_bits():
+    convert, dtype = mono8_converter(PixelFormat.Mono12)
+    assert dtype == np.uint16
+    raw = np.array([[[0x0FFF], [0x0120]]], dtype=np.uint16)
+    out = convert(raw)
+    assert out.dtype == np.uint8
+    assert out.tolist() == [[[0xFF], [0x12]]]
+
+
+def test_color_formats_need_cv2_and_unknown_formats_are_left_to_vmbpy():
+    assert mono8_converter(PixelFormat.Bgr8) is None  # no cv2 given
+    assert mono8_converter("Mono12p") is None
+
+
+def test_frames_leave_in_order_with_their_metadata():
+    dest = FrameRing(2**20)
+
+    def convert(image):
+        time.sleep(0.002 * (int(image[0, 0, 0]) % 3))  # workers finish out of order
+        return (image >> 4).astype(np.uint8)
+
+    pool = ConvertPool(dest, convert, np.uint16, workers=3, capacity_bytes=2**16).start()
+    t0 = time.perf_counter()
+    for num in range(20):
+        pool.submit(np.full((4, 4, 1), num << 4, dtype=np.uint16), num, frame_id=100 + num, timestamp=num)
+    got = []
+    for _ in range(20):
+        f = dest.get(True, 2)
+        got.append((f.num, f.frame_id, int(f.image[0, 0, 0])))
+        assert t0 <= f.received < time.perf_counter()  # the callback time, not the conversion time
+        f.release()
+    pool.stop()
+    assert got == [(n, 100 + n, n) for n in range(20)]
+    assert pool.pending() == 0
+    assert pool.summary() == {"workers": 3, "converted": 20, "failed": 0}
+
+
+def test_a_failed_conversion_does_not_hold_up_later_frames():
+    dest = FrameRing(2**20)
+
+    def convert(image):
+        if image[0, 0, 0] == 1:
+            raise ValueError("bad frame")
+        return image
+
+    pool = ConvertPool(dest, convert, workers=2, capacity_bytes=2**12).start()
+    for num in range(3):
+        pool.submit(np.full((2, 2, 1), num, dtype=np.uint8), num)
+    nums = [dest.get(True, 2).num for _ in range(2)]
+    pool.stop()
+    assert nums == [0, 2]
+    assert pool.failed == 1
@@ -0,0 +1,207 @@
+import numpy as np
+import pytest
+
+from rap_demux import WellDemux, WellQueues
+from rap_ringbuffer import FrameRing
+
+PERIOD = 10_000_000  # 100 fps in ns
+
+
+def assign_all(demux, ids, period=PERIOD):
+    return [demux.assign(fid, 1 + fid * period) for fid in ids]
+
+
+# ——— WellDemux ——— #
+
+def test_wells_follow_frame_ids_through_dropped_frames():
+    demux = WellDemux(6)
+    ids = [0, 1, 2, 4, 5, 9, 10, 11]  # frames 3, 6, 7, 8 never reached the host
+    assert assign_all(demux, ids) == [fid % 6 for fid in ids]
+    assert demux.gaps == 2
+    assert demux.missing == 4
+
+
+def test_phase_offsets_the_sequence():
+    demux = WellDemux(4, phase=1)
+    assert assign_all(demux, [0, 1, 2, 3]) == [1, 2, 3, 0]
+    demux.set_phase(-1)
+    assert demux.assign(4, 1 + 4 * PERIOD) == 3
+
+
+def test_period_is_learned_from_unit_steps():
+    demux = WellDemux(4, calibrate=8)
+    assign_all(demux, range(9))
+    assert demux.period_ns == pytest.approx(PERIOD)
+
+
+def test_recalibrate_relearns_the_period_and_keeps_the_sequence():
+    demux = WellDemux(4, calibrate=8)
+    assign_all(demux, range(9))
+    demux.recalibrate()
+    assert demux.period_ns is None
+    # the frame rate halved: no re-phase on the first slow frame, the new period is learned
+    times = [1 + 8 * PERIOD + k * 2 * PERIOD for k in range(1, 10)]
+    assert [demux.assign(9 + k, t) for k, t in enumerate(times)] == [(9 + k) % 4 for k in range(9)]
+    assert demux.rephased == 0
+    assert demux.period_ns == pytest.approx(2 * PERIOD)
+    fixed = WellDemux(4, period_ns=PERIOD)
+    fixed.recalibrate()
+    assert fixed.period_ns == PERIOD
+
+
+def test_a_trigger_pause_does_not_move_the_sequence():
+    demux = WellDemux(24, period_ns=PERIOD)
+    assign_all(demux, range(40))
+    # the trigger paused for 10 periods: no trigger, no LED step, no frame
+    assert demux.assign(40, 1 + 50 * PERIOD) == 16
+    assert demux.assign(41, 1 + 51 * PERIOD) == 17
+    assert (demux.gaps, demux.missing, demux.rephased) == (0, 0, 0)
+
+
+def test_single_frame_jitter_keeps_the_wells():
+    demux = WellDemux(24, period_ns=PERIOD)
+    times = [1 + fid * PERIOD for fid in range(30)]
+    times[24] += int(0.6 * PERIOD)  # one frame 0.6 period late, the next ones on time
+    assert [demux.assign(fid, t) for fid, t in enumerate(times)] == [fid % 24 for fid in range(30)]
+    assert (demux.gaps, demux.rephased) == (0, 0)
+
+
+def test_freerun_re_phases_on_time_beyond_the_tolerance():
+    demux = WellDemux(4, period_ns=PERIOD, freerun=True)
+    assert assign_all(demux, [0, 1, 2]) == [0, 1, 2]
+    assert demux.assign(3, 1 + 3 * PERIOD + int(0.9 * PERIOD)) == 3  # within one period: FrameID
+    # the LEDs moved on by 3 periods while the FrameID stepped by 1
+    assert demux.assign(4, 1 + 7 * PERIOD) == 2
+    assert (demux.rephased, demux.missing) == (1, 2)
+
+
+def test_frame_id_reset_falls_back_on_time():
+    demux = WellDemux(6, period_ns=PERIOD)
+    demux.assign(100, 1)
+    demux.assign(101, 1 + PERIOD)
+    assert demux.assign(0, 1 + 3 * PERIOD) == (100 + 3) % 6
+    assert demux.assign(1, 1 + 4 * PERIOD) == (100 + 4) % 6
+    assert demux.rephased == 1
+
+
+def test_frame_id_reset_without_timestamps_assumes_next_frame():
+    demux = WellDemux(3)
+    demux.assign(7)
+    assert demux.assign(0) == (7 + 1) % 3
+
+
+def test_route_sets_frame_well():
+    ring = FrameRing(1024)
+    ring.put(np.zeros((2, 2, 1), np.uint8), 1, frame_id=5, timestamp=99)
+    frame = ring.get()
+    assert WellDemux(4).route(frame) == 1
+    assert frame.well == 1
+
+
+# ——— WellQueues ——— #
+
+def make_frames(ring, demux, count):
+    frames = []
+    for num in range(count):
+        ring.put(np.full((2, 2, 1), num, np.uint8), num, frame_id=num, timestamp=1 + num * PERIOD)
+        frame = ring.get()
+        demux.route(frame)
+        frames.append(frame)
+    return frames
+
+
+def test_consumers_get_independent_per_well_queues():
+    ring = FrameRing(1024, min_slots=16, max_slots=16)
+    demux = WellDemux(3)
+    queues = WellQueues(3)
+    save = queues.subscribe("save")
+    show = queues.subscribe("display", maxlen=1)
+    for frame in make_frames(ring, demux, 7):
+        queues.publish(frame)
+        frame.release()
+    assert save.qsize() == 7
+    assert save.qsize(0) == 3
+    assert show.qsize() == 3
+    assert show.dropped == 4
+    shown = show.latest()
+    assert [f.num for f in shown] == [6, 4, 5]
+    saved = save.drain()
+    assert [f.num for f in saved] == list(range(7))
+    assert [f.well for f in saved] == [n % 3 for n in range(7)]
+    # slots come back once every consumer released them
+    for f in saved:
+        f.release()
+    assert ring.in_use() == 3
+    for f in shown:
+        f.release()
+    assert ring.in_use() == 0
+
+
+def test_latest_releases_older_frames_and_unsubscribe_clears():
+    ring = FrameRing(1024, min_slots=16, max_slots=16)
+    queues = WellQueues(2)
+    show = queues.subscribe("display")
+    for frame in make_frames(ring, WellDemux(2), 6):
+        queues.publish(frame)
+        frame.release()
+    latest = show.latest()
+    assert [f.num for f in latest] == [4, 5]
+    assert ring.in_use() == 2
+    for f in latest:
+        f.release()
+    queues.subscribe("save")
+    for frame in make_frames(ring, WellDemux(2), 2):
+        queues.publish(frame)
+        frame.release()
+    queues.unsubscribe("save")
+    queues.unsubscribe("display")
+    assert ring.in_use() == 0
+
+
+def test_wells_can_grow():
+    ring = FrameRing(1024, min_slots=8, max_slots=8)
+    queues = WellQueues(2)
+    q = queues.subscribe("save")
+    queues.set_wells(4)
+    frame = make_frames(ring, WellDemux(4), 4)[3]
+    queues.publish(frame)
+    assert q.get(3) is frame
+    assert q.get(3) is None
+
+
+def test_consumers_are_shed_by_ring_fill():
+    ring = FrameRing(1024, min_slots=8, max_slots=8)
+    queues = WellQueues(2)
+    save = queues.subscribe("save")
+    show = queues.subscribe("display", maxlen=1, shed_at=0.6)
+    frames = make_frames(ring, WellDemux(2), 3)
+    assert queues.publish(frames[0], fill=0.5) == []
+    assert queues.publish(frames[1], fill=0.6) == ["display"]
+    assert queues.publish(frames[2], fill=0.9) == ["display"]
+    assert save.qsize() == 3  # saving is never shed
+    assert show.qsize() == 1 and show.shed == 2
+
+
+# ——— with the simulated camera ——— #
+
+def test_drops_do_not_shift_wells_with_the_sim_camera(real_threads):
+    import time
+    import vimba_rap3
+    from rap_simcam import SimCamera
+    cam = SimCamera(fps=500, wells=6, drop_rate=0.2, incomplete_rate=0.1, seed=3)
+    handler = vimba_rap3.Handler(cv2=None, capacity_bytes=128 * 816 * 624)
+    handler.verbose = 0
+    demux = WellDemux(6)
+    cam.start_streaming(handler=handler, buffer_count=64)
+    time.sleep(0.1)  # ~50 frames, well within the ring
+    cam.stop_streaming()
+    checked = 0
+    while not handler.display_queue.empty():
+        frame, _ = handler.get_image()
+        demux.route(frame)
+        top = frame.image[:312].mean()  # incomplete frames lose the bottom half
+        assert frame.well == int(np.argmin([abs(top - cam.well_level(w)) for w in range(6)]))
+        checked += 1
+        frame.release()
+    assert checked > 12
+    assert demux.gaps > 0  # the host counter alone would have drifted
@@ -0,0 +1,84 @@
+import threading
+import time
+
+import numpy as np
+import pytest
+
+from rap_demux import WellDemux, WellQueues
+from rap_display import DisplayThread
+from rap_ringbuffer import FrameRing
+
+pytestmark = pytest.mark.usefixtures("real_threads")
+
+
+def publish(ring, queues, demux, count, start=0):
+    for num in range(start, start + count):
+        ring.put(np.full((2, 2, 1), num % 256, np.uint8), num, frame_id=num)
+        frame = ring.get()
+        demux.route(frame)
+        queues.publish(frame)
+        frame.release()
+
+
+def wait_for(condition, timeout=2.0):
+    deadline = time.monotonic() + timeout
+    while not condition() and time.monotonic() < deadline:
+        time.sleep(0.005)
+    return condition()
+
+
+def test_shows_only_the_newest_frame_per_well():
+    ring = FrameRing(1024, min_slots=32, max_slots=32)
+    queues = WellQueues(3)
+    shown = []
+    gate = threading.Event()
+
+    def show(frames):
+        gate.wait(2)
+        shown.append(sorted(f.num for f in frames))
+
+    display = DisplayThread(queues.subscribe("display", maxlen=1), show, max_fps=0).start()
+    publish(ring, queues, WellDemux(3), 12)
+    gate.set()
+    assert wait_for(lambda: display.frames_shown and ring.in_use() == 0)
+    display.stop()
+    assert shown[-1] == [9, 10, 11]
+    assert display.frames_skipped > 0
+    assert display.frames_shown + display.frames_skipped == 12
+
+
+def test_refresh_rate_is_capped():
+    ring = FrameRing(1024, min_slots=64, max_slots=64)
+    queues = WellQueues(1)
+    display = DisplayThread(queues.subscribe("display", maxlen=1), lambda frames: None, max_fps=20).start()
+    t_end = time.monotonic() + 0.3
+    num = 0
+    while time.monotonic() < t_end:
+        publish(ring, queues, WellDemux(1), 1, start=num)
+        num += 1
+        time.sleep(0.002)
+    display.stop()
+    assert 2 <= display.refreshes <= 8
+    assert ring.in_use() == 0
+
+
+def test_keypress_requests_quit_without_frames():
+    queues = WellQueues(1)
+    keys = iter([0, 0, -1])
+    display = DisplayThread(queues.subscribe("display", maxlen=1), lambda frames: None,
+                            keypress=lambda: next(keys), idle_poll=0.01).start()
+    assert wait_for(lambda: display.quit_requested)
+    display.stop()
+
+
+def test_show_errors_still_release_frames():
+    ring = FrameRing(1024, min_slots=8, max_slots=8)
+    queues = WellQueues(2)
+
+    def show(frames):
+        raise RuntimeError("window closed")
+
+    display = DisplayThread(queues.subscribe("display", maxlen=1), show, max_fps=0).start()
+    publish(ring, queues, WellDemux(2), 4)
+    assert wait_for(lambda: display.errors > 0 and ring.in_use() == 0)
+    display.stop()
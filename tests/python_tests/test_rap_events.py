@@ -0,0 +1,59 @@
+import threading
+import time
+
+import pytest
+
+from rap_events import CommandQueue, EventSource
+
+pytestmark = pytest.mark.usefixtures("real_threads")
+
+
+def test_wait_returns_on_notify_from_another_thread():
+    events = EventSource()
+    seen = events.seq
+    t0 = time.perf_counter()
+    threading.Timer(0.05, events.notify).start()
+    assert events.wait(seen, 2)
+    assert time.perf_counter() - t0 < 1
+    assert not events.wait(events.seq, 0.01)
+    assert events.summary() == {"wakeups": 1, "timeouts": 1, "timers": 0}
+
+
+def test_a_notify_before_the_wait_is_not_lost():
+    events = EventSource()
+    seen = events.seq
+    events.notify()  # e.g. a frame arrived while the loop was busy
+    t0 = time.perf_counter()
+    assert events.wait(seen, 2)
+    assert time.perf_counter() - t0 < 0.1
+
+
+def test_timers_run_when_due_without_catching_up():
+    events = EventSource()
+    assert events.next_timeout() is None
+    ticks = []
+    events.every(1.0, lambda: ticks.append(1), "tick")
+    now = time.perf_counter()
+    assert 0.9 < events.next_timeout(now) <= 1.0
+    events.run_timers(now)
+    assert ticks == []
+    events.run_timers(now + 5.0)  # late: runs once, next one a full interval later
+    assert ticks == [1]
+    assert events.next_timeout(now + 5.0) == pytest.approx(1.0)
+
+
+def test_failing_timer_is_logged_and_kept(caplog):
+    events = EventSource()
+    events.every(0.0, lambda: 1 / 0, "broken")
+    events.run_timers()
+    events.run_timers()
+    assert caplog.text.count("timer broken failed") == 2
+
+
+def test_command_queue_wakes_the_loop():
+    events = EventSource()
+    queue = CommandQueue(events)
+    seen = events.seq
+    queue.put("hello")
+    assert events.wait(seen, 0)
+    assert queue.get_nowait() == "hello"
@@ -0,0 +1,74 @@
+import numpy as np
+import pytest
+
+from rap_history import WellHistory, history_depth
+
+SHAPE = (2, 3, 1)
+FRAME_BYTES = 2 * 3
+
+
+def img(value):
+    return np.full(SHAPE, value, dtype=np.uint8)
+
+
+def fill(history, wells, frames):
+    for num in range(frames):
+        history.append(num % wells, img(num), num, timestamp=1000 + num)
+
+
+def test_depth_in_frames_or_seconds():
+    assert history_depth("30") == 30
+    assert history_depth("0") == 0
+    assert history_depth("2s", fps=120, wells=24) == 10  # 240 frames shared by 24 wells
+    assert history_depth("0.5s", fps=100, wells=3) == 17
+    with pytest.raises(ValueError):
+        history_depth("2s")  # seconds need the frame rate
+    with pytest.raises(ValueError):
+        history_depth("long")
+
+
+def test_one_preallocated_array_and_last_k_oldest_first():
+    history = WellHistory(3, 4)
+    assert history.frames is None  # sized from the first frame
+    fill(history, 3, 20)  # well 1 got frames 1, 4, 7, 10, 13, 16, 19
+    assert history.frames.shape == (3, 4) + SHAPE
+    assert history.available(1) == 4
+    last = history.last(1, 3)
+    assert last.shape == (3,) + SHAPE
+    assert last[:, 0, 0, 0].tolist() == [13, 16, 19]
+    assert history.numbers(1, 10).tolist() == [10, 13, 16, 19]
+    assert history.times(1, 2).tolist() == [1016, 1019]
+    assert history.latest(2)[0, 0, 0] == 17
+    assert history.summary()["appended"] == 20
+
+
+def test_views_are_zero_copy_and_read_only_across_the_wrap():
+    history = WellHistory(1, 4, shape=SHAPE)
+    fill(history, 1, 6)  # slots hold 4, 5, 2, 3
+    views = history.views(0, 3)
+    assert [v[:, 0, 0, 0].tolist() for v in views] == [[3], [4, 5]]
+    assert all(np.shares_memory(v, history.frames) for v in views)
+    with pytest.raises(ValueError):
+        views[0][0] = 0
+    assert history.views(0, 2)[0][:, 0, 0, 0].tolist() == [4, 5]
+
+
+def test_last_all_gathers_every_well():
+    history = WellHistory(3, 4)
+    fill(history, 3, 8)  # well 2 has only 2 frames
+    block = history.last_all(3)
+    assert block.shape == (3, 2) + SHAPE
+    assert block[:, :, 0, 0, 0].tolist() == [[3, 6], [4, 7], [2, 5]]
+
+
+def test_capacity_caps_the_depth_and_set_wells_keeps_it():
+    history = WellHistory(2, 10, capacity_bytes=8 * FRAME_BYTES)
+    fill(history, 2, 10)
+    assert history.depth == 4
+    assert history.nbytes == 8 * FRAME_BYTES
+    history.set_wells(4, depth=3)
+    assert (history.depth, history.available(0)) == (2, 0)  # starts over in the same memory
+    too_small = WellHistory(4, 3, capacity_bytes=FRAME_BYTES)
+    too_small.append(0, img(1))
+    assert too_small.depth == 0 and too_small.skipped == 1
+    assert too_small.last(0, 2).shape == (0,) + SHAPE
@@ -0,0 +1,68 @@
+import json
+import time
+import urllib.request
+
+import pytest
+
+from rap_metrics import Histogram, Metrics, MetricsReporter, serve_http
+
+pytestmark = pytest.mark.usefixtures("real_threads")
+
+
+def test_histogram_percentiles_are_bucket_bounds():
+    h = Histogram()
+    for v in [1.0] * 98 + [50.0, 400.0]:
+        h.observe(v)
+    s = h.summary()
+    assert s["count"] == 100
+    assert s["min"] == 1.0 and s["max"] == 400.0
+    assert 1.0 <= s["p50"] < 1.3
+    assert 50.0 <= s["p99"] < 64.0
+    assert Histogram().summary() == {"count": 0}
+
+
+def test_snapshot_rates_gauges_and_windows():
+    m = Metrics()
+    depth = [3]
+    m.gauge("queue_depth", lambda: depth[0])
+    m.gauge("broken", lambda: 1 / 0)
+    m.inc("frames_received", 10)
+    m.observe("callback_to_dequeue", 2.0)
+    time.sleep(0.02)
+    snap = m.snapshot()
+    assert snap["counters"] == {"frames_received": 10}
+    assert snap["rates"]["frames_received"] > 0
+    assert snap["gauges"] == {"queue_depth": 3, "broken": None}
+    assert snap["latency_ms"]["callback_to_dequeue"]["count"] == 1
+    # the next window starts empty
+    snap = m.snapshot()
+    assert snap["rates"]["frames_received"] == 0
+    assert snap["latency_ms"]["callback_to_dequeue"] == {"count": 0}
+    assert snap["counters"]["frames_received"] == 10
+
+
+def test_reporter_sends_metrics_messages():
+    sent = []
+    m = Metrics()
+    m.inc("frames_written")
+    reporter = MetricsReporter(m, interval=0.01, send=sent.append).start()
+    deadline = time.monotonic() + 2
+    while len(sent) < 2 and time.monotonic() < deadline:
+        time.sleep(0.005)
+    reporter.stop()
+    assert sent[0]["type"] == "metrics"
+    assert sent[0]["v"] == 1
+    assert sent[0]["counters"] == {"frames_written": 1}
+
+
+def test_http_endpoint_serves_the_latest_snapshot():
+    m = Metrics()
+    m.inc("frames_received", 5)
+    server = serve_http(m, 0)
+    try:
+        port = server.server_address[1]
+        with urllib.request.urlopen("http://127.0.0.1:{}/metrics".format(port), timeout=2) as r:
+            body = json.loads(r.read())
+        assert body["counters"] == {"frames_received": 5}
+    finally:
+        server.shutdown()
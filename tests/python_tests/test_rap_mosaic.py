@@ -0,0 +1,77 @@
+import numpy as np
+import pytest
+
+from rap_mosaic import Mosaic
+
+
+class ResizeCV2:
+    """OpenCV double: nearest-neighbour resize into dst, records windows and imshow calls."""
+    WINDOW_NORMAL = 0
+    INTER_AREA = 3
+
+    def __init__(self):
+        self.windows = []
+        self.shown = []
+
+    def namedWindow(self, title, flags):
+        self.windows.append(title)
+
+    def resize(self, image, size, dst=None, interpolation=None):
+        w, h = size
+        ys = np.arange(h) * image.shape[0] // h
+        xs = np.arange(w) * image.shape[1] // w
+        dst[...] = image[ys[:, None], xs, 0]
+        return dst
+
+    def imshow(self, title, canvas):
+        self.shown.append((title, canvas))
+
+
+def test_24_wells_tile_the_screen_without_overlap():
+    mosaic = Mosaic(ResizeCV2(), 24, screen=(1920, 1080), frame_size=(816, 624))
+    assert mosaic.canvas.shape == (1080, 1920)
+    assert mosaic.canvas.dtype == np.uint8
+    assert mosaic.tile_size == (320, 244)
+    covered = np.zeros(mosaic.canvas.shape, dtype=int)
+    for tile in mosaic.tiles:
+        assert np.shares_memory(tile, mosaic.canvas)
+        tile[...] = 1
+        covered += mosaic.canvas
+        mosaic.canvas[:] = 0
+    assert covered.max() == 1
+
+
+def test_update_resizes_into_the_tile_in_place():
+    cv = ResizeCV2()
+    mosaic = Mosaic(cv, 6, screen=(1200, 600), frame_size=(816, 624))
+    canvas = mosaic.canvas
+    mosaic.update(4, np.full((624, 816, 1), 200, np.uint8))
+    assert mosaic.canvas is canvas
+    assert np.all(mosaic.tiles[4] == 200)
+    assert canvas.sum() == 200 * mosaic.tiles[4].size
+    mosaic.update(9, np.zeros((624, 816, 1), np.uint8))  # beyond the layout: ignored
+    assert mosaic.updates == 1
+
+
+def test_show_is_capped_and_skips_unchanged_canvas():
+    cv = ResizeCV2()
+    mosaic = Mosaic(cv, 4, screen=(800, 600), max_fps=10)
+    frame = np.ones((624, 816, 1), np.uint8)
+    mosaic.update(0, frame)
+    assert mosaic.show(now=100.0)
+    mosaic.update(1, frame)
+    assert not mosaic.show(now=100.05)  # within 1/10 s
+    assert mosaic.show(now=100.2)
+    assert not mosaic.show(now=101.0)  # nothing changed since
+    assert len(cv.shown) == 2
+    assert cv.windows == ["RAP wells"]
+    assert all(canvas is mosaic.canvas for _, canvas in cv.shown)
+
+
+def test_set_wells_relays_out_and_clears():
+    mosaic = Mosaic(ResizeCV2(), 24)
+    mosaic.update(0, np.full((624, 816, 1), 9, np.uint8))
+    mosaic.set_wells(1)
+    assert mosaic.canvas.sum() == 0
+    assert len(mosaic.tiles) == 1
+    assert mosaic.tile_size == (1412, 1080)
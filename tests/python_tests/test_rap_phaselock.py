@@ -0,0 +1,102 @@
+from types import SimpleNamespace
+
+import numpy as np
+import pytest
+
+from rap_demux import WellDemux
+from rap_phaselock import PhaseLock
+from rap_wells import well_region
+
+WELLS = 6
+
+
+# frames of a camera that sees the whole plate: dim background, the region of the lit well bright
+def plate_frames(wells, width=816, height=624):
+    rng = np.random.default_rng(0)
+    background = 20 + rng.normal(0, 3, (height, width, 1))
+    images = np.empty((wells, height, width, 1), np.uint8)
+    for w in range(wells):
+        img = background.copy()
+        y0, y1, x0, x1 = well_region(w, wells, width, height)
+        img[y0:y1, x0:x1] += 150
+        images[w] = np.clip(img, 0, 255)
+    return images
+
+
+TEMPLATES = plate_frames(WELLS)
+
+
+def frames(demux, lock, leds, first_id=0):
+    # feeds frames whose lit well is leds[i] and FrameID first_id + i; returns the assigned wells
+    wells = []
+    for i, led in enumerate(leds):
+        frame = SimpleNamespace(image=TEMPLATES[led], frame_id=first_id + i, timestamp=0, well=None)
+        demux.route(frame)
+        lock.observe(frame, demux)
+        wells.append(frame.well)
+    return wells
+
+
+def test_lit_well_from_a_few_hundred_pixels():
+    lock = PhaseLock(WELLS, 816, 624)
+    assert lock._index.size <= 300
+    for w in range(WELLS):
+        assert lock.lit_well(TEMPLATES[w]) == w
+    assert lock.lit_well(np.full((624, 816, 1), 40, np.uint8)) is None
+
+
+def test_locks_within_the_first_cycle():
+    demux = WellDemux(WELLS)
+    lock = PhaseLock(WELLS)
+    leds = [i % WELLS for i in range(3 * WELLS)]
+    wells = frames(demux, lock, leds, first_id=5)  # the camera counter is 5 ahead of the LEDs
+    assert lock.locked
+    assert demux.phase == (0 - 5) % WELLS
+    assert wells[WELLS - 1:] == leds[WELLS - 1:]  # from the frame that completed the first cycle on
+
+
+def test_periodic_checks_re_phase_after_a_slip():
+    demux = WellDemux(WELLS)
+    lock = PhaseLock(WELLS, check_every=2, confirm=3)
+    frames(demux, lock, [i % WELLS for i in range(WELLS)])
+    assert lock.locked and demux.phase == 0
+    # the LED sequence slips by two without a FrameID gap
+    leds = [(i + 2) % WELLS for i in range(WELLS, 4 * WELLS)]
+    wells = frames(demux, lock, leds, first_id=WELLS)
+    assert demux.phase == 2
+    assert lock.relocks == 1
+    assert wells[-5:] == leds[-5:]
+
+
+def test_dark_frames_are_ignored():
+    demux = WellDemux(WELLS)
+    lock = PhaseLock(WELLS)
+    dark = np.full((624, 816, 1), 40, np.uint8)
+    for i in range(2 * WELLS):
+        frame = SimpleNamespace(image=dark, frame_id=i, timestamp=0, well=None)
+        demux.route(frame)
+        assert not lock.observe(frame, demux)
+    assert not lock.locked
+
+
+def test_single_well_and_well_changes():
+    demux = WellDemux(1)
+    lock = PhaseLock(1)
+    frame = SimpleNamespace(image=TEMPLATES[0], frame_id=0, timestamp=0, well=None)
+    demux.route(frame)
+    assert not lock.observe(frame, demux)
+    demux.set_wells(WELLS)
+    frames(demux, lock, [i % WELLS for i in range(1, WELLS + 1)], first_id=1)
+    assert lock.wells == WELLS and lock.locked
+
+
+def test_one_well_per_frame_leaves_the_phase_alone():
+    from rap_simcam import SimCamera
+    images = SimCamera(wells=WELLS)._templates  # the whole frame shows the lit well, no region stands out
+    demux = WellDemux(WELLS)
+    lock = PhaseLock(WELLS)
+    for i in range(3 * WELLS):
+        frame = SimpleNamespace(image=images[(i + 2) % WELLS], frame_id=i, timestamp=0, well=None)
+        demux.route(frame)
+        assert not lock.observe(frame, demux)
+    assert not lock.locked and demux.phase == 0
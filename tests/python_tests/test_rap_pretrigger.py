@@ -0,0 +1,50 @@
+import numpy as np
+
+from rap_history import WellHistory
+from rap_pretrigger import PreTrigger
+
+MS = 10**6
+
+
+def history_with(frames, wells=3, depth=4):
+    history = WellHistory(wells, depth)
+    for num in range(frames):
+        history.append(num % wells, np.full((2, 2, 1), num, np.uint8), num, timestamp=1 + num * 10 * MS)
+    return history
+
+
+def window(history, k):
+    return [h for well in range(history.wells) for h in history.pin(well, k)]
+
+
+def test_backlog_is_reserved_in_acquisition_order_with_wall_times():
+    history = history_with(9)
+    reserved = []
+    pre = PreTrigger(window(history, 2), lambda num, well, t: reserved.append((num, well, t)) or num,
+                     now_ns=1000 * MS)
+    assert [r[:2] for r in reserved] == [(3, 0), (4, 1), (5, 2), (6, 0), (7, 1), (8, 2)]
+    # dated back from the newest frame on the camera clock
+    assert [r[2] // MS for r in reserved] == [950, 960, 970, 980, 990, 1000]
+    assert pre.total == 6 and pre.pending() == 6
+
+
+def test_step_submits_while_there_is_room_and_holds_are_released_by_the_writer():
+    history = history_with(9)
+    pre = PreTrigger(window(history, 2), lambda num, well, t: "img{}".format(num))
+    queued = []
+    assert pre.step(lambda target, image, hold: queued.append((target, image, hold)), limit=2) == 2
+    assert pre.step(lambda *item: queued.append(item), room=lambda: len(queued) < 5) == 3
+    assert [q[0] for q in queued] == ["img3", "img4", "img5", "img6", "img7"]
+    assert all(q[1][0, 0, 0] == int(q[0][3:]) for q in queued)
+    assert not pre.done
+    pre.step(lambda *item: queued.append(item))
+    assert pre.done and pre.summary()["submitted"] == 6
+    # pinned slots are not overwritten until the writer releases them
+    history.append(0, np.full((2, 2, 1), 9, np.uint8), 9)
+    history.append(0, np.full((2, 2, 1), 12, np.uint8), 12)
+    history.append(0, np.full((2, 2, 1), 15, np.uint8), 15)
+    assert history.held == 1 and queued[0][1][0, 0, 0] == 3
+    for _, _, hold in queued:
+        hold.release()
+    history.append(0, np.full((2, 2, 1), 15, np.uint8), 15)
+    assert history.numbers(0, 4).tolist() == [6, 9, 12, 15]
@@ -0,0 +1,48 @@
+import numpy as np
+import pytest
+
+from rap_preview import Preview
+
+
+def test_rig_frames_bin_3x3_to_salliedxy():
+    preview = Preview((256, 208))
+    image = np.random.default_rng(0).integers(0, 256, (624, 816, 1), dtype=np.uint8)
+    out = preview.bin(image)
+    assert out.shape == (208, 256, 1)
+    assert out.dtype == np.uint8
+    assert preview.factor == (3, 3)
+    assert preview.crop == (0, 624, 24, 792)
+    expected = image[:, 24:792].reshape(208, 3, 256, 3, 1).mean(axis=(1, 3))
+    assert np.abs(out.astype(float) - expected).max() <= 0.5
+
+
+def test_output_buffers_are_reused_per_key():
+    preview = Preview((4, 2))
+    a = preview.bin(np.full((6, 12), 10, np.uint8), key=0)
+    b = preview.bin(np.full((6, 12), 20, np.uint8), key=1)
+    again = preview.bin(np.full((6, 12), 30, np.uint8), key=0)
+    assert again is a and b is not a
+    assert np.all(a == 30) and np.all(b == 20)
+
+
+def test_shape_change_reallocates():
+    preview = Preview((4, 2))
+    first = preview.bin(np.zeros((6, 12), np.uint8))
+    out = preview.bin(np.zeros((8, 8, 3), np.uint8))
+    assert out.shape == (2, 4, 3)
+    assert out is not first
+
+
+def test_small_frames_pass_through():
+    preview = Preview((256, 208))
+    image = np.arange(24, dtype=np.uint8).reshape(4, 6)
+    out = preview.bin(image)
+    assert preview.factor == (1, 1)
+    assert np.array_equal(out, image)
+
+
+def test_large_blocks_do_not_overflow():
+    preview = Preview((2, 2))
+    out = preview.bin(np.full((64, 64), 255, np.uint8))
+    assert preview.factor == (32, 32)
+    assert np.all(out == 255)
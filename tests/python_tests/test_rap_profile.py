@@ -0,0 +1,79 @@
+import os
+import pstats
+import time
+
+import pytest
+
+from rap_profile import LoopProfiler
+
+pytestmark = pytest.mark.usefixtures("real_threads")
+
+
+def test_laps_split_the_loop_into_stages():
+    p = LoopProfiler()
+    p.start(sample=False)
+    for _ in range(20):
+        p.begin()
+        time.sleep(0.002)
+        p.lap("get_image")
+        p.lap("maybesaveimage")
+    p.record("maybeshowimage", 0.001)
+    stats = p.summary()
+    assert list(stats)[0] == "get_image"  # slowest first
+    assert stats["get_image"]["n"] == 20
+    assert stats["get_image"]["mean"] >= 2.0
+    assert stats["maybesaveimage"]["mean"] < stats["get_image"]["mean"]
+    assert sum(s["share"] for s in stats.values()) == pytest.approx(1.0)
+
+
+def test_disabled_profiler_records_nothing():
+    p = LoopProfiler()
+    p.begin()
+    p.lap("get_image")
+    assert p.summary() == {}
+    assert p.stop() is None
+
+
+def test_window_keeps_the_latest_timings():
+    p = LoopProfiler(window=5)
+    p.start(sample=False)
+    for ms in range(10):
+        p.record("save", ms / 1000.0)
+    assert p.summary()["save"]["n"] == 5
+    assert p.summary()["save"]["mean"] == pytest.approx(7.0)
+
+
+def test_stop_writes_folded_stacks_and_pstats(tmp_path):
+    p = LoopProfiler(directory=str(tmp_path))
+    p.start(cprofile=True, interval=0.001)
+    end = time.perf_counter() + 0.1
+    while time.perf_counter() < end:
+        p.begin()
+        sum(range(1000))
+        p.lap("work")
+    out = p.stop()
+    assert not p.enabled
+    folded, stats = sorted(out["files"])
+    assert folded.endswith(".folded") and stats.endswith(".pstats")
+    lines = open(folded).read().splitlines()
+    assert lines and all(line.rsplit(" ", 1)[1].isdigit() for line in lines)
+    assert any(line.startswith("MainThread;") and "test_stop_writes_folded_stacks_and_pstats" in line for line in lines)
+    assert pstats.Stats(stats).total_calls > 0
+    assert os.path.dirname(folded) == str(tmp_path)
+
+
+def test_cprofile_keeps_collecting_after_a_dump(tmp_path):
+    def work():
+        return sum(range(100))
+    p = LoopProfiler(directory=str(tmp_path))
+    p.start(sample=False, cprofile=True)
+    for _ in range(50):
+        work()
+    first, = p.dump()["files"]
+    for _ in range(50):
+        work()
+    second, = p.stop()["files"]
+
+    def calls(path):
+        return sum(nc for (_, _, name), (_, nc, _, _, _) in pstats.Stats(path).stats.items() if name == "work")
+    assert (calls(first), calls(second)) == (50, 100)
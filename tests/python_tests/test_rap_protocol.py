@@ -0,0 +1,48 @@
+import io
+import json
+
+import pytest
+
+from rap_protocol import ProtocolError, is_json_command, parse_request, reply, reply_error
+
+
+def test_json_requests_are_told_apart_from_text_commands():
+    assert is_json_command(' {"v": 1}')
+    assert not is_json_command("trigger,1")
+
+
+def test_parse_request_reads_settings_and_commands():
+    req = parse_request('{"v": 1, "id": "s3", "set": {"fps": 50}, "cmds": [["startsave", "/data/s3"], ["mode", 2]]}')
+    assert req.id == "s3"
+    assert req.settings == {"fps": 50}
+    assert req.cmds == [["startsave", "/data/s3"], ["mode", "2"]]
+
+
+@pytest.mark.parametrize("text, error_type, request_id", [
+    ("{not json", "bad_request", None),
+    ("[1, 2]", "bad_request", None),
+    ('{"v": 2, "id": 7, "set": {"fps": 5}}', "unsupported_version", 7),
+    ('{"v": 1, "id": 8, "set": [1]}', "bad_request", 8),
+    ('{"v": 1, "id": 9, "cmds": ["quit"]}', "bad_request", 9),
+    ('{"v": 1, "id": 10}', "bad_request", 10),
+])
+def test_parse_request_errors_are_typed(text, error_type, request_id):
+    with pytest.raises(ProtocolError) as exc:
+        parse_request(text)
+    assert exc.value.type == error_type
+    assert exc.value.request_id == request_id
+
+
+def test_replies_are_single_prefixed_json_lines(monkeypatch):
+    out = io.StringIO()
+    monkeypatch.setattr("sys.stdout", out)
+    reply("a", "ack", applied={"gain": 3.0})
+    reply_error("b", ProtocolError("invalid_value", "gain must be a number"))
+    reply_error("c", RuntimeError("feature locked"))
+    lines = out.getvalue().splitlines()
+    assert all(line.startswith("py.json ") for line in lines)
+    ack, err, cam = (json.loads(line[len("py.json "):]) for line in lines)
+    assert ack == {"v": 1, "id": "a", "type": "ack", "ok": True, "applied": {"gain": 3.0}}
+    assert err["error"] == {"type": "invalid_value", "message": "gain must be a number"}
+    assert not err["ok"]
+    assert cam["error"]["type"] == "camera_error"
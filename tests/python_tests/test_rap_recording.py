@@ -0,0 +1,111 @@
+import numpy as np
+import pytest
+
+from rap_recording import RapRecording
+from rap_stack import StackSession
+
+
+def frame(value, shape=(6, 8, 1)):
+    return np.full(shape, value, dtype=np.uint8)
+
+
+def make_stack(path, wells, frames):
+    session = StackSession(path, wells=wells)
+    for num in range(frames):
+        session.reserve(num % wells, num, timestamp=num * 10)(frame(num))
+    session.close()
+    return path
+
+
+def npy_imread(path):
+    with open(path, "rb") as f:
+        return np.load(f)
+
+
+def make_tiffs(path, frames, skip=(), well=None):
+    for num in range(frames):
+        if num in skip:
+            continue
+        name = "img{:09d}.tif".format(num) if well is None else "img{:09d}_well{:02d}.tif".format(num, well(num))
+        with open(path / name, "wb") as f:
+            np.save(f, frame(num, shape=(6, 8)))
+    return path
+
+
+# ——— stacked sessions ——— #
+
+def test_well_is_a_zero_copy_memmap(tmp_path):
+    rec = RapRecording(make_stack(tmp_path, wells=3, frames=30))
+    assert rec.format == "stack"
+    assert rec.frames() == [10, 10, 10]
+    well = rec.well(1)
+    assert isinstance(well, np.memmap)
+    assert well.shape == (10, 6, 8)
+    block = well[2:5]
+    assert np.shares_memory(block, well)
+    assert block[:, 0, 0].tolist() == [7, 10, 13]
+    assert rec.nums(1).tolist() == list(range(1, 30, 3))
+    assert rec.timestamps(1)[0] == 10
+
+
+def test_chunks_cover_the_well(tmp_path):
+    rec = RapRecording(make_stack(tmp_path, wells=2, frames=22))
+    starts, values = [], []
+    for t0, block in rec.chunks(0, 4):
+        starts.append(t0)
+        values.extend(block[:, 0, 0].tolist())
+    assert starts == [0, 4, 8]
+    assert values == list(range(0, 22, 2))
+
+
+def test_empty_well_and_range(tmp_path):
+    rec = RapRecording(make_stack(tmp_path, wells=3, frames=2))
+    assert rec.frames(2) == 0
+    assert rec.well(2).shape == (0, 6, 8)
+    with pytest.raises(IndexError):
+        rec.well(3)
+
+
+# ——— TIFF folders ——— #
+
+def test_tiff_frames_go_to_the_well_in_their_name(tmp_path):
+    rec = RapRecording(make_tiffs(tmp_path, 9, well=lambda num: (num + 1) % 3), imread=npy_imread)
+    assert rec.wells == 3  # taken from the names
+    assert rec.nums(1).tolist() == [0, 3, 6]
+    assert rec.well(1)[:][:, 0, 0].tolist() == [0, 3, 6]
+    assert RapRecording(tmp_path, wells=4, imread=npy_imread).frames() == [3, 3, 3, 0]
+    with pytest.raises(ValueError):
+        RapRecording(tmp_path, wells=2)
+
+
+def test_tiff_folder_through_the_same_interface(tmp_path):
+    rec = RapRecording(make_tiffs(tmp_path, 12, skip={4}), wells=3, imread=npy_imread)
+    assert rec.format == "tiff"
+    assert rec.frames() == [4, 3, 4]
+    assert rec.nums(1).tolist() == [1, 7, 10]
+    well = rec.well(1)
+    assert well.shape == (3, 6, 8)
+    assert well[1:][:, 0, 0].tolist() == [7, 10]
+    assert well[0][0, 0] == 1
+    assert np.asarray(well).shape == (3, 6, 8)
+    assert rec.timestamps(1) is None
+    assert [t0 for t0, _ in rec.chunks(0, 3)] == [0, 3]
+
+
+def test_tiff_frames_are_decoded_lazily(tmp_path):
+    reads = []
+    def imread(path):
+        reads.append(path.name)
+        return npy_imread(path)
+    rec = RapRecording(make_tiffs(tmp_path, 8), wells=2, imread=imread)
+    assert reads == []
+    rec.well(0)[1:3]
+    assert len(reads) == 3  # one probe for shape/dtype plus the two sliced frames
+
+
+def test_tiff_folder_needs_wells_and_frames(tmp_path):
+    with pytest.raises(FileNotFoundError):
+        RapRecording(tmp_path, wells=2)
+    make_tiffs(tmp_path, 2)
+    with pytest.raises(ValueError):
+        RapRecording(tmp_path)
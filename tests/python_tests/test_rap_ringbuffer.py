@@ -0,0 +1,194 @@
+import os
+import threading
+import time
+from queue import Empty, Full
+
+import numpy as np
+import pytest
+
+from rap_ringbuffer import FrameRing
+
+pytestmark = pytest.mark.usefixtures("real_threads")
+
+SHAPE = (4, 6, 1)
+FRAME_BYTES = 4 * 6
+
+
+def img(value):
+    return np.full(SHAPE, value, dtype=np.uint8)
+
+
+def test_capacity_is_set_in_bytes():
+    ring = FrameRing(10 * FRAME_BYTES + 5, shape=SHAPE)
+    assert ring.maxsize == 10
+    assert ring.nbytes == 10 * FRAME_BYTES
+    assert FrameRing(1, shape=SHAPE).maxsize == 2  # never fewer than min_slots
+    assert FrameRing(10**6, shape=SHAPE, max_slots=8).maxsize == 8
+
+
+def test_allocates_lazily_from_first_frame():
+    ring = FrameRing(3 * FRAME_BYTES)
+    assert ring.maxsize == 0 and not ring.full()
+    ring.put(img(1), 0)
+    assert ring.maxsize == 3 and ring.shape == SHAPE
+    with pytest.raises(ValueError):
+        ring.put(np.zeros((2, 2, 1), dtype=np.uint8), 1)
+
+
+def test_fifo_order_and_numbers():
+    ring = FrameRing(4 * FRAME_BYTES, shape=SHAPE)
+    for i in range(3):
+        ring.put(img(i), i)
+    assert ring.qsize() == 3
+    for i in range(3):
+        frame = ring.get()
+        assert frame.num == i
+        assert np.all(frame.image == i)
+        display, num = frame
+        assert num == i
+        frame.release()
+    assert ring.empty()
+
+
+def test_views_are_read_only_and_slots_are_reused_without_reallocation():
+    ring = FrameRing(2 * FRAME_BYTES, shape=SHAPE)
+    slabs = ring._slabs
+    ring.put(img(5), 0)
+    frame = ring.get()
+    with pytest.raises(ValueError):
+        frame.image[0, 0, 0] = 1
+    frame.release()
+    for i in range(10):
+        ring.put(img(i), i)
+        ring.get().release()
+    assert ring._slabs is slabs
+
+
+def test_a_released_slot_is_the_next_one_taken():
+    ring = FrameRing(8 * FRAME_BYTES, shape=SHAPE)
+    used = set()
+    for i in range(20):
+        ring.put(img(i), i)
+        frame = ring.get()
+        used.add(frame.index)
+        frame.release()
+    assert used == {0}  # an idle ring keeps reusing one warm slot
+
+
+def rss_bytes():
+    with open("/proc/self/statm") as f:
+        return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+
+
+@pytest.mark.skipif(not os.path.exists("/proc/self/statm"), reason="needs /proc")
+def test_slots_are_faulted_in_when_allocated():
+    before = rss_bytes()
+    ring = FrameRing(64 * 2**20, shape=(1024, 1024, 1))
+    assert rss_bytes() - before > 0.9 * ring.nbytes
+
+
+def test_full_ring_nonblocking_and_timeout():
+    ring = FrameRing(2 * FRAME_BYTES, shape=SHAPE)
+    ring.put(img(0), 0)
+    ring.put(img(1), 1)
+    assert ring.full()
+    with pytest.raises(Full):
+        ring.put(img(2), 2, block=False)
+    with pytest.raises(Full):
+        ring.put(img(2), 2, timeout=0.01)
+    ring.get().release()
+    ring.put(img(2), 2, block=False)
+
+
+def test_fill_counts_queued_and_held_slots():
+    ring = FrameRing(4 * FRAME_BYTES, shape=SHAPE)
+    assert ring.fill() == 0.0
+    ring.put(img(1), 1)
+    ring.put(img(2), 2)
+    assert ring.fill() == 0.5
+    frame = ring.get()
+    assert ring.fill() == 0.5  # held until released
+    frame.release()
+    assert ring.fill() == 0.25
+
+
+def test_get_empty_nonblocking_and_timeout():
+    ring = FrameRing(2 * FRAME_BYTES, shape=SHAPE)
+    with pytest.raises(Empty):
+        ring.get(block=False)
+    with pytest.raises(Empty):
+        ring.get(timeout=0.01)
+
+
+def test_slot_is_only_recycled_after_every_holder_released():
+    ring = FrameRing(2 * FRAME_BYTES, shape=SHAPE)
+    ring.put(img(0), 0)
+    ring.put(img(1), 1)
+    frame = ring.get().retain()
+    frame.release()
+    assert ring.full()
+    assert ring.in_use() == 1
+    frame.release()
+    assert not ring.full()
+    with pytest.raises(ValueError):
+        frame.release()
+    with pytest.raises(ValueError):
+        frame.retain()
+
+
+def test_blocked_producer_resumes_on_release():
+    ring = FrameRing(2 * FRAME_BYTES, shape=SHAPE)
+    ring.put(img(0), 0)
+    ring.put(img(1), 1)
+    first = ring.get()
+    done = threading.Event()
+
+    def producer():
+        ring.put(img(2), 2)
+        done.set()
+
+    t = threading.Thread(target=producer)
+    t.start()
+    assert not done.wait(0.05)
+    first.release()
+    assert done.wait(1)
+    t.join()
+    assert [ring.get().num, ring.get().num] == [1, 2]
+
+
+def test_frames_carry_their_put_time():
+    ring = FrameRing(1024, min_slots=2, max_slots=2)
+    before = time.perf_counter()
+    ring.put(np.zeros((2, 2, 1), np.uint8), 1)
+    frame = ring.get()
+    assert before <= frame.received <= time.perf_counter()
+    frame.release()
+
+
+
+def test_forwarded_frames_keep_the_time_given_and_wake_on_ready():
+    ring = FrameRing(1024, min_slots=2, max_slots=2)
+    woken = []
+    ring.on_ready = lambda: woken.append(ring.qsize())
+    ring.put(np.zeros((2, 2, 1), np.uint8), 1, received=12.5)
+    assert woken == [1]  # called once the frame can be taken
+    frame = ring.get()
+    assert frame.received == 12.5
+    frame.release()
+
+
+def test_a_dropped_ring_is_freed_without_the_garbage_collector():
+    import gc
+    import weakref
+    gc.disable()
+    try:
+        ring = FrameRing(4 * FRAME_BYTES, shape=SHAPE)
+        ring.put(img(7), 0)
+        held = ring.get()
+        gone = weakref.ref(ring)
+        del ring
+        assert gone() is None
+        assert np.all(held.image == 7)  # a frame still held keeps its memory
+        held.release()  # nothing left to hand it back to
+    finally:
+        gc.enable()
@@ -0,0 +1,95 @@
+import threading
+
+import pytest
+
+from rap_control import CameraControl
+from rap_demux import WellDemux
+from rap_session import LiveSession
+
+pytestmark = pytest.mark.usefixtures("real_threads")
+
+
+def test_camera_changes_run_on_the_worker_and_finish_between_frames():
+    gate = threading.Event()
+    applied = []
+    reports = []
+    wells = []
+    demux = WellDemux(4, period_ns=None, freerun=True)
+    demux.period_ns = 10e6  # learned from the frames
+
+    def apply(cam, changes):
+        gate.wait(2)
+        applied.append(changes)
+
+    control = CameraControl(report=None).start()
+    session = LiveSession("cam", apply, control=control, on_wells=wells.append, demux=demux, report=reports.append)
+    for num in range(10):
+        session.frame(num)
+    rec = session.reconfigure({"trigger": True, "gain": 3.0, "wells": 12})
+    for num in range(10, 15):  # the stream keeps going while the camera is written
+        session.frame(num)
+    assert not rec.done
+    assert wells == []
+    gate.set()
+    assert control.flush(2)
+    session.frame(15)
+    control.stop()
+    assert applied == [{"trigger": True, "gain": 3.0}]
+    assert rec.status == "applied"
+    assert wells == [12]
+    assert (rec.requested_frame, rec.applied_frame, rec.affected) == (9, 15, 5)
+    assert demux.period_ns is None
+    assert demux.freerun is False  # triggered again: the FrameID steps are trusted
+    assert reports == [rec]
+
+
+def test_wells_only_change_applies_at_the_next_frame():
+    wells = []
+    session = LiveSession("cam", lambda cam, changes: None, on_wells=wells.append, report=None)
+    session.frame(3)
+    rec = session.reconfigure({"wells": 6})
+    session.frame(4)
+    assert wells == [6]
+    assert rec.affected == 0
+    assert session.summary() == {"reconfigurations": 1, "failed": 0, "in_flight": 0}
+
+
+def test_failed_camera_change_is_reported_and_wells_kept(capsys):
+    wells = []
+
+    def apply(cam, changes):
+        raise RuntimeError("TriggerMode is locked")
+
+    control = CameraControl().start()  # reports to stdout too, but not the writes of a reconfiguration
+    session = LiveSession("cam", apply, control=control, on_wells=wells.append)
+    session.reconfigure({"trigger": False, "wells": 2})
+    assert control.flush(2)
+    session.frame(1)
+    control.stop()
+    assert session.last.status == "error"
+    assert wells == []
+    lines = [line for line in capsys.readouterr().out.splitlines() if line.startswith("py.")]
+    assert lines == ["py. Error - reconfigure trigger=False wells=2 failed: TriggerMode is locked"]
+
+
+def test_a_change_finishes_on_tick_while_no_frames_come_in():
+    woken = threading.Event()
+    done = []
+    control = CameraControl(report=None).start()
+    session = LiveSession("cam", lambda cam, changes: None, control=control, report=None, wake=woken.set)
+    session.frame(7)
+    rec = session.reconfigure({"trigger": True}, on_done=done.append)
+    assert woken.wait(2)  # the worker wakes the main loop once the camera is written
+    control.stop()
+    session.tick()
+    assert done == [rec]
+    assert (rec.status, rec.applied_frame, rec.affected) == ("applied", 8, 0)
+    session.tick()
+    assert done == [rec]  # finished once
+
+
+def test_unknown_settings_are_rejected():
+    session = LiveSession("cam", lambda cam, changes: None, report=None)
+    with pytest.raises(ValueError):
+        session.reconfigure({"binning": 2})
+    assert session.reconfigurations == 0
@@ -0,0 +1,183 @@
+import os
+from pathlib import Path
+
+import rap_settings
+from rap_settings import SettingsEngine, load_profile
+
+CONFIG = Path(__file__).parents[2] / "config"
+
+PROFILE = """<?xml version="1.0" encoding="UTF-8" standalone="yes" ?>
+<ModuleSettings>
+    <SettingsStruct>
+        <MaxIterations Value="3" />
+    </SettingsStruct>
+    <CameraInfo Id="SIM0">
+        <RemoteDevice>
+            <Feature Name="AcquisitionFrameRate" Value="{rate}" Type="Float" />
+            <Feature Name="AcquisitionFrameRateEnable" Value="1" Type="Bool" />
+            <Feature Name="DeviceTemperature" Value="33.7" Type="Float" />
+            <Feature Name="ExposureMode" Value="{exposure}" Type="Enum" />
+            <Feature Name="Gain" Value="{gain}" Type="Float" />
+            <SelectorGroup Name="TriggerSelector" Type="Enum" Value="FrameStart">
+                <Feature Name="TriggerMode" Value="{mode}" Type="Enum" />
+            </SelectorGroup>
+            <SelectorGroup Name="TriggerSelector" Type="Enum" Value="ExposureActive">
+                <Feature Name="TriggerMode" Value="Off" Type="Enum" />
+            </SelectorGroup>
+            <Feature Name="TriggerSelector" Value="ExposureActive" Type="Enum" />
+        </RemoteDevice>
+    </CameraInfo>
+</ModuleSettings>
+"""
+
+
+def write_profile(path, rate=100.0, exposure="Timed", gain=0.0, mode="Off"):
+    path.write_text(PROFILE.format(rate=rate, exposure=exposure, gain=gain, mode=mode))
+    return str(path)
+
+
+class Feature:
+    def __init__(self, cam, name, writeable=True):
+        self.cam = cam
+        self.name = name
+        self.writeable = writeable
+
+    def _key(self):
+        if self.name == "TriggerMode":
+            return (self.name, self.cam.values["TriggerSelector"])
+        return self.name
+
+    def get(self):
+        return self.cam.values[self._key()]
+
+    def set(self, value):
+        if self.name in self.cam.reject:
+            self.cam.reject.discard(self.name)
+            raise RuntimeError("{} rejected".format(self.name))
+        self.cam.values[self._key()] = value
+        self.cam.writes.append(self.name)
+
+    def is_writeable(self):
+        return self.writeable
+
+
+class SelectorCam:
+    # camera whose TriggerMode depends on TriggerSelector, like the real one
+    def __init__(self):
+        self.values = {"AcquisitionFrameRate": 0.0, "AcquisitionFrameRateEnable": False,
+                       "DeviceTemperature": 40.0, "ExposureMode": "Timed", "Gain": 0.0,
+                       "TriggerSelector": "ExposureActive",
+                       ("TriggerMode", "FrameStart"): "Off", ("TriggerMode", "ExposureActive"): "Off"}
+        self.writes = []
+        self.reject = set()
+        self.full_loads = []
+
+    def get_feature_by_name(self, name):
+        if name == "TriggerMode" or name in self.values:
+            return Feature(self, name, writeable=name != "DeviceTemperature")
+        raise RuntimeError("Feature '{}' not found.".format(name))
+
+    def load_settings(self, path, persist_type=None):
+        self.full_loads.append(path)
+        if not os.path.exists(path):
+            return
+        for (selector, selector_value, name), (value, type_) in load_profile(path).features.items():
+            if name == "DeviceTemperature":
+                continue
+            key = (name, selector_value) if selector is not None else name
+            self.values[key] = rap_settings.convert(value, type_)
+
+
+def test_profiles_are_parsed_once_until_the_file_changes(tmp_path):
+    trigger = load_profile(CONFIG / "trigger.xml")
+    freerun = load_profile(CONFIG / "freerun.xml")
+    assert load_profile(CONFIG / "trigger.xml") is trigger
+    assert trigger.features[("TriggerSelector", "FrameStart", "TriggerMode")] == ("On", "Enum")
+    assert freerun.features[("TriggerSelector", "FrameStart", "TriggerMode")] == ("Off", "Enum")
+    differ = [k for k, v in trigger.features.items() if freerun.features.get(k) != v]
+    assert 0 < len(differ) < len(trigger) // 10
+
+    path = write_profile(tmp_path / "p.xml")
+    first = load_profile(path)
+    assert first.max_iterations == 3
+    write_profile(tmp_path / "p.xml", gain=5.0)
+    os.utime(path, (1, 1))
+    assert load_profile(path) is not first
+
+
+def test_first_apply_is_a_full_load_then_only_differences_are_written(tmp_path):
+    cam = SelectorCam()
+    engine = SettingsEngine(cam)
+    freerun = write_profile(tmp_path / "freerun.xml")
+    trigger = write_profile(tmp_path / "trigger.xml", exposure="TriggerControlled", mode="On")
+    assert engine.apply(freerun)["full"]
+    assert cam.full_loads == [freerun]
+    result = engine.apply(trigger)
+    assert not result["full"]
+    assert result["changed"] == 2
+    assert sorted(cam.writes) == ["ExposureMode", "TriggerMode", "TriggerSelector", "TriggerSelector"]
+    assert cam.values[("TriggerMode", "FrameStart")] == "On"
+    assert cam.values["TriggerSelector"] == "ExposureActive"  # put back after the group write
+    cam.writes.clear()
+    assert engine.apply(trigger)["written"] == 0
+    assert cam.writes == []
+
+
+def test_writes_follow_dependency_order(tmp_path):
+    cam = SelectorCam()
+    engine = SettingsEngine(cam)
+    engine.apply(write_profile(tmp_path / "a.xml"))
+    cam.writes.clear()
+    engine.apply(write_profile(tmp_path / "b.xml", rate=50.0, exposure="TriggerControlled", gain=3.0, mode="On"))
+    order = [w for w in cam.writes if w != "TriggerSelector"]
+    assert order == ["TriggerMode", "ExposureMode", "Gain", "AcquisitionFrameRate"]
+
+
+def test_forget_rechecks_features_written_directly(tmp_path):
+    cam = SelectorCam()
+    engine = SettingsEngine(cam)
+    path = write_profile(tmp_path / "p.xml")
+    engine.apply(path)
+    cam.values["Gain"] = 12.0  # e.g. a gain command
+    assert engine.apply(path)["written"] == 0
+    engine.forget("Gain")
+    result = engine.apply(path)
+    assert result["written"] == 1
+    assert cam.values["Gain"] == 0.0
+
+
+def test_rejected_writes_are_retried_and_missing_features_skipped(tmp_path):
+    cam = SelectorCam()
+    engine = SettingsEngine(cam)
+    engine.apply(write_profile(tmp_path / "a.xml"))
+    del cam.values["AcquisitionFrameRateEnable"]
+    engine.state.pop((None, None, "AcquisitionFrameRateEnable"))
+    cam.reject.add("Gain")
+    result = engine.apply(write_profile(tmp_path / "b.xml", gain=7.0, rate=25.0))
+    assert result["failed"] == []
+    assert result["missing"] == 1
+    assert cam.values["Gain"] == 7.0
+    assert cam.values["AcquisitionFrameRate"] == 25.0
+
+
+def test_readonly_and_missing_features_are_not_remembered_as_applied(tmp_path):
+    cam = SelectorCam()
+    engine = SettingsEngine(cam)
+    engine.apply(write_profile(tmp_path / "a.xml"))
+    del cam.values["AcquisitionFrameRateEnable"]
+    engine.state[(None, None, "AcquisitionFrameRateEnable")] = False
+    hot = tmp_path / "hot.xml"
+    hot.write_text(open(write_profile(tmp_path / "b.xml")).read().replace("33.7", "35.0"))
+    for _ in range(2):  # both are checked against the camera again on every apply
+        result = engine.apply(str(hot))
+        assert (result["changed"], result["readonly"], result["missing"], result["written"]) == (2, 1, 1, 0)
+    assert (None, None, "DeviceTemperature") not in engine.state
+    assert (None, None, "AcquisitionFrameRateEnable") not in engine.state
+
+
+def test_missing_file_goes_to_the_camera(tmp_path):
+    cam = SelectorCam()
+    engine = SettingsEngine(cam)
+    assert engine.apply(str(tmp_path / "missing.xml")) is None
+    assert cam.full_loads == [str(tmp_path / "missing.xml")]
+    assert engine.state is None
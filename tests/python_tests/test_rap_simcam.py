@@ -0,0 +1,134 @@
+import time
+import numpy as np
+import pytest
+
+import rap_simcam
+from rap_simcam import SimCamera, FrameStatus, PixelFormat
+
+pytestmark = pytest.mark.usefixtures("real_threads")
+
+
+class RecordingHandler:
+    """Collects (id, status, well shown) and re-queues every frame, like a well-behaved handler."""
+    def __init__(self, wells):
+        self.wells = wells
+        self.seen = []
+
+    def __call__(self, cam, stream, frame):
+        top = frame.as_opencv_image()[:cam.height // 2].mean()  # incomplete frames lose the bottom half
+        lit = int(np.argmin([abs(top - cam.well_level(w)) for w in range(self.wells)]))
+        self.seen.append((frame.get_id(), frame.get_status(), lit))
+        cam.queue_frame(frame)
+
+
+def run_for(cam, handler, seconds, buffer_count=10):
+    cam.start_streaming(handler=handler, buffer_count=buffer_count)
+    time.sleep(seconds)
+    cam.stop_streaming()
+
+
+# ——— SimCamera ——— #
+
+def test_frames_are_mono8_with_rig_resolution():
+    cam = SimCamera(fps=200, wells=24)
+    handler = RecordingHandler(24)
+    run_for(cam, handler, 0.1)
+    assert handler.seen
+    assert cam.get_pixel_formats() == (PixelFormat.Mono8,)
+    frame = rap_simcam.SimFrame(816, 624)
+    assert frame.as_opencv_image().shape == (624, 816, 1)
+    assert frame.as_opencv_image().dtype == np.uint8
+
+
+def test_mono12_frames_are_16_bit_and_convert_to_mono8():
+    cam = SimCamera(fps=200, wells=4, pixel_format=PixelFormat.Mono12)
+    assert cam.get_pixel_formats() == (PixelFormat.Mono12,)
+    frames = []
+
+    def handler(cam, stream, frame):
+        frames.append((frame.as_numpy_ndarray().copy(), frame.convert_pixel_format(PixelFormat.Mono8).as_opencv_image()))
+        cam.queue_frame(frame)
+    run_for(cam, handler, 0.05)
+    raw, mono8 = frames[0]
+    assert raw.dtype == np.uint16 and raw.max() > 255
+    assert mono8.dtype == np.uint8
+    assert np.array_equal(mono8, raw >> 4)
+
+
+def test_led_interleave_follows_frame_id():
+    cam = SimCamera(fps=500, wells=24)
+    handler = RecordingHandler(24)
+    run_for(cam, handler, 0.2)
+    assert len(handler.seen) > 24
+    for fid, status, lit in handler.seen:
+        assert status == FrameStatus.Complete
+        assert lit == fid % 24
+
+
+def test_injected_drops_leave_gaps_in_frame_ids():
+    cam = SimCamera(fps=500, wells=6, drop_rate=0.3)
+    handler = RecordingHandler(6)
+    run_for(cam, handler, 0.2)
+    ids = [fid for fid, _, _ in handler.seen]
+    assert cam.frames_dropped > 0
+    assert ids == sorted(ids)
+    assert ids[-1] + 1 > len(ids)
+    # the LED sequence keeps running through the gaps
+    assert all(lit == fid % 6 for fid, _, lit in handler.seen)
+
+
+def test_injected_incomplete_frames():
+    cam = SimCamera(fps=500, wells=6, incomplete_rate=0.5)
+    handler = RecordingHandler(6)
+    run_for(cam, handler, 0.2)
+    statuses = [status for _, status, _ in handler.seen]
+    assert FrameStatus.Incomplete in statuses
+    assert statuses.count(FrameStatus.Incomplete) == cam.frames_incomplete
+
+
+def test_frames_are_lost_when_handler_never_requeues():
+    cam = SimCamera(fps=500, wells=6)
+    seen = []
+    run_for(cam, lambda c, s, f: seen.append(f.get_id()), 0.1, buffer_count=3)
+    assert len(seen) == 3
+    assert cam.frames_no_buffer > 0
+
+
+def test_framerate_feature_changes_the_rate():
+    cam = SimCamera(fps=50, wells=6)
+    cam.get_feature_by_name("AcquisitionFrameRate").set(400.0)
+    handler = RecordingHandler(6)
+    run_for(cam, handler, 0.25)
+    assert len(handler.seen) > 40
+
+
+def test_features_and_readonly_features():
+    cam = SimCamera()
+    cam.Gain.set(12.5)
+    assert cam.Gain.get() == 12.5
+    with pytest.raises(rap_simcam.VmbFeatureError):
+        cam.DeviceTemperature.set(1)
+    with pytest.raises(rap_simcam.VmbFeatureError):
+        cam.get_feature_by_name("NoSuchFeature")
+    with pytest.raises(AttributeError):
+        cam.NoSuchFeature
+
+
+def test_load_settings_applies_known_features(tmp_path):
+    xml = tmp_path / "s.xml"
+    xml.write_text('<ModuleSettings><CameraInfo><RemoteDevice>'
+                   '<Feature Name="Gain" Value="10.5" Type="Float" />'
+                   '<Feature Name="TriggerMode" Value="On" Type="Enum" />'
+                   '<Feature Name="DeviceTemperature" Value="70" Type="Float" />'
+                   '</RemoteDevice></CameraInfo></ModuleSettings>')
+    cam = SimCamera()
+    cam.load_settings(str(xml), None)
+    assert cam.Gain.get() == 10.5
+    assert cam.TriggerMode.get() == "On"
+    assert cam.settings_loaded == [str(xml)]
+
+
+def test_load_settings_missing_file_is_ignored(tmp_path):
+    cam = SimCamera()
+    cam.load_settings(str(tmp_path / "missing.xml"), None)
+    assert cam.settings_loaded == []
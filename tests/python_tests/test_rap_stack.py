@@ -0,0 +1,104 @@
+import json
+import threading
+import numpy as np
+import pytest
+
+from rap_stack import (StackSession, StackFile, open_stack, is_stack_session,
+                       well_filename, HEADER_BYTES, SESSION_FILE)
+from rap_writer import WriterPool
+
+pytestmark = pytest.mark.usefixtures("real_threads")
+
+
+def frame(value, shape=(6, 8, 1)):
+    return np.full(shape, value, dtype=np.uint8)
+
+
+def test_frames_round_trip_per_well(tmp_path):
+    session = StackSession(tmp_path, wells=2)
+    for num in range(6):
+        session.reserve(num % 2, num, timestamp=1000 + num)(frame(num))
+    session.close()
+    info, files = open_stack(tmp_path)
+    assert info["frames"] == [3, 3]
+    assert info["shape"] == [6, 8, 1]
+    assert sorted(files) == [0, 1]
+    well1 = files[1]
+    assert len(well1) == 3
+    assert well1.shape == (6, 8)
+    assert [well1.read(t)[0, 0] for t in range(3)] == [1, 3, 5]
+    nums, stamps = well1.index()
+    assert nums.tolist() == [1, 3, 5]
+    assert stamps.tolist() == [1001, 1003, 1005]
+
+
+def test_file_layout_is_header_plus_fixed_stride(tmp_path):
+    session = StackSession(tmp_path, wells=1)
+    for num in range(4):
+        session.reserve(0, num)(frame(num))
+    session.close()
+    path = tmp_path / well_filename(0, "rap")
+    assert path.stat().st_size == HEADER_BYTES + 4 * 48
+    raw = path.read_bytes()
+    assert raw[HEADER_BYTES + 2 * 48] == 2
+
+
+def test_out_of_order_writes_land_in_their_slots(tmp_path):
+    session = StackSession(tmp_path, wells=1)
+    targets = [session.reserve(0, num) for num in range(5)]
+    for num in (4, 1, 3, 0, 2):
+        targets[num](frame(num))
+    session.close()
+    _, files = open_stack(tmp_path)
+    assert [files[0].read(t)[0, 0] for t in range(5)] == [0, 1, 2, 3, 4]
+
+
+def test_writer_pool_fills_a_session(tmp_path):
+    session = StackSession(tmp_path, wells=4)
+    pool = WriterPool(lambda target, image: target(image), workers=3, max_queued=8)
+    for num in range(40):
+        pool.submit(session.reserve(num % 4, num), frame(num % 256))
+    assert pool.close(timeout=5)
+    session.close()
+    info, files = open_stack(tmp_path)
+    assert info["frames"] == [10] * 4
+    assert files[2].index()[0].tolist() == list(range(2, 40, 4))
+
+
+def test_shape_mismatch_is_rejected(tmp_path):
+    session = StackSession(tmp_path, wells=2)
+    session.reserve(0, 0)(frame(0))
+    with pytest.raises(ValueError):
+        session.reserve(1, 1)(frame(1, shape=(3, 3, 1)))
+
+
+def test_well_count_can_grow(tmp_path):
+    session = StackSession(tmp_path, wells=1)
+    session.reserve(2, 0)(frame(7))
+    session.close()
+    info, files = open_stack(tmp_path)
+    assert info["wells"] == 3
+    assert files[2].read(0)[0, 0] == 7
+
+
+def test_unclosed_session_is_still_readable(tmp_path):
+    session = StackSession(tmp_path, wells=1)
+    for num in range(3):
+        session.reserve(0, num)(frame(num))
+    for f in session._files[0]:
+        f.flush()
+    assert is_stack_session(tmp_path)
+    assert json.loads((tmp_path / SESSION_FILE).read_text())["frames"] == [0]
+    assert len(StackFile(tmp_path / well_filename(0, "rap"))) == 3
+
+
+def test_bad_magic_and_range(tmp_path):
+    bad = tmp_path / "x.rap"
+    bad.write_bytes(b"\0" * 128)
+    with pytest.raises(ValueError):
+        StackFile(bad)
+    session = StackSession(tmp_path, wells=1)
+    session.reserve(0, 0)(frame(0))
+    session.close()
+    with pytest.raises(IndexError):
+        StackFile(tmp_path / well_filename(0, "rap")).read(1)
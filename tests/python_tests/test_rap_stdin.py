@@ -0,0 +1,64 @@
+import os
+import threading
+import time
+from queue import Queue
+
+import pytest
+
+from rap_stdin import Command, CommandParser, read_commands
+
+pytestmark = pytest.mark.usefixtures("real_threads")
+
+
+def test_commands_carry_their_receive_time():
+    parser = CommandParser()
+    cmds = parser.feed("<startsave,/tmp/x>", received=12.5)
+    assert cmds == ["startsave,/tmp/x"]
+    assert isinstance(cmds[0], Command)
+    assert cmds[0].received == 12.5
+
+
+def test_frames_split_across_feeds():
+    parser = CommandParser()
+    assert parser.feed("<wel") == []
+    assert parser.pending
+    assert parser.feed("ls,24><tri") == ["wells,24"]
+    assert parser.feed("gger,1>") == ["trigger,1"]
+    assert not parser.pending
+    assert parser.commands == 2
+
+
+def test_text_outside_frames_is_discarded():
+    parser = CommandParser()
+    assert parser.feed("noise\n<a>\r\n<b>tail") == ["a", "b"]
+    assert parser.discarded == len("noise\n") + len("\r\n") + len("tail")
+
+
+def test_json_requests_pass_through_the_framing():
+    parser = CommandParser()
+    text = '{"v": 1, "id": "a<b", "set": {"gain": 3}, "cmds": [["savedir", "x\\u003ey"]]}'
+    assert parser.feed("<" + text + ">") == [text]
+
+
+def test_oversize_frames_are_dropped_up_to_their_close():
+    parser = CommandParser(max_length=8)
+    assert parser.feed("<" + "x" * 6) == []
+    assert parser.feed("x" * 6 + "><ok>") == ["ok"]
+    assert parser.oversize == 1
+    assert parser.feed("<12345678>") == ["12345678"]  # exactly max_length is fine
+
+
+def test_read_commands_from_a_pipe():
+    r, w = os.pipe()
+    cq = Queue()
+    with os.fdopen(r, "r", encoding="utf-8") as stream:
+        reader = threading.Thread(target=read_commands, args=(stream, cq), kwargs={"block_size": 16})
+        reader.start()
+        os.write(w, "<hello><savedir,/données/".encode("utf-8"))
+        assert cq.get(timeout=2) == "hello"  # handled before the rest of the input arrives
+        time.sleep(0.01)
+        os.write(w, "run1>".encode("utf-8"))
+        assert cq.get(timeout=2) == "savedir,/données/run1"
+        os.close(w)
+        reader.join(2)
+    assert not reader.is_alive()
@@ -0,0 +1,17 @@
+import numpy as np
+import pytest
+
+from rap_wells import well_grid, well_region
+
+
+@pytest.mark.parametrize("wells, expected", [(24, (4, 6)), (1, (1, 1)), (6, (2, 3)), (4, (2, 2))])
+def test_well_grid(wells, expected):
+    assert well_grid(wells) == expected
+
+
+def test_well_regions_tile_the_frame():
+    covered = np.zeros((624, 816), dtype=int)
+    for w in range(24):
+        y0, y1, x0, x1 = well_region(w, 24, 816, 624)
+        covered[y0:y1, x0:x1] += 1
+    assert np.all(covered == 1)
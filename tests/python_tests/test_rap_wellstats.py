@@ -0,0 +1,60 @@
+import numpy as np
+import pytest
+
+from rap_wellstats import WellStats
+
+
+def frame(values, shape=(4, 8, 1)):
+    image = np.zeros(shape, dtype=np.uint8)
+    image.reshape(-1)[:len(values)] = values
+    return image
+
+
+def test_report_per_well_from_the_histograms():
+    stats = WellStats(3, step=1, bins=4)
+    stats.observe(frame([255] * 8 + [100] * 8), 0)  # 32 pixels: 16 at 0, 8 at 100, 8 saturated
+    stats.observe(np.full((4, 8, 1), 64, np.uint8), 1)
+    stats.observe(np.full((4, 8, 1), 128, np.uint8), 1)
+    report = stats.report()
+    assert report["frames"] == [1, 2, 0]
+    assert report["mean"] == [pytest.approx((8 * 255 + 8 * 100) / 32, abs=0.05), 96.0, None]
+    assert report["min"] == [0, 64, None] and report["max"] == [255, 128, None]
+    assert report["saturated"] == [0.25, 0.0, None]
+    assert report["hist"][0] == [500, 250, 0, 250]  # per mille in 4 bins of 64 levels
+    assert report["hist"][1] == [0, 500, 500, 0]
+    # a report starts a new interval
+    assert stats.report()["frames"] == [0, 0, 0]
+
+
+def test_subsampling_decimation_and_well_count():
+    stats = WellStats(2, step=2, every=2)
+    image = np.zeros((4, 4, 1), np.uint8)
+    image[1::2, :] = 200  # odd rows are skipped at step 2
+    assert stats.observe(image, 0)
+    assert not stats.observe(image, 0)  # every 2nd frame of a well
+    assert stats.observe(image, 1)
+    assert not stats.observe(image, 5)  # unknown well
+    report = stats.report()
+    assert report["frames"] == [1, 1] and report["max"] == [0, 0]
+    stats.set_wells(4)
+    assert stats.report()["wells"] == 4
+    with pytest.raises(ValueError):
+        WellStats(2, bins=10)
+
+
+def test_frames_are_counted_without_allocating():
+    import tracemalloc
+    stats = WellStats(2)
+    image = np.random.default_rng(1).integers(0, 256, (624, 816, 1), dtype=np.uint8)
+    stats.observe(image, 0)  # allocates the sample buffer once
+    tracemalloc.start()
+    try:
+        for _ in range(5):
+            stats.observe(image, 1)
+        peak = tracemalloc.get_traced_memory()[1]
+    finally:
+        tracemalloc.stop()
+    assert peak < 32 * 1024  # a per-frame histogram or index array would be ~1 MB
+    assert stats.report()["frames"] == [1, 5]
+    assert stats.observe(np.full((4, 4), 300, np.uint16), 0)
+    assert stats.report()["max"][0] == 300 % 256  # wraps like a uint8 cast
@@ -0,0 +1,129 @@
+import threading
+import time
+
+import numpy as np
+import pytest
+
+from rap_writer import WriterPool
+
+pytestmark = pytest.mark.usefixtures("real_threads")
+
+
+class SlowWrite:
+    """Records writes; writes of even targets take longer so completions come back out of order."""
+    def __init__(self, delay=0.0):
+        self.delay = delay
+        self.written = []
+        self.lock = threading.Lock()
+
+    def __call__(self, target, image):
+        if self.delay and target % 2 == 0:
+            time.sleep(self.delay)
+        with self.lock:
+            self.written.append(target)
+        return True
+
+
+class Releasable:
+    def __init__(self):
+        self.released = 0
+
+    def release(self):
+        self.released += 1
+
+
+def test_writes_everything_and_flushes():
+    write = SlowWrite(delay=0.005)
+    pool = WriterPool(write, workers=3, max_queued=4)
+    for i in range(20):
+        assert pool.submit(i, np.zeros(10, dtype=np.uint8)) == i
+    assert pool.flush(timeout=5)
+    assert sorted(write.written) == list(range(20))
+    assert pool.completed == pool.submitted == 20
+    assert pool.completed_through == 19
+    assert pool.pending == 0
+    pool.close()
+
+
+def test_completed_through_only_advances_over_contiguous_completions():
+    gate = threading.Event()
+
+    def write(target, image):
+        if target == 0:
+            gate.wait(2)
+        return True
+
+    pool = WriterPool(write, workers=2, max_queued=8)
+    for i in range(4):
+        pool.submit(i, None)
+    deadline = time.time() + 2
+    while pool.completed < 3 and time.time() < deadline:
+        time.sleep(0.005)
+    assert pool.completed == 3
+    assert pool.completed_through == -1  # frame 0 is still being written
+    assert not pool.flush(timeout=0.01)
+    gate.set()
+    assert pool.flush(timeout=2)
+    assert pool.completed_through == 3
+    pool.close()
+
+
+def test_failures_are_counted_and_frames_released():
+    def write(target, image):
+        if target == "bad":
+            return False
+        if target == "boom":
+            raise OSError("disk gone")
+        return True
+
+    pool = WriterPool(write, workers=1)
+    frames = [Releasable() for _ in range(3)]
+    for target, frame in zip(("ok", "bad", "boom"), frames):
+        pool.submit(target, np.zeros(4, dtype=np.uint8), frame)
+    assert pool.flush(timeout=2)
+    assert pool.failed == 2
+    assert [f.released for f in frames] == [1, 1, 1]
+    summary = pool.summary()
+    assert summary["writers"][0]["frames"] == 1
+    assert summary["writers"][0]["errors"] == 2
+    pool.close()
+
+
+def test_per_writer_stats():
+    pool = WriterPool(SlowWrite(), workers=2, name="w")
+    for i in range(10):
+        pool.submit(i, np.zeros(1000, dtype=np.uint8))
+    pool.close(timeout=2)
+    summary = pool.summary()
+    assert [w["name"] for w in summary["writers"]] == ["w-0", "w-1"]
+    assert sum(w["frames"] for w in summary["writers"]) == 10
+    assert sum(w["bytes"] for w in summary["writers"]) == 10000
+    assert summary["submitted"] == summary["completed"] == 10
+
+
+def test_submit_blocks_when_queue_is_full():
+    gate = threading.Event()
+    pool = WriterPool(lambda t, i: gate.wait(2), workers=1, max_queued=1)
+    pool.submit(0, None)  # taken by the worker
+    pool.submit(1, None)  # fills the queue
+    submitted = threading.Event()
+    t = threading.Thread(target=lambda: (pool.submit(2, None), submitted.set()))
+    t.start()
+    assert not submitted.wait(0.05)
+    gate.set()
+    assert submitted.wait(2)
+    t.join()
+    assert pool.close(timeout=2)
+
+
+def test_on_written_sees_each_frame_before_release():
+    seen = []
+    frames = [Releasable() for _ in range(3)]
+    pool = WriterPool(lambda target, image: target != "bad", workers=2,
+                      on_written=lambda frame, image, ok: seen.append((frame.released, ok)))
+    for i, f in enumerate(frames):
+        pool.submit("bad" if i == 1 else "ok", np.zeros(4, np.uint8), f)
+    pool.close(2)
+    assert sorted(seen) == [(0, False), (0, True), (0, True)]
+    assert all(f.released == 1 for f in frames)
+
@@ -12,6 +12,7 @@ from vmbpy import *
 import types
 from queue import Queue
 import time
+import numpy as np
 import queue
 
 # ——— Shared Dummy Classes ——— #
@@ -41,12 +42,13 @@ class DummyCV2Show(DummyCV2):
         self.shown.append((title, img))
 
 class FakeStdin:
-    def __init__(self, data):
-        self.data = list(data)
+    """Text stream without a file descriptor; each read returns the next block ('' at the end)."""
+    def __init__(self, *blocks):
+        self.blocks = list(blocks)
     def read(self, n):
-        if self.data:
-            return self.data.pop(0)
-        raise EOFError
+        if self.blocks:
+            return self.blocks.pop(0)
+        return ""
 
 class DummyCam:
     pass
@@ -77,6 +79,9 @@ class DummyFrameIncomplete:
     def get_status(self):
         return FrameStatus.Incomplete
 
+RAW_IMAGE = np.full((4, 6, 1), 7, dtype=np.uint8)
+CONVERTED_IMAGE = np.full((4, 6, 1), 9, dtype=np.uint8)
+
 class DummyFrameDirect:
     """A Complete frame already in the opencv_display_format."""
     def __init__(self):
@@ -93,7 +98,13 @@ class DummyFrameDirect:
         raise AssertionError("convert_pixel_format should not be used for direct format")
 
     def as_opencv_image(self):
-        return "raw_image"
+        return RAW_IMAGE
+
+    def get_id(self):
+        return 41
+
+    def get_timestamp(self):
+        return 123456
 
 class DummyFrameConvert:
     def __init__(self, converted):
@@ -112,7 +123,13 @@ class DummyFrameConvert:
         return self._converted
 
     def as_opencv_image(self):
-        return "converted_image"
+        return CONVERTED_IMAGE
+
+    def get_id(self):
+        return 42
+
+    def get_timestamp(self):
+        return 654321
 
 
 class DummyCamQueue:
@@ -507,21 +524,96 @@ def test_setup_pixel_format_no_compatible(monkeypatch, caplog, capsys):
 
 # --class handler tests-- #
 
-def test_handler_skips_incomplete_frame():
-    """
-    If frame.get_status() != Complete, Handler should do nothing:    no increment of frnum, no queue put, no cam.queue_frame().    """
+def test_handler_skips_incomplete_frame():
+    """
+    If frame.get_status() != Complete, Handler should not show or save it:    no increment of frnum, no queue put, but the buffer still goes back to the camera.    """
+    handler = Handler(cv2=None)
+    cam = DummyCamQueue()
+    frame = DummyFrameIncomplete()
+
+    handler(cam, None, frame)
+
+    # frnum stays at 0
+    assert handler.frnum == 0
+    # nothing was queued for display
+    assert handler.display_queue.empty()
+    # the buffer was recycled, so the stream does not run out of buffers
+    assert cam.queued == [frame]
+    assert handler.statuses == {"Incomplete": 1}
+    assert handler.starved() == 1
+
+def test_handler_requeues_when_the_put_fails_and_counts_refused_buffers(monkeypatch):
+    handler = Handler(cv2=None)
+    cam = DummyCamQueue()
+    frame = DummyFrameDirect()
+    def put(*args, **kwargs):
+        raise ValueError("frame shape does not match ring slots")
+    monkeypatch.setattr(handler.display_queue, "put", put)
+    with pytest.raises(ValueError):
+        handler(cam, None, frame)
+    assert cam.queued == [frame]
+
+    class StoppedCam:
+        def queue_frame(self, frame):
+            raise RuntimeError("not streaming")
+    handler(StoppedCam(), None, DummyFrameIncomplete())
+    assert handler.requeue_failed == 1
+
+class DummyFrameMono12(DummyFrameDirect):
+    """A Complete Mono12 frame: 16 bit pixels that need converting to Mono8."""
+    def get_pixel_format(self):
+        return PixelFormat.Mono12
+
+    def convert_pixel_format(self, fmt):
+        raise AssertionError("the converter threads convert Mono12")
+
+    def as_numpy_ndarray(self):
+        return np.full((4, 6, 1), 0x0A50, dtype=np.uint16)
+
+@pytest.mark.usefixtures("real_threads")
+def test_handler_hands_conversion_to_the_converter_threads():
+    handler = Handler(cv2=None)
+    assert not handler.start_converting(vimba_rap3.opencv_display_format, 2)
+    assert handler.start_converting(PixelFormat.Mono12, 2)
+    cam = DummyCamQueue()
+    frame = DummyFrameMono12()
+    handler(cam, None, frame)
+    assert cam.queued == [frame]  # re-queued right after the copy
+    out, cnum = handler.get_image()
+    handler.stop_converting()
+    assert (out.num, out.frame_id, cnum) == (1, 41, 1)
+    assert out.image.dtype == np.uint8 and (out.image == 0xA5).all()
+    assert handler.converter is None
+
+def test_handler_get_image_without_blocking():
+    from queue import Empty
+    handler = Handler(cv2=None)
+    with pytest.raises(Empty):
+        handler.get_image(False)
+    handler(DummyCamQueue(), None, DummyFrameDirect())
+    frame, cnum = handler.get_image(False)
+    assert (frame.num, cnum) == (1, 1)
+
+def test_handler_counts_frames_for_telemetry(monkeypatch):
+    from rap_metrics import Metrics
+    monkeypatch.setattr(vimba_rap3, "metrics", Metrics())
     handler = Handler(cv2=None)
+    handler(DummyCamQueue(), None, DummyFrameIncomplete())
+    handler(DummyCamQueue(), None, DummyFrameDirect())
+    assert vimba_rap3.metrics.counters == {"frames_received": 2, "frames_incomplete": 1}
+
+def test_handler_drops_frames_when_the_ring_is_full(monkeypatch):
+    from rap_metrics import Metrics
+    monkeypatch.setattr(vimba_rap3, "metrics", Metrics())
+    handler = Handler(cv2=None, capacity_bytes=1)  # two slots
     cam = DummyCamQueue()
-    frame = DummyFrameIncomplete()
-
-    handler(cam, None, frame)
-
-    # frnum stays at 0
-    assert handler.frnum == 0
-    # nothing was queued for display
-    assert handler.display_queue.empty()
-    # camera never re-queued the frame
-    assert cam.queued == []
+    frames = [DummyFrameDirect() for _ in range(3)]
+    for frame in frames:
+        handler(cam, None, frame)  # never blocks on the full ring
+    assert cam.queued == frames
+    assert handler.dropped == 1
+    assert handler.display_queue.qsize() == 2
+    assert vimba_rap3.metrics.counters["admission_frames_dropped"] == 1
 
 def test_handler_puts_direct_format():
     """
@@ -535,10 +627,13 @@ def test_handler_puts_direct_format():
     # Handler should have incremented its frame counter
     assert handler.frnum == 1
 
-    (img, queued_fn), num = handler.get_image()
-    assert img == "raw_image"
+    frame_out, num = handler.get_image()
+    img, queued_fn = frame_out.image, frame_out.num
+    assert np.array_equal(img, RAW_IMAGE)
     assert queued_fn == 1
     assert num == 1
+    # the camera FrameID / timestamp travel with the frame for the demux
+    assert (frame_out.frame_id, frame_out.timestamp) == (41, 123456)
 
     # and the original frame object is returned to the camera
     assert cam.queued == [frame]
@@ -558,8 +653,11 @@ def test_handler_converts_format():
     assert handler.frnum == 1
 
     # get_image should yield the converted image
-    (img, queued_fn), num = handler.get_image()
-    assert img == "converted_image"
+    frame_out, num = handler.get_image()
+    img, queued_fn = frame_out.image, frame_out.num
+    assert np.array_equal(img, CONVERTED_IMAGE)
+    # ids come from the original frame, not the converted copy
+    assert frame_out.frame_id == 42
     assert queued_fn == 1
     assert num == 1
 
@@ -575,7 +673,7 @@ def test_handler_prints_queue_full_and_status_message(capsys):
     # stub out display_queue to simulate full() always True
     handler.display_queue = SimpleNamespace(
         full=lambda: True,
-        put=lambda item, block: None
+        put=lambda item, num, block, **camera_ids: None
     )
 
     # Create a frame that is complete and in direct format
@@ -589,6 +687,29 @@ def test_handler_prints_queue_full_and_status_message(capsys):
     assert "queue full" in out
     assert ".py." in out and "acquired with" in out
 
+def test_handler_copies_into_ring_slot():
+    """
+    The queued image is a read-only copy in a preallocated ring slot, recycled on release.    """
+    handler = Handler(cv2=None, capacity_bytes=2 * RAW_IMAGE.nbytes)
+    cam = DummyCamQueue()
+    src = RAW_IMAGE.copy()
+
+    class Frame(DummyFrameDirect):
+        def as_opencv_image(self):
+            return src
+
+    handler(cam, None, Frame())
+    src[:] = 0
+    frame_out, _ = handler.get_image()
+    assert np.array_equal(frame_out.image, RAW_IMAGE)
+    assert not frame_out.image.flags.writeable
+    assert handler.display_queue.maxsize == 2
+
+    handler(cam, None, Frame())
+    assert handler.display_queue.full()
+    frame_out.release()
+    assert not handler.display_queue.full()
+
 # -- parsefile() tests -- #
 def test_parsefile_sets_auto_and_time(tmp_path, stub_dummy_cam_methods, monkeypatch):
     # 1) Write a RAPcommand.txt in a fresh tmp dir
@@ -947,55 +1068,226 @@ def test_process_js_free_mode_savedir_unknown(monkeypatch, caplog, capsys):
     out = capsys.readouterr().out
     assert "command foo not understood" in out
 
+# ——— 7) camera writes go to the camera control worker while streaming ——— #
+def test_process_js_camera_writes_use_camera_control(monkeypatch):
+    submitted = []
+    class FakeControl:
+        def submit(self, key, func, *args, label=None):
+            submitted.append((key, func, args[1:], label))
+    monkeypatch.setattr(vimba_rap3, "camera_control", FakeControl())
+    cam = DummyCam()
+    process_js_command("trigger,1", cam)
+    process_js_command("exposure, 500", cam)
+    process_js_command("gain, 3", cam)
+    process_js_command("fps, 50", cam)
+    process_js_command("free", cam)
+    assert submitted == [
+        ("settings", vimba_rap3.load_camera_settings, (vimba_rap3.defaultTriggerConfigfile,), "trigger"),
+        ("exposure", vimba_rap3.set_exposure, (500.0,), None),
+        ("gain", vimba_rap3.set_gain, (3.0,), None),
+        ("framerate", vimba_rap3.set_framerate, (50.0,), None),
+        ("settings", vimba_rap3.load_camera_settings, (vimba_rap3.defaultFreerunConfigfile,), "freerun"),
+    ]
+
+# ——— 8) settings files go through the settings engine of the streaming camera ——— #
+def test_load_camera_settings_uses_the_settings_engine(monkeypatch):
+    applied = []
+    cam = DummyCam()
+    engine = SimpleNamespace(cam=cam, apply=applied.append, forget=lambda *names: applied.append(names))
+    monkeypatch.setattr(vimba_rap3, "camera_settings", engine)
+    vimba_rap3.load_camera_settings(cam, "trigger.xml")
+    vimba_rap3.settings_changed(cam, "Gain")
+    vimba_rap3.settings_changed(DummyCam(), "ExposureTime")
+    assert applied == ["trigger.xml", ("Gain",)]
+
+# ——— 9) reconfigure: several settings at once ——— #
+def test_process_js_reconfigure(monkeypatch, capsys):
+    applied, windows, live = [], [], []
+    monkeypatch.setattr(vimba_rap3, "apply_camera_changes", lambda cam, changes: applied.append(changes))
+    monkeypatch.setattr(vimba_rap3, "set_windows", windows.append)
+    # before streaming: applied directly
+    process_js_command("reconfigure, trigger=1, fps=50, exposure=5, gain=60, wells=12", DummyCam())
+    assert applied == [{"trigger": True, "framerate": 50.0, "exposure": 20, "gain": 45, "wells": 12}]
+    assert windows == [12]
+    assert "py. reconfigured trigger=True" in capsys.readouterr().out
+    # while streaming: handed to the live session
+    monkeypatch.setattr(vimba_rap3, "live_session", SimpleNamespace(reconfigure=live.append))
+    process_js_command("reconfig,trigger=false", DummyCam())
+    assert live == [{"trigger": False}]
+    process_js_command("reconfigure,binning=2", DummyCam())
+    process_js_command("reconfigure", DummyCam())
+    out = capsys.readouterr().out
+    assert "py. Error - cannot reconfigure binning" in out
+    assert "py. Error - nothing to reconfigure" in out
+    assert len(live) == 1
+
+def test_apply_camera_changes_order(monkeypatch):
+    calls = []
+    monkeypatch.setattr(vimba_rap3, "load_camera_settings", lambda cam, f: calls.append(f))
+    monkeypatch.setattr(vimba_rap3, "set_exposure", lambda cam, v: calls.append("exposure"))
+    monkeypatch.setattr(vimba_rap3, "set_gain", lambda cam, v: calls.append("gain"))
+    monkeypatch.setattr(vimba_rap3, "set_framerate", lambda cam, v: calls.append("framerate"))
+    vimba_rap3.apply_camera_changes(DummyCam(), {"framerate": 50.0, "gain": 1.0, "exposure": 100.0, "trigger": False})
+    assert calls == [vimba_rap3.defaultFreerunConfigfile, "exposure", "gain", "framerate"]
+
+# ——— 10) JSON requests ——— #
+def json_replies(capsys):
+    import json
+    return [json.loads(l[len("py.json "):]) for l in capsys.readouterr().out.splitlines() if l.startswith("py.json ")]
+
+def test_process_js_json_request_before_streaming(monkeypatch, capsys):
+    applied, windows, saves = [], [], []
+    monkeypatch.setattr(vimba_rap3, "apply_camera_changes", lambda cam, changes: applied.append(changes))
+    monkeypatch.setattr(vimba_rap3, "set_windows", windows.append)
+    monkeypatch.setattr(vimba_rap3, "start_save", saves.append)
+    process_js_command('{"v":1,"id":"step1","set":{"trigger":true,"gain":99,"wells":6},"cmds":[["startsave","/tmp/s1"]]}', DummyCam())
+    assert applied == [{"trigger": True, "gain": 45, "wells": 6}]
+    assert windows == [6]
+    assert saves == ["/tmp/s1"]
+    ack, = json_replies(capsys)
+    assert ack == {"v": 1, "id": "step1", "type": "ack", "ok": True,
+                   "applied": {"trigger": True, "gain": 45, "wells": 6}, "queued": {},
+                   "cmds": ["startsave"], "queued_cmds": [], "pending": False}
+
+def test_process_js_json_errors_are_typed(monkeypatch, capsys):
+    applied = []
+    monkeypatch.setattr(vimba_rap3, "apply_camera_changes", lambda cam, changes: applied.append(changes))
+    process_js_command('{"v":1,"id":1,"set":{"gain":"loud"}}', DummyCam())
+    process_js_command('{"v":1,"id":2,"set":{"binning":2}}', DummyCam())
+    process_js_command('{"v":1,"id":3,"cmds":[["jmessage"],["dance"]]}', DummyCam())
+    process_js_command('{"v":3,"id":4,"cmds":[["quit"]]}', DummyCam())
+    errors = [(r["id"], r["error"]["type"]) for r in json_replies(capsys)]
+    assert errors == [(1, "invalid_value"), (2, "invalid_value"), (3, "unknown_command"), (4, "unsupported_version")]
+    assert applied == []
+
+def test_process_js_bad_arguments_are_errors(monkeypatch, capsys):
+    import json
+    calls = []
+    monkeypatch.setattr(vimba_rap3, "camera_call", lambda key, func, cam, *args, label=None: calls.append((key, args)))
+    for command in ("trigger,maybe", "gain", "mode,x", "fps", "exposure,long", "wells,many", "savedir"):
+        assert process_js_command(command, DummyCam()) is False
+    out = capsys.readouterr().out
+    assert "py. Error - true/false argument not parsed" in out
+    assert "py. Error - mode requires a number" in out
+    assert calls == []
+    for i, cmds in enumerate((["trigger", "maybe"], ["gain"], ["mode", "x"])):
+        process_js_command(json.dumps({"v": 1, "id": i, "cmds": [["jmessage"], cmds]}), DummyCam())
+        error, = json_replies(capsys)
+        assert (error["id"], error["ok"], error["error"]["type"]) == (i, False, "invalid_value")
+    assert calls == []
+
+def test_process_js_json_ack_labels_queued_camera_writes(monkeypatch, capsys):
+    from rap_control import CameraControl
+    control = CameraControl(report=None)  # not started: writes stay queued
+    monkeypatch.setattr(vimba_rap3, "camera_control", control)
+    process_js_command('{"v":1,"id":"q","cmds":[["gain","3"],["jmessage"]]}', DummyCam())
+    ack, = json_replies(capsys)
+    assert (ack["applied"], ack["cmds"], ack["queued_cmds"], ack["pending"]) == ({}, ["gain", "jmessage"], ["gain"], False)
+    assert control.pending() == 1
+
+def test_process_js_json_set_while_streaming_acks_then_reports_done(monkeypatch, capsys):
+    from rap_session import LiveSession
+    session = LiveSession(DummyCam(), lambda cam, changes: None, report=None)
+    monkeypatch.setattr(vimba_rap3, "live_session", session)
+    session.frame(41)
+    process_js_command('{"v":1,"id":"s2","set":{"fps":50}}', DummyCam())
+    session.frame(42)
+    ack, done = json_replies(capsys)
+    assert (ack["type"], ack["pending"], ack["applied"], ack["queued"]) == ("ack", True, {}, {"framerate": 50.0})
+    assert done == {"v": 1, "id": "s2", "type": "done", "ok": True, "applied": {"framerate": 50.0},
+                    "affected": 0, "frames": [], "ms": done["ms"]}
+
+def test_process_js_json_bad_cmd_rejects_the_whole_request(monkeypatch, capsys):
+    from rap_session import LiveSession
+    applied, saves = [], []
+    monkeypatch.setattr(vimba_rap3, "apply_camera_changes", lambda cam, changes: applied.append(changes))
+    monkeypatch.setattr(vimba_rap3, "start_save", saves.append)
+    process_js_command('{"v":1,"id":"x","set":{"gain":3},"cmds":[["startsave","/tmp/s"],["exposure","abc"]]}', DummyCam())
+    session = LiveSession(DummyCam(), lambda cam, changes: applied.append(changes), report=None)
+    monkeypatch.setattr(vimba_rap3, "live_session", session)
+    session.frame(1)
+    process_js_command('{"v":1,"id":"y","set":{"gain":3},"cmds":[["dance"]]}', DummyCam())
+    session.frame(2)
+    replies = json_replies(capsys)
+    assert [(r["id"], r["type"], r["error"]["type"]) for r in replies] == [("x", "error", "invalid_value"),
+                                                                         ("y", "error", "unknown_command")]
+    assert replies[0]["error"]["message"].startswith("exposure: ")
+    assert applied == [] and saves == []
+
+def test_process_js_json_camera_faults_are_camera_errors(monkeypatch, capsys):
+    from rap_session import LiveSession
+    def fail(path):
+        raise OSError("disk full")
+    monkeypatch.setattr(vimba_rap3, "start_save", fail)
+    session = LiveSession(DummyCam(), lambda cam, changes: None, report=None)
+    monkeypatch.setattr(vimba_rap3, "live_session", session)
+    session.frame(1)
+    process_js_command('{"v":1,"id":"z","set":{"fps":50},"cmds":[["jmessage"],["startsave","/tmp/s"]]}', DummyCam())
+    session.frame(2)
+    error, = json_replies(capsys)  # no done follows the error
+    assert error["error"] == {"type": "camera_error", "message": "startsave: disk full"}
+    assert (error["queued"], error["cmds"]) == ({"framerate": 50.0}, ["jmessage"])
+
 # -- add_stdin_input() tests -- #
 
 def test_add_stdin_input_single_command(monkeypatch):
     """
-    Input "<hello>" should queue "hello" as one command, and leave the input queue empty.
+    Input "<hello>" should queue "hello" as one command and return at end of input.
     """
     stdin = FakeStdin("<hello>")
     monkeypatch.setattr(sys, "stdin", stdin)
 
-    iq, cq = Queue(), Queue()
-    with pytest.raises(EOFError):
-        add_stdin_input(iq, cq)  # It will raise EOFError once FakeStdin is exhausted
+    cq = Queue()
+    add_stdin_input(cq)  # returns once FakeStdin is exhausted
 
     # The command queue should have exactly one entry "hello"
-    assert cq.get_nowait() == "hello"
-    # The raw input-queue should be empty
-    assert iq.empty()
+    cmd = cq.get_nowait()
+    assert cmd == "hello"
+    # stamped with the time it was read
+    assert 0 < cmd.received <= time.perf_counter()
+    assert cq.empty()
 
 def test_add_stdin_input_partial_no_close(monkeypatch):
     """
-    Input without a closing '>' should never emit a command, but all non-'<' chars go into the input queue.
+    Input without a closing '>' should never emit a command; text outside <...> is discarded.
     """
     stdin = FakeStdin("abc<foo")
     monkeypatch.setattr(sys, "stdin", stdin)
 
-    iq, cq = Queue(), Queue()
-    with pytest.raises(EOFError):
-        add_stdin_input(iq, cq)
+    cq = Queue()
+    add_stdin_input(cq)
 
     # No complete command was emitted
     assert cq.empty()
-    # Every character except the '<' was pushed into iq, and none removed
-    assert list(iq.queue) == ["a", "b", "c", "f", "o", "o"]
+    assert vimba_rap3.stdin_parser.pending
+    assert vimba_rap3.stdin_parser.discarded == 3
 
 def test_add_stdin_input_multiple_commands(monkeypatch):
     """
-    Multiple "<a><b>" sequences should produce two commands "a" and "b", and leave iq empty.
+    Multiple "<a><b>" sequences should produce two commands "a" and "b".
     """
     stdin = FakeStdin("<a><b>")
     monkeypatch.setattr(sys, "stdin", stdin)
 
-    iq, cq = Queue(), Queue()
-    with pytest.raises(EOFError):
-        add_stdin_input(iq, cq)
+    cq = Queue()
+    add_stdin_input(cq)
 
     # We should have seen exactly ["a", "b"] in the command queue
     assert list(cq.queue) == ["a", "b"]
-    # And no leftover characters in the input queue
-    assert iq.empty()
+
+def test_add_stdin_input_commands_split_across_reads():
+    """
+    Blocks end anywhere; a command is only queued once its closing '>' arrives.
+    """
+    stdin = FakeStdin("<wells,2", "4><gain,", "3>\n<quit>")
+    cq = Queue()
+    add_stdin_input(cq, stdin)
+    assert list(cq.queue) == ["wells,24", "gain,3", "quit"]
+
+def test_command_latency_ms():
+    from rap_stdin import Command
+    assert vimba_rap3.command_latency_ms(Command("x", time.perf_counter() - 0.05)) >= 50
+    assert vimba_rap3.command_latency_ms("plain") == -1.0
 
 # -- maybesaveimage() tests -- #
 
@@ -1037,6 +1329,206 @@ def test_maybesaveimage_writes_and_increments_below_max(tmp_path):
     # now savedframes == save_max, so toggle should flip off
     assert vimba_rap3.SAVETOGGLE   == 0
 
+def test_tiff_names_carry_the_well(monkeypatch):
+    calls = []
+    dummy_cv2 = type("CV", (), {"imwrite": lambda self, fn, img: calls.append(fn)})()
+    monkeypatch.setattr(vimba_rap3, "writer", None)
+    monkeypatch.setattr(vimba_rap3, "stack_session", None)
+    monkeypatch.setattr(vimba_rap3, "SAVETOGGLE", 1)
+    monkeypatch.setattr(vimba_rap3, "savedframes", 0)
+    monkeypatch.setattr(vimba_rap3, "save_max", 10)
+    vimba_rap3.maybesaveimage(dummy_cv2, "DATA", 3, well=5)
+    assert calls == ["img000000003_well05.tif"]
+
+class RecordingWriter:
+    def __init__(self):
+        self.submitted = []
+        self.flushes = 0
+    def submit(self, target, image, frame=None):
+        self.submitted.append((target, image, frame))
+    def flush(self, timeout=None):
+        self.flushes += 1
+        return True
+
+class RetainCounter:
+    def __init__(self):
+        self.retains = 0
+    def retain(self):
+        self.retains += 1
+        return self
+
+def test_maybesaveimage_hands_frames_to_background_writer(monkeypatch):
+    """With a writer pool, the frame is retained and submitted instead of written inline."""
+    w = RecordingWriter()
+    monkeypatch.setattr(vimba_rap3, "writer", w)
+    dummy_cv2 = type("CV", (), {"imwrite": lambda self, fn, img: pytest.fail("wrote inline")})()
+    vimba_rap3.SAVETOGGLE = 1
+    vimba_rap3.savedframes = 0
+    vimba_rap3.save_max = 2
+    frame = RetainCounter()
+
+    vimba_rap3.maybesaveimage(dummy_cv2, "DATA", 4, frame)
+    vimba_rap3.maybesaveimage(dummy_cv2, "DATA", 5)
+    assert w.submitted == [("img000000004.tif", "DATA", frame), ("img000000005.tif", "DATA", None)]
+    assert frame.retains == 1
+    # save_max semantics are unchanged
+    assert vimba_rap3.savedframes == 2
+    assert vimba_rap3.SAVETOGGLE == 0
+
+class FlushingWriter:
+    submitted = 1  # flush_writer only flushes when something was submitted
+    def __init__(self):
+        self.flushes = 0
+    def flush(self, timeout=None):
+        self.flushes += 1
+        return True
+    def summary(self):
+        return {"writers": [{"name": "writer-0", "frames": 1, "errors": 0, "fps": 10.0, "mb_per_s": 5.0}]}
+
+def test_stop_and_start_save_flush_the_writer(monkeypatch, capsys):
+    w = FlushingWriter()
+    monkeypatch.setattr(vimba_rap3, "writer", w)
+    monkeypatch.setattr(os, "chdir", lambda p: None)
+    vimba_rap3.stop_save()
+    assert w.flushes == 1
+    assert ".py. writer-0 wrote 1 frames" in capsys.readouterr().out
+    vimba_rap3.start_save("somewhere")
+    assert w.flushes == 2
+
+def test_stack_format_saves_per_well(monkeypatch, tmp_path):
+    from rap_stack import open_stack
+    monkeypatch.setattr(vimba_rap3, "writer", None)
+    monkeypatch.setattr(vimba_rap3, "save_format", "stack")
+    monkeypatch.setattr(vimba_rap3, "number_of_wells", 3)
+    monkeypatch.setattr(vimba_rap3, "save_max", 100)
+    monkeypatch.setattr(os, "chdir", lambda p: None)
+    cv2 = DummyCV2()
+    vimba_rap3.start_save(str(tmp_path))
+    for num in range(7):
+        vimba_rap3.maybesaveimage(cv2, np.full((4, 5, 1), num, dtype=np.uint8), num)
+    vimba_rap3.stop_save()
+    assert vimba_rap3.stack_session is None
+    info, files = open_stack(tmp_path)
+    assert info["frames"] == [3, 2, 2]
+    assert files[0].index()[0].tolist() == [0, 3, 6]
+    assert files[1].read(1)[0, 0] == 4
+    assert not list(tmp_path.glob("*.tif"))
+
+def test_savebuffer_saves_the_history_window_before_the_live_frames(monkeypatch, tmp_path, capsys):
+    from rap_history import WellHistory
+    from rap_stack import open_stack
+    monkeypatch.setattr(vimba_rap3, "writer", None)
+    monkeypatch.setattr(vimba_rap3, "save_format", "stack")
+    monkeypatch.setattr(vimba_rap3, "number_of_wells", 3)
+    monkeypatch.setattr(vimba_rap3, "save_max", 100)
+    monkeypatch.setattr(vimba_rap3, "pretrigger", None)
+    monkeypatch.setattr(os, "chdir", lambda p: None)
+    history = WellHistory(3, 4)
+    for num in range(9):
+        history.append(num % 3, np.full((4, 5, 1), num, dtype=np.uint8), num, timestamp=1 + num * 10**7)
+    monkeypatch.setattr(vimba_rap3, "history", history)
+    monkeypatch.setattr(vimba_rap3, "history_fps", 3.0)  # one frame per well per second
+    vimba_rap3.process_js_command("savebuffer,2,{}".format(tmp_path), None)
+    assert "py. savebuffer 6 frames from the last 2 s" in capsys.readouterr().out
+    assert vimba_rap3.step_pretrigger()  # a couple per loop without background writers
+    assert vimba_rap3.pretrigger.pending() == 4
+    for num in range(9, 12):
+        vimba_rap3.maybesaveimage(DummyCV2(), np.full((4, 5, 1), num, dtype=np.uint8), num)
+    vimba_rap3.stop_save()  # the rest of the backlog is written first
+    assert vimba_rap3.pretrigger is None
+    info, files = open_stack(tmp_path)
+    assert info["frames"] == [3, 3, 3]
+    assert files[0].index()[0].tolist() == [3, 6, 9]
+    assert files[2].read(0)[0, 0] == 5
+    assert not history._pins.any()  # every slot released once written
+
+def test_savebuffer_needs_seconds_and_a_history(monkeypatch, capsys):
+    monkeypatch.setattr(vimba_rap3, "history", None)
+    vimba_rap3.process_js_command("savebuffer,soon", None)
+    assert "savebuffer requires the seconds" in capsys.readouterr().out
+    vimba_rap3.process_js_command("savebuffer,2", None)
+    assert "savebuffer needs the frame history" in capsys.readouterr().out
+    assert vimba_rap3.SAVETOGGLE == 0
+
+def test_format_command_and_option(monkeypatch, capsys):
+    monkeypatch.setattr(vimba_rap3, "save_format", "tiff")
+    vimba_rap3.process_js_command("saveformat,stack", None)
+    assert vimba_rap3.save_format == "stack"
+    vimba_rap3.process_js_command("saveformat,png", None)
+    assert vimba_rap3.save_format == "stack"
+    assert "format must be tiff or stack" in capsys.readouterr().out
+    vimba_rap3.parse_option("--format=tiff")
+    assert vimba_rap3.save_format == "tiff"
+
+def test_buffers_option(monkeypatch):
+    for name in ("buffer_count", "buffer_auto", "buffer_max"):
+        monkeypatch.setattr(vimba_rap3, name, getattr(vimba_rap3, name))
+    vimba_rap3.parse_option("--buffers=24")
+    assert (vimba_rap3.buffer_count, vimba_rap3.buffer_auto) == (24, 0)
+    vimba_rap3.parse_option("--buffers=auto")
+    vimba_rap3.parse_option("--buffers-max=128")
+    assert (vimba_rap3.buffer_count, vimba_rap3.buffer_auto, vimba_rap3.buffer_max) == (24, 1, 128)
+    with pytest.raises(SystemExit):
+        vimba_rap3.parse_option("--buffers=0")
+
+def test_history_option(monkeypatch):
+    monkeypatch.setattr(vimba_rap3, "history_setting", "0")
+    vimba_rap3.parse_option("--history=2s")
+    assert vimba_rap3.history_setting == "2s"
+    vimba_rap3.parse_option("--history=30")
+    assert vimba_rap3.history_setting == "30"
+    with pytest.raises(SystemExit):
+        vimba_rap3.parse_option("--history=recent")
+
+def test_well_stats_options(monkeypatch):
+    for name in ("well_stats_interval", "well_stats_step", "well_stats_every"):
+        monkeypatch.setattr(vimba_rap3, name, getattr(vimba_rap3, name))
+    vimba_rap3.parse_option("--well-stats=0.5")
+    vimba_rap3.parse_option("--well-stats-step=4")
+    vimba_rap3.parse_option("--well-stats-every=0")
+    assert (vimba_rap3.well_stats_interval, vimba_rap3.well_stats_step, vimba_rap3.well_stats_every) == (0.5, 4, 1)
+
+def test_profile_command_and_option(monkeypatch, capsys, tmp_path):
+    from rap_profile import LoopProfiler
+    profiler = LoopProfiler(directory=str(tmp_path))
+    monkeypatch.setattr(vimba_rap3, "profiler", profiler)
+    vimba_rap3.process_js_command("profile,on", None)
+    assert profiler.enabled
+    profiler.begin()
+    profiler.lap("get_image")
+    vimba_rap3.process_js_command("profile,dump", None)
+    assert profiler.enabled
+    vimba_rap3.process_js_command("profile,off", None)
+    assert not profiler.enabled
+    vimba_rap3.process_js_command("profile,off", None)
+    vimba_rap3.process_js_command("profile,maybe", None)
+    out = capsys.readouterr().out
+    assert "py. profiling on" in out
+    assert out.count("py. profile get_image mean") == 2
+    assert "py. profiling is off" in out
+    assert "profile requires on, cprofile, dump or off" in out
+    monkeypatch.setattr(vimba_rap3, "profile_at_start", "")
+    vimba_rap3.parse_option("--profile")
+    assert vimba_rap3.profile_at_start == "on"
+    vimba_rap3.parse_option("--profile=cprofile")
+    assert vimba_rap3.profile_at_start == "cprofile"
+    with pytest.raises(SystemExit):
+        vimba_rap3.parse_option("--profile=always")
+
+def test_phaselock_command_and_option(monkeypatch, capsys):
+    monkeypatch.setattr(vimba_rap3, "phase_lock_enabled", 1)
+    vimba_rap3.process_js_command("phaselock,0", None)
+    assert vimba_rap3.phase_lock_enabled == 0
+    vimba_rap3.process_js_command("phaselock,maybe", None)
+    assert vimba_rap3.phase_lock_enabled == 0
+    assert "requires a 0/1 argument" in capsys.readouterr().out
+    vimba_rap3.parse_option("--phase-lock=1")
+    assert vimba_rap3.phase_lock_enabled == 1
+    vimba_rap3.parse_option("--format=tiff")
+    assert vimba_rap3.save_format == "tiff"
+    with pytest.raises(SystemExit):
+        vimba_rap3.parse_option("--format=png")
+
 # -- setupdisplaywindows() tests -- #
 
 def test_setupdisplaywindows_24_grid():
@@ -1120,6 +1612,63 @@ def test_maybeshowimage_wraps_and_displays_correct_window(num, n_wells, expected
     # should have exactly one imshow call with title Win{expected_idx}
     assert cv2.shown == [(f"Win{expected_idx}", "FRAME")]
 
+def test_maybeshowimage_uses_demuxed_well():
+    cv2 = DummyCV2Show()
+    vimba_rap3.windowtitle = "Win{}"
+    vimba_rap3.maybeshowimage(cv2, display="FRAME", num=5, number_of_wells=4, well=3)
+    assert cv2.shown == [("Win3", "FRAME")]
+
+# -- show_frames() (display thread) tests -- #
+
+@pytest.fixture
+def display_globals(monkeypatch):
+    for name in ("mode", "number_of_wells", "mosaic", "display_wells", "windowtitle", "preview", "preview_enabled"):
+        monkeypatch.setattr(vimba_rap3, name, getattr(vimba_rap3, name))
+    vimba_rap3.mosaic = None
+    vimba_rap3.display_wells = None
+    vimba_rap3.preview = None
+    vimba_rap3.preview_enabled = 0
+    vimba_rap3.windowtitle = "Win{}"
+
+def test_show_frames_sets_up_windows_when_wells_change(display_globals):
+    cv2 = DummyCV2Show()
+    vimba_rap3.mode = 1
+    vimba_rap3.number_of_wells = 2
+    frames = [SimpleNamespace(image="A", num=4, well=1, received=0.0), SimpleNamespace(image="B", num=5, well=0, received=0.0)]
+    vimba_rap3.show_frames(cv2, frames)
+    assert [t for t, _ in cv2.named_calls] == ["Win0", "Win1"]
+    assert cv2.shown == [("Win1", "A"), ("Win0", "B")]
+    vimba_rap3.show_frames(cv2, frames)
+    assert len(cv2.named_calls) == 2  # no new windows while the well count is unchanged
+    vimba_rap3.number_of_wells = 3
+    vimba_rap3.show_frames(cv2, [])
+    assert len(cv2.named_calls) == 5
+
+def test_show_frames_mode_2_draws_into_the_mosaic(display_globals):
+    class MosaicCV2(DummyCV2Show):
+        INTER_AREA = 3
+        def resize(self, image, size, dst=None, interpolation=None):
+            dst[...] = image[0, 0, 0]
+    cv2 = MosaicCV2()
+    vimba_rap3.mode = 2
+    vimba_rap3.number_of_wells = 4
+    vimba_rap3.show_frames(cv2, [SimpleNamespace(image=np.full((4, 6, 1), 5, np.uint8), num=1, well=2, received=0.0)])
+    assert vimba_rap3.mosaic is not None
+    assert np.all(vimba_rap3.mosaic.tiles[2] == 5)
+    assert [t for t, _ in cv2.shown] == [vimba_rap3.mosaic.title]
+
+def test_show_frames_shows_binned_previews(display_globals):
+    cv2 = DummyCV2Show()
+    vimba_rap3.mode = 0
+    vimba_rap3.number_of_wells = 2
+    vimba_rap3.preview_enabled = 1
+    full = np.full((624, 816, 1), 90, np.uint8)
+    vimba_rap3.show_frames(cv2, [SimpleNamespace(image=full, num=3, well=1, received=0.0)])
+    (title, shown), = cv2.shown
+    assert title == "Win1"
+    assert shown.shape == (208, 256, 1)
+    assert np.all(shown == 90)
+
 # -- main() tests --#
 
 
@@ -1210,8 +1759,13 @@ def _install_common_stubs(monkeypatch, tmp_path, calls):
 
     # 5) Handler → fake handler whose get_image returns a dummy image
     class FakeHandler:
-        def __init__(self, cv2obj):
+        statuses, queue_full, dropped, requeue_failed = {}, 0, 0, 0
+        def __init__(self, cv2obj, capacity_bytes=None):
             calls.append("handler_ctor")
+        def start_converting(self, pixel_format, workers, capacity_bytes=None):
+            return False
+        def stop_converting(self):
+            pass
         def get_image(self):
             # return ((display, rnum), cnum)
             return (("IMG", 1), 1)
@@ -1219,9 +1773,9 @@ def _install_common_stubs(monkeypatch, tmp_path, calls):
 
     # 6) Display / saving stubs
     monkeypatch.setattr(vimba_rap3, "maybesaveimage",
-                        lambda cv2, img, num: calls.append(f"maybesave:{num}"))
+                        lambda cv2, img, num, frame=None, well=None: calls.append(f"maybesave:{num}"))
     monkeypatch.setattr(vimba_rap3, "maybeshowimage",
-                        lambda cv2, img, num: calls.append(f"maybeshow:{num}"))
+                        lambda cv2, img, num, wells, well=None: calls.append(f"maybeshow:{num}"))
     monkeypatch.setattr(vimba_rap3, "checkkeypress",
                         lambda cv2, cnum: 1)  # force exit immediately
 
@@ -1246,6 +1800,7 @@ def test_streaming_loop_runs_one_round_and_exits(monkeypatch, tmp_path):
     class FakeCam:
         def __enter__(self): return self
         def __exit__(self, *args): return False
+        def get_pixel_format(self): return vimba_rap3.opencv_display_format
         def start_streaming(self, handler, buffer_count):
             calls.append(f"start_streaming:{buffer_count}")
             raise SystemExit(99)
@@ -1276,6 +1831,7 @@ def test_streaming_loop_skips_waitloop_if_first_command_is_start(monkeypatch, tm
     class FakeCam2:
         def __enter__(self): return self
         def __exit__(self, *args): return False
+        def get_pixel_format(self): return vimba_rap3.opencv_display_format
         def start_streaming(self, handler, buffer_count):
             calls.append("start_streaming_immediate")
             # immediately break
@@ -1295,3 +1851,71 @@ def test_streaming_loop_skips_waitloop_if_first_command_is_start(monkeypatch, tm
     assert not any(c.startswith("process_js:") for c in calls)
     assert "start_streaming_immediate" in calls
     assert "stoped" in calls
+
+def test_history_is_capped_to_leave_the_ring_its_share_of_the_budget(monkeypatch, tmp_path, caplog):
+    calls, rings = [], []
+    _install_common_stubs(monkeypatch, tmp_path, calls)
+    monkeypatch.setattr(vimba_rap3, "parse_args", lambda: (2, 24, 0))
+    monkeypatch.setattr(vimba_rap3, "Handler", lambda cv2obj, capacity_bytes=None: rings.append(capacity_bytes) or sys.exit(5))
+    monkeypatch.setattr(vimba_rap3, "frame_bytes", lambda cam: 816 * 624)
+    monkeypatch.setattr(vimba_rap3, "camera_fps", lambda cam: 100.0)
+    monkeypatch.setattr(vimba_rap3, "history_setting", "30")  # 24 x 30 frames = 350 MiB
+    monkeypatch.setattr(vimba_rap3, "memory_budget_mb", 320)
+    monkeypatch.setattr(vimba_rap3, "history", None)
+    while not vimba_rap3.stdin_command_queue.empty():
+        vimba_rap3.stdin_command_queue.get()
+    vimba_rap3.stdin_command_queue.put("startcamera")
+
+    class FakeCam3:
+        def __enter__(self): return self
+        def __exit__(self, *args): return False
+        def get_pixel_format(self): return vimba_rap3.opencv_display_format
+    monkeypatch.setattr(vimba_rap3.VmbSystem, "get_instance", classmethod(lambda cls: FakeCam3()))
+    monkeypatch.setattr(vimba_rap3, "get_camera", lambda cid: FakeCam3())
+
+    with caplog.at_level(logging.WARNING), pytest.raises(SystemExit):
+        vimba_rap3.main()
+    history = vimba_rap3.history
+    assert history.requested == 13  # half of the budget
+    assert history.capacity_bytes <= vimba_rap3.HISTORY_SHARE * 320 * 2**20
+    assert rings[0] >= vimba_rap3.RING_MIN_FRAMES * 816 * 624
+    assert "history of 30 frames per well needs 350 MB" in caplog.text
+
+# -- command line options / simulated camera -- #
+
+@pytest.fixture
+def reset_sim_globals(monkeypatch):
+    for name in ("simulate_camera", "sim_fps", "sim_wells", "sim_incomplete", "sim_drop",
+                 "savedirectory", "defaultSaveRootDirectory", "defaultCameraConfigDirectory",
+                 "defaultFreerunConfigfile", "defaultTriggerConfigfile"):
+        monkeypatch.setattr(vimba_rap3, name, getattr(vimba_rap3, name))
+    yield
+
+def test_parse_args_sim_options_are_not_positional(monkeypatch, reset_sim_globals):
+    monkeypatch.setattr(sys, "argv", ["script", "--sim=250", "2", "--sim-drop=0.1", "6"])
+    assert parse_args() == (2, 6, 0)
+    assert vimba_rap3.simulate_camera == 1
+    assert vimba_rap3.sim_fps == 250.0
+    assert vimba_rap3.sim_drop == 0.1
+
+def test_parse_args_dirs(monkeypatch, reset_sim_globals):
+    monkeypatch.setattr(sys, "argv", ["script", "--savedir=/data/x", "--configdir=/cfg"])
+    assert parse_args() == (1, 1, 1)
+    assert vimba_rap3.savedirectory == "/data/x"
+    assert vimba_rap3.defaultTriggerConfigfile == "/cfg/trigger.xml"
+    assert vimba_rap3.defaultFreerunConfigfile == "/cfg/freerun.xml"
+
+@pytest.mark.parametrize("arg", ["--nope", "--sim=fast"])
+def test_parse_args_bad_option_aborts(monkeypatch, capsys, reset_sim_globals, arg):
+    monkeypatch.setattr(sys, "argv", ["script", arg])
+    with pytest.raises(SystemExit) as exc:
+        parse_args()
+    assert exc.value.code == 2
+    assert "Usage:" in capsys.readouterr().out
+
+def test_get_camera_returns_sim_camera(monkeypatch, reset_sim_globals):
+    monkeypatch.setattr(vimba_rap3, "simulate_camera", 1)
+    monkeypatch.setattr(vimba_rap3, "sim_wells", 6)
+    cam = get_camera(None)
+    assert isinstance(cam, SimCamera)
+    assert cam.wells == 6